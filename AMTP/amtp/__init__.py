@@ -1,10 +1,7 @@
-from python_ping import ping
+from .icmp import ICMP
 
 class Pinger(object):
     pass
 
-class ICMP(Pinger):
-    pass
-
 class HTTP(Pinger):
     pass
@@ -0,0 +1,559 @@
+"""
+asyncio engine for the probe requests of the HTTP pinger
+
+HTTPPinger(engine='asyncio') sends the probe requests of all pings on an
+asyncio event loop (uvloop's when it is installed) before the items are filled
+in, instead of from the greenlet of every ping. The requests go through a small
+HTTP/1.1 client of our own with keep-alive connections per (scheme, host,
+port). It does not rely on geventhttpclient internals. Every request is an
+amtp.probe.Attempt, like those of the gevent engine, and the limits are the
+same, so both engines give the same results for a TBMON document.
+
+Python 3.7+ only, imported by HTTPPinger when the engine is selected.
+"""
+import asyncio
+import socket
+import ssl
+from contextlib import asynccontextmanager
+from time import monotonic as clock
+
+from .dns import family, is_ip, normalize
+from .pool import HostPool, MAX_CONNECTIONS, HOST_CONNECTIONS, DRAIN_BYTES
+from .matcher import BLOCK_SIZE
+from .probe import Attempt, Engine, new_probe
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# pings probed at the same time, as many as HTTPPinger runs greenlets for
+CONCURRENCY = 500
+USER_AGENT = 'amtp'
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class HTTPError(ValueError):
+    """
+    Raised for a malformed response or a connection closed without one
+    """
+
+
+def new_event_loop():
+    """
+    Returns a uvloop event loop if uvloop is installed, a default one otherwise
+    """
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+class Response(object):
+    """
+    Status line and headers of a response, the body is read with read()
+    """
+    def __init__(self, connection, status_code, headers, length, chunked, keep_alive):
+        """
+        :headers - dictionary of lower case field name to list of values
+        :length - Content-Length of the body, None to read until closed
+        """
+        self.connection = connection
+        self.status_code = status_code
+        self.headers = headers
+        self.remaining = length
+        self.chunked = chunked
+        self.chunk = 0
+        self.keep_alive = keep_alive and (chunked or length is not None)
+        self.message_complete = not chunked and length == 0
+
+    async def read(self, size=BLOCK_SIZE):
+        """
+        Returns up to size bytes of the body, b'' at its end
+        """
+        if self.message_complete:
+            return b''
+        reader = self.connection.reader
+        if self.chunked:
+            if not self.chunk:
+                line = await _readline(reader)
+                try:
+                    self.chunk = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise HTTPError('invalid chunk size {!r}'.format(line))
+                if not self.chunk:
+                    # the trailer ends with an empty line
+                    while (await _readline(reader)).strip():
+                        pass
+                    self.message_complete = True
+                    return b''
+            data = await reader.read(min(size, self.chunk))
+            if not data:
+                raise HTTPError('connection closed in the body')
+            self.chunk -= len(data)
+            if not self.chunk:
+                await reader.readexactly(2)
+            return data
+        if self.remaining is None:
+            data = await reader.read(size)
+            if not data:
+                self.message_complete = True
+            return data
+        data = await reader.read(min(size, self.remaining))
+        if not data:
+            raise HTTPError('connection closed in the body')
+        self.remaining -= len(data)
+        self.message_complete = not self.remaining
+        return data
+
+
+class _Connection(object):
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+
+    def close(self):
+        self.writer.close()
+
+
+async def _readline(reader):
+    """
+    StreamReader.readline raising HTTPError for a line over the limit of the
+    reader (64 KiB), like a huge header
+    """
+    try:
+        return await reader.readline()
+    except ValueError:
+        # what readline makes of a LimitOverrunError
+        raise HTTPError('line too long')
+
+
+async def _read_head(connection, method):
+    """
+    Reads the status line and headers of a response, returns a Response
+    """
+    reader = connection.reader
+    line = await _readline(reader)
+    if not line:
+        raise HTTPError('connection closed without a response')
+    try:
+        version, status = line.split(None, 2)[:2]
+        status_code = int(status)
+    except ValueError:
+        raise HTTPError('invalid status line {!r}'.format(line))
+    headers = {}
+    while True:
+        line = await _readline(reader)
+        if not line:
+            raise HTTPError('connection closed in the headers')
+        if not line.strip():
+            break
+        field, sep, value = line.decode('latin1').partition(':')
+        if not sep:
+            raise HTTPError('invalid header {!r}'.format(line))
+        headers.setdefault(field.strip().lower(), []).append(value.strip())
+
+    tokens = ','.join(headers.get('connection', [])).lower()
+    if version == b'HTTP/1.1':
+        keep_alive = 'close' not in tokens
+    else:
+        keep_alive = 'keep-alive' in tokens
+    chunked = 'chunked' in ','.join(headers.get('transfer-encoding', [])).lower()
+    length = None
+    if method == 'HEAD' or status_code in (204, 304) or 100 <= status_code < 200:
+        length = 0
+    elif not chunked and 'content-length' in headers:
+        try:
+            length = int(headers['content-length'][0])
+        except ValueError:
+            raise HTTPError('invalid Content-Length')
+    return Response(connection, status_code, headers, length, chunked, keep_alive)
+
+
+class Client(object):
+    """
+    Sends the requests of a HostPool.connection block, the counterpart of the
+    geventhttpclient client the gevent engine hands out
+    """
+    def __init__(self, pool, url, phases):
+        self.pool = pool
+        self.url = url
+        self.phases = phases
+        self.connection = None
+        self.response = None
+
+    async def request(self, method, uri, headers=None):
+        """
+        Sends a request and returns its Response once the headers are read.
+        The connection of a previous request is released first, so the
+        response to that must have been read
+        """
+        self.release()
+        self.response = None
+        host = self.url.host
+        port = self.url.port or DEFAULT_PORTS.get(self.url.scheme, 80)
+        if port != DEFAULT_PORTS.get(self.url.scheme):
+            host = '{}:{}'.format(host, port)
+        head = '{} {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\n{}\r\n'.format(
+                method, uri, host, USER_AGENT, ''.join('{}: {}\r\n'.format(field, value)
+                for field, value in (headers or {}).items())).encode('latin1')
+        while True:
+            connection = self.pool._checkout(self.url)
+            if connection is None:
+                connection = await self.pool._connect(self.url, self.phases)
+            self.connection = connection
+            try:
+                connection.writer.write(head)
+                await connection.writer.drain()
+                self.response = await _read_head(connection, method)
+                return self.response
+            except (HTTPError, OSError, asyncio.IncompleteReadError):
+                self.connection = None
+                connection.close()
+                # the server may have closed an idle connection meanwhile
+                if not connection.reused:
+                    raise
+
+    async def get(self, uri):
+        return await self.request('GET', uri)
+
+    def release(self):
+        """
+        Hands the connection back to the pool if the response was read to the
+        end and can be followed by another one, closes it otherwise
+        """
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        response = self.response
+        if response is not None and response.message_complete and response.keep_alive:
+            self.pool._checkin(self.url, connection)
+        else:
+            connection.close()
+
+
+class AsyncHostPool(object):
+    """
+    The asyncio counterpart of amtp.pool.HostPool: keep-alive connections per
+    (scheme, host, port) with a cap per host and one across all hosts. Has to
+    be created inside the running event loop
+    """
+    def __init__(self, max_connections=MAX_CONNECTIONS, host_connections=HOST_CONNECTIONS,
+            resolver=None, limiter=None):
+        """
+        :max_connections - connections allowed across all hosts
+        :host_connections - connections allowed to a single host
+        :resolver(optional) - amtp.dns.Resolver whose cached addresses are
+            used, other hosts are looked up with the getaddrinfo of the loop
+        :limiter(optional) - amtp.ratelimit.RateLimiter every request waits for
+        """
+        self.max_connections = max_connections
+        self.host_connections = min(host_connections, max_connections)
+        self.resolver = resolver
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.semaphores = {}
+        self.idle = {}
+        self.addresses = {}
+        self.ssl_context = None
+
+        self.active = 0
+        self.requests = 0
+        self.connects = 0
+        # requests sent on a kept-alive connection
+        self.reused = 0
+        # exception type name -> number of requests failed with it
+        self.errors = {}
+
+    key = staticmethod(HostPool.key)
+
+    async def _acquire_tokens(self, key):
+        limiter = self.limiter
+        start = clock()
+        # host first, like RateLimiter.acquire
+        if limiter.host_rate:
+            delay = limiter.host_bucket(key).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+        if limiter.bucket is not None:
+            delay = limiter.bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+        limiter.waited += clock() - start
+
+    @asynccontextmanager
+    async def connection(self, url, phases=None):
+        """
+        Async context manager yielding a Client for url while holding a
+        connection slot for the host and one from the global budget, see
+        amtp.pool.HostPool.connection
+        """
+        key = self.key(url)
+        if self.limiter is not None:
+            await self._acquire_tokens(key)
+        semaphore = self.semaphores.get(key)
+        if semaphore is None:
+            semaphore = self.semaphores[key] = asyncio.Semaphore(self.host_connections)
+        async with semaphore, self.semaphore:
+            self.active += 1
+            self.requests += 1
+            client = Client(self, url, phases)
+            try:
+                yield client
+            except Exception as err:
+                name = type(err).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+                raise
+            finally:
+                client.release()
+                self.active -= 1
+
+    def _checkout(self, url):
+        connections = self.idle.get(self.key(url))
+        while connections:
+            connection = connections.pop()
+            if connection.reader.at_eof():
+                connection.close()
+                continue
+            self.reused += 1
+            return connection
+        return None
+
+    def _checkin(self, url, connection):
+        connection.reused = True
+        self.idle.setdefault(self.key(url), []).append(connection)
+
+    async def _resolve(self, host, port, phases):
+        host = normalize(host)
+        if is_ip(host):
+            # no lookup, no dns phase - as in amtp.pool
+            return [host]
+        start = clock()
+        addresses = self.addresses.get(host)
+        if addresses is None and self.resolver is not None:
+            addresses = self.resolver.cached(host)
+        if addresses is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port,
+                    type=socket.SOCK_STREAM)
+            addresses = sorted(set(info[4][0] for info in infos
+                                   if info[0] in (socket.AF_INET, socket.AF_INET6)),
+                               key=lambda address: (':' in address, address))
+            if not addresses:
+                raise socket.gaierror('hostname {} does not resolve'.format(host))
+        if phases is not None:
+            phases['dns'] = phases.get('dns', 0) + clock() - start
+        self.addresses[host] = addresses
+        return addresses
+
+    async def _connect(self, url, phases=None):
+        """
+        Opens a new connection to url, timing the dns, connect and tls phases
+        """
+        port = url.port or DEFAULT_PORTS.get(url.scheme, 80)
+        addresses = await self._resolve(url.host, port, phases)
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(family(addresses[0]), socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            start = clock()
+            await loop.sock_connect(sock, (addresses[0], port))
+            connected = clock()
+            context = None
+            if url.scheme == 'https':
+                if self.ssl_context is None:
+                    self.ssl_context = ssl.create_default_context()
+                context = self.ssl_context
+            reader, writer = await asyncio.open_connection(sock=sock, ssl=context,
+                    server_hostname=url.host if context else None)
+        except BaseException:
+            sock.close()
+            raise
+        if phases is not None:
+            phases['connect'] = phases.get('connect', 0) + connected - start
+            if context is not None:
+                phases['tls'] = phases.get('tls', 0) + clock() - connected
+        self.connects += 1
+        return _Connection(reader, writer)
+
+    def close(self):
+        for connections in self.idle.values():
+            for connection in connections:
+                connection.close()
+        self.idle.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary with the connection reuse statistics, like
+        amtp.pool.HostPool.stats
+        """
+        return {
+            'hosts': len(self.semaphores),
+            'requests': self.requests,
+            'connects': self.connects,
+            'reused': self.reused,
+            'reuse_ratio': self.reused / self.requests if self.requests else 0.0,
+            'evicted': 0,
+        }
+
+
+async def match_body(matcher, response):
+    """
+    amtp.matcher.BodyMatcher.match for a Response
+    """
+    scan = matcher.scan()
+    while scan.wanted():
+        if not scan.feed(await response.read(scan.wanted())):
+            break
+    return scan.matched()
+
+
+async def finish_response(response, max_bytes=DRAIN_BYTES):
+    """
+    Reads up to max_bytes of the rest of the body so that the connection can
+    be reused, see amtp.pool.finish_response
+    """
+    read = 0
+    while not response.message_complete and read < max_bytes:
+        block = await response.read(min(max_bytes - read, DRAIN_BYTES))
+        if not block:
+            break
+        read += len(block)
+
+
+class AsyncEngine(Engine):
+    """
+    Sends the probe requests of Ping objects on an asyncio event loop, those
+    of all pings ahead of the run
+    """
+    ahead = True
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, host_connections=HOST_CONNECTIONS,
+            resolver=None, health=None, limiter=None, modes=None, concurrency=CONCURRENCY):
+        """
+        :max_connections - connections allowed across all targets
+        :host_connections - connections allowed to a single target host
+        :resolver(optional) - amtp.dns.Resolver with the prefetched hosts
+        :health(optional) - amtp.health.HostHealth shared with the pings
+        :limiter(optional) - amtp.ratelimit.RateLimiter
+        :modes(optional) - amtp.probemode.ProbeModes picking the requests
+        :concurrency - pings probed at the same time
+        """
+        self.max_connections = max_connections
+        self.host_connections = host_connections
+        self.resolver = resolver
+        self.health = health
+        self.limiter = limiter
+        self.modes = modes
+        self.concurrency = concurrency
+        self.pool = None
+
+    @property
+    def active(self):
+        return self.pool.active if self.pool is not None else 0
+
+    def stats(self):
+        """
+        Returns the connection reuse statistics of the last prepare
+        """
+        if self.pool is None:
+            return {'hosts': 0, 'requests': 0, 'connects': 0, 'reused': 0,
+                    'reuse_ratio': 0.0, 'evicted': 0}
+        return self.pool.stats()
+
+    def errors(self):
+        return self.pool.errors if self.pool is not None else {}
+
+    def prepare(self, pings, deadline=None):
+        """
+        Probes pings on a new event loop, which blocks the gevent hub until
+        they are done. Pings not probed within deadline seconds are missing
+        """
+        loop = new_event_loop()
+        try:
+            return loop.run_until_complete(self._probe_all(pings, deadline))
+        finally:
+            # after a KeyboardInterrupt, let the probes close their connections
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def probe(self, ping):
+        """
+        Probes a single ping, blocking the gevent hub
+        """
+        return self.prepare([ping])[ping]
+
+    async def _probe_all(self, pings, deadline):
+        self.pool = AsyncHostPool(self.max_connections, self.host_connections,
+                self.resolver, self.limiter)
+        probes = {}
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def _run(ping):
+            async with slots:
+                probes[ping] = await self._probe(ping)
+
+        tasks = [asyncio.ensure_future(_run(ping)) for ping in pings]
+        try:
+            if tasks:
+                done, pending = await asyncio.wait(tasks, timeout=deadline)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            self.pool.close()
+        return probes
+
+    async def _probe(self, ping):
+        """
+        Sends the requests_count requests of a ping, up to requests_concurrency
+        at a time, and returns the probe
+        """
+        probe = new_probe()
+        slots = asyncio.Semaphore(min(ping.requests_concurrency, ping.requests_count))
+
+        async def _once():
+            async with slots:
+                await self._probe_once(ping, probe)
+
+        await asyncio.gather(*(_once() for i in range(ping.requests_count)))
+        return probe
+
+    async def _probe_once(self, ping, probe):
+        """
+        Makes a single request and records it in probe
+        """
+        attempt = Attempt(ping, probe, self.pool.key(ping.url), self.health, self.modes)
+        if not attempt.allowed():
+            return
+        phases = {}
+        try:
+            async with self.pool.connection(ping.url, phases) as http:
+                attempt.start()
+                await asyncio.wait_for(self._exchange(attempt, http, phases), attempt.timeout)
+        except asyncio.TimeoutError:
+            attempt.timed_out()
+        except (OSError, HTTPError, asyncio.IncompleteReadError):
+            attempt.failed()
+        attempt.finish()
+
+    async def _exchange(self, attempt, http, phases):
+        """
+        Sends the request of attempt and reads the response
+        """
+        uri = attempt.ping.url.request_uri
+        method, headers = attempt.request()
+        response = await http.request(method, uri, headers)
+        if attempt.retry(response.status_code):
+            await finish_response(response)
+            method, headers = attempt.request()
+            response = await http.request(method, uri, headers)
+        header = lambda field: response.headers.get(field.lower(), [None])[0]
+        passed = attempt.received(response.status_code, header)
+        if passed is None:
+            passed = await match_body(attempt.ping.plan.body, response)
+        await finish_response(response)
+        attempt.responded(response.status_code, header, passed, phases)
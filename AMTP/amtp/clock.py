@@ -0,0 +1,7 @@
+"""
+Clock for measuring durations, monotonic where the Python version has one
+"""
+try:
+    from time import monotonic as clock
+except ImportError: # Python 2
+    from time import time as clock
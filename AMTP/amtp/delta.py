@@ -0,0 +1,251 @@
+"""
+Delta output - the changes of a run as an RFC 6902 JSON Patch
+
+DeltaWriter keeps the result document of the last run (the snapshot) and
+writes a patch of what changed against it, ping by ping as they finish. The
+items of a ping are compared field by field, so an unchanged target adds
+nothing to the patch and a changed one only the fields which changed. No
+whole-document diff is ever made.
+
+The timestamp of an item changes on every run, so it is only patched along
+with a real change of the item: in the snapshot (and in anything rebuilt from
+the patches) it is the time the item last changed.
+
+apply_patch() replays the patches on a snapshot, see tools/replay.py.
+"""
+import json
+import os
+
+# fields which are patched only along with a change of another field of the item
+VOLATILE = ('timestamp',)
+_MISSING = object()
+
+
+def pointer(*tokens):
+    """
+    Returns the JSON Pointer (RFC 6901) of a path of keys
+    """
+    return ''.join('/' + str(token).replace('~', '~0').replace('/', '~1') for token in tokens)
+
+
+def _tokens(path):
+    if path == '':
+        return []
+    if not path.startswith('/'):
+        raise ValueError("invalid JSON pointer '{}'".format(path))
+    return [token.replace('~1', '/').replace('~0', '~') for token in path[1:].split('/')]
+
+
+def diff_fields(path, old, new, volatile=()):
+    """
+    Returns the add/replace/remove operations turning the object old into new,
+    comparing their members as whole values. Returns no operations if only
+    members in volatile differ
+
+    :path - list of the keys leading to the objects
+    """
+    ops = []
+    changed = False
+    for key, value in new.items():
+        previous = old.get(key, _MISSING)
+        if previous is _MISSING:
+            ops.append({'op': 'add', 'path': pointer(*path + [key]), 'value': value})
+        elif previous != value:
+            ops.append({'op': 'replace', 'path': pointer(*path + [key]), 'value': value})
+        else:
+            continue
+        changed = changed or key not in volatile
+    for key in old:
+        if key not in new:
+            ops.append({'op': 'remove', 'path': pointer(*path + [key])})
+            changed = changed or key not in volatile
+    return ops if changed else []
+
+
+def diff_items(path, old, new):
+    """
+    Returns the operations turning the items object old into new, field by
+    field for the items present in both
+    """
+    ops = []
+    for key, item in new.items():
+        if key not in old:
+            ops.append({'op': 'add', 'path': pointer(*path + [key]), 'value': item})
+        elif isinstance(item, dict) and isinstance(old[key], dict):
+            ops.extend(diff_fields(path + [key], old[key], item, VOLATILE))
+        elif old[key] != item:
+            ops.append({'op': 'replace', 'path': pointer(*path + [key]), 'value': item})
+    for key in old:
+        if key not in new:
+            ops.append({'op': 'remove', 'path': pointer(*path + [key])})
+    return ops
+
+
+def apply_patch(document, ops):
+    """
+    Applies the add, remove, replace and test operations of a JSON Patch to
+    document in place and returns the result (a new value if the root
+    was replaced). Raises ValueError if an operation does not apply
+    """
+    for op in ops:
+        tokens = _tokens(op['path'])
+        kind = op['op']
+        if not tokens:
+            if kind in ('add', 'replace'):
+                document = op['value']
+            elif kind == 'test' and document != op['value']:
+                raise ValueError('test of the document failed')
+            elif kind not in ('add', 'replace', 'test'):
+                raise ValueError("can't {} the document".format(kind))
+            continue
+        parent = document
+        try:
+            for token in tokens[:-1]:
+                parent = parent[int(token) if isinstance(parent, list) else token]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise ValueError("path '{}' does not exist".format(op['path']))
+        key = tokens[-1]
+        if isinstance(parent, list):
+            key = len(parent) if key == '-' else int(key)
+        elif not isinstance(parent, dict):
+            raise ValueError("path '{}' does not exist".format(op['path']))
+        if kind == 'add':
+            if isinstance(parent, list):
+                parent.insert(key, op['value'])
+            else:
+                parent[key] = op['value']
+        elif kind in ('remove', 'replace', 'test'):
+            try:
+                current = parent[key]
+            except (KeyError, IndexError):
+                raise ValueError("path '{}' does not exist".format(op['path']))
+            if kind == 'remove':
+                del parent[key]
+            elif kind == 'replace':
+                parent[key] = op['value']
+            elif current != op['value']:
+                raise ValueError("test of '{}' failed".format(op['path']))
+        else:
+            raise ValueError("unsupported operation '{}'".format(kind))
+    return document
+
+
+def _fields(data, container):
+    """
+    Returns the members of data other than container
+    """
+    return dict((key, value) for key, value in data.items() if key != container)
+
+
+def load_snapshot(path):
+    """
+    Returns the snapshot saved at path, an empty document if there is none
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (IOError, OSError):
+        return {'applications': {}}
+
+
+class DeltaWriter(object):
+    """
+    Writes the changes of the pings against the snapshot as a JSON Patch and
+    moves the snapshot on to the results of this run
+    """
+    def __init__(self, file, snapshot_path):
+        """
+        :file - text file object the patch (a JSON array) is written to
+        :snapshot_path - JSON file of the last results, updated on close().
+            Missing on the first run, the patch then adds everything
+        """
+        self.file = file
+        self.snapshot_path = snapshot_path
+        self.snapshot = load_snapshot(snapshot_path)
+        self.snapshot.setdefault('applications', {})
+        self.seen = set()
+        self.ops = 0
+        self.changed = 0
+        self.file.write('[')
+
+    def _write(self, ops):
+        for op in ops:
+            self.file.write('\n' if not self.ops else ',\n')
+            self.file.write(json.dumps(op, separators=(',', ':')))
+            self.ops += 1
+
+    def add(self, application, ping, data):
+        """
+        Writes the changes of a finished ping
+
+        :data - the TBMON ping object with its items filled in
+        """
+        self.seen.add((application, ping))
+        # what the snapshot holds once loaded again, e.g. lists for tuples
+        data = json.loads(json.dumps(data))
+        applications = self.snapshot['applications']
+        if application not in applications:
+            applications[application] = {'pings': {}}
+            self._write([{'op': 'add', 'path': pointer('applications', application),
+                          'value': {'pings': {}}}])
+        pings = applications[application]['pings']
+        old = pings.get(ping)
+        if old is None:
+            ops = [{'op': 'add', 'path': pointer('applications', application, 'pings', ping),
+                    'value': data}]
+        else:
+            path = ['applications', application, 'pings', ping]
+            ops = diff_fields(path, _fields(old, 'items'), _fields(data, 'items'))
+            ops.extend(diff_items(path + ['items'], old.get('items', {}), data.get('items', {})))
+        if ops:
+            self.changed += 1
+            apply_patch(self.snapshot, ops)
+            self._write(ops)
+
+    def close(self, document=None):
+        """
+        Removes the pings which were not run from the snapshot, writes the
+        changes of the other fields of document and its applications, ends
+        the patch and saves the snapshot
+
+        :document(optional) - the TBMON document of the run
+        """
+        applications = self.snapshot['applications']
+        ops = []
+        for application in list(applications):
+            pings = applications[application]['pings']
+            gone = [ping for ping in pings if (application, ping) not in self.seen]
+            if gone and len(gone) == len(pings):
+                ops.append({'op': 'remove', 'path': pointer('applications', application)})
+                continue
+            ops.extend({'op': 'remove', 'path': pointer('applications', application, 'pings', ping)}
+                       for ping in gone)
+        apply_patch(self.snapshot, ops)
+        self._write(ops)
+        if document is not None:
+            # what the snapshot holds once loaded again
+            fields = json.loads(json.dumps(_fields(document, 'applications')))
+            ops = diff_fields([], _fields(self.snapshot, 'applications'), fields)
+            for application, data in document.get('applications', {}).items():
+                if application in applications:
+                    fields = json.loads(json.dumps(_fields(data, 'pings')))
+                    ops.extend(diff_fields(['applications', application],
+                                           _fields(applications[application], 'pings'), fields))
+            apply_patch(self.snapshot, ops)
+            self._write(ops)
+        self.file.write('\n]\n' if self.ops else ']\n')
+        self.file.close()
+        # never a half written snapshot, the next run diffs against it
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(self.snapshot, file)
+        os.rename(tmp, self.snapshot_path)
+
+    def abort(self):
+        """
+        Replaces the patch with an empty one and leaves the snapshot as it was
+        """
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write('[]\n')
+        self.file.close()
@@ -0,0 +1,390 @@
+"""
+Asynchronous DNS resolution with a TTL respecting cache
+
+A records are queried over UDP straight from the nameservers in
+/etc/resolv.conf, so the TTLs of the answers are known and the results can be
+cached for exactly as long as they are valid. NXDOMAIN is cached as well
+(negative caching, RFC 2308). Hosts without an A record, which may have AAAA
+ones, are looked up with getaddrinfo.
+"""
+from __future__ import division
+
+import random
+import struct
+import time
+
+import gevent
+import gevent.socket
+from gevent.event import AsyncResult
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+
+from .clock import clock
+
+RESOLV_CONF = '/etc/resolv.conf'
+HOSTS = '/etc/hosts'
+DNS_PORT = 53
+TIMEOUT = 2
+RETRIES = 2
+# used when the TTL is unknown (getaddrinfo fallback, /etc/hosts)
+DEFAULT_TTL = 300
+MAX_TTL = 3600
+NEGATIVE_TTL = 60
+PREFETCH_CONCURRENCY = 100
+# UDP sockets open for queries at the same time
+MAX_QUERIES = 100
+
+TYPE_A = 1
+TYPE_SOA = 6
+CLASS_IN = 1
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+
+class _QueryTimeout(Exception):
+    """
+    Raised when a nameserver does not answer within the timeout of a query
+    """
+
+
+class DNSError(gevent.socket.gaierror):
+    """
+    Raised when a hostname does not resolve
+
+    :ttl - seconds the failure may be cached for, None if unknown
+    """
+    def __init__(self, message, ttl=None):
+        super(DNSError, self).__init__(message)
+        self.ttl = ttl
+
+
+def _read_config(path=RESOLV_CONF):
+    """
+    Returns the list of nameserver addresses in a resolv.conf file
+    """
+    nameservers = []
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    nameservers.append(fields[1])
+    except (IOError, OSError):
+        pass
+    return nameservers
+
+
+def _read_hosts(path=HOSTS):
+    """
+    Returns a dictionary of hostname to IPv4 addresses from a hosts file
+    """
+    hosts = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) < 2 or ':' in fields[0]:
+                    continue
+                for name in fields[1:]:
+                    hosts.setdefault(name.lower(), []).append(fields[0])
+    except (IOError, OSError):
+        pass
+    return hosts
+
+
+def normalize(host):
+    """
+    Returns host the way it is cached: lower case, without the brackets of
+    an IPv6 literal and the trailing dot
+    """
+    return host.lower().strip('[]').rstrip('.')
+
+
+def family(address):
+    """
+    Returns the address family of an IPv4 or IPv6 address
+    """
+    return gevent.socket.AF_INET6 if ':' in address else gevent.socket.AF_INET
+
+
+def is_ip(host):
+    try:
+        gevent.socket.inet_pton(gevent.socket.AF_INET, host)
+        return True
+    except (gevent.socket.error, ValueError):
+        pass
+    try:
+        gevent.socket.inet_pton(gevent.socket.AF_INET6, host)
+        return True
+    except (gevent.socket.error, ValueError):
+        return False
+
+
+def build_query(qid, host, qtype=TYPE_A):
+    """
+    Returns a DNS query message for host
+    """
+    header = struct.pack('!HHHHHH', qid, 0x0100, 1, 0, 0, 0)
+    qname = b''
+    for label in host.encode('idna').split(b'.'):
+        if label:
+            qname += struct.pack('!B', len(label)) + label
+    return header + qname + b'\0' + struct.pack('!HH', qtype, CLASS_IN)
+
+
+def _read_name(data, offset):
+    """
+    Returns the (possibly compressed) domain name at offset and the offset
+    right after it
+    """
+    labels = []
+    end = None
+    for _ in range(128):
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = (length & 0x3F) << 8 | data[offset + 1]
+        elif length == 0:
+            return b'.'.join(labels).decode('ascii').lower(), end or offset + 1
+        else:
+            labels.append(bytes(data[offset + 1:offset + 1 + length]))
+            offset += 1 + length
+    raise ValueError("too many compression pointers")
+
+
+def parse_response(message):
+    """
+    Returns a tuple of (qid, rcode, addresses, ttl) from a DNS response.
+    For negative answers ttl is taken from the SOA record if present
+    """
+    data = bytearray(message)
+    qid, flags, qdcount, ancount, nscount, _ = struct.unpack('!HHHHHH', bytes(data[:12]))
+    rcode = flags & 0x000F
+    offset = 12
+    for _ in range(qdcount):
+        offset = _read_name(data, offset)[1] + 4
+
+    addresses = []
+    ttl = None
+    negative_ttl = None
+    for i in range(ancount + nscount):
+        offset = _read_name(data, offset)[1]
+        rtype, rclass, rttl, rdlength = struct.unpack('!HHIH', bytes(data[offset:offset + 10]))
+        offset += 10
+        rdata = offset
+        offset += rdlength
+        if i < ancount:
+            # CNAMEs in the chain bound the TTL as well
+            ttl = rttl if ttl is None else min(ttl, rttl)
+            if rtype == TYPE_A and rdlength == 4:
+                addresses.append(gevent.socket.inet_ntoa(bytes(data[rdata:offset])))
+        elif rtype == TYPE_SOA:
+            pos = _read_name(data, _read_name(data, rdata)[1])[1]
+            minimum = struct.unpack('!I', bytes(data[pos + 16:pos + 20]))[0]
+            negative_ttl = min(rttl, minimum)
+    if not addresses:
+        ttl = negative_ttl
+    return qid, rcode, addresses, ttl
+
+
+class Resolver(object):
+    """
+    Caching DNS resolver for gevent
+    """
+    def __init__(self, nameservers=None, timeout=TIMEOUT, retries=RETRIES,
+            max_ttl=MAX_TTL, negative_ttl=NEGATIVE_TTL, port=DNS_PORT, max_queries=MAX_QUERIES):
+        """
+        :nameservers(optional) - list of nameserver addresses, by default read
+            from /etc/resolv.conf. If there are none getaddrinfo is used
+        :port - UDP port of the nameservers
+        :timeout - seconds to wait for an answer from a nameserver
+        :retries - number of times each nameserver is asked
+        :max_ttl - upper bound for caching an answer in seconds
+        :negative_ttl - seconds to cache a failure for if its TTL is unknown
+        :max_queries - queries in flight at the same time, each holds a socket
+        """
+        if nameservers is None:
+            nameservers = _read_config()
+        self.nameservers = nameservers
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_queries = max_queries
+        self.queries = BoundedSemaphore(max_queries)
+        self.hosts = _read_hosts()
+        # hostname -> (expires, addresses or None, error)
+        self.cache = {}
+        self.pending = {}
+        # hostname -> seconds the last lookup took
+        self.lookup_times = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def resolve(self, host):
+        """
+        Returns a list of IPv4 and/or IPv6 addresses for host or raises
+        DNSError. Concurrent lookups of the same host share a single query
+        """
+        host = normalize(host)
+        if is_ip(host):
+            return [host]
+        entry = self.cache.get(host)
+        if entry is not None and entry[0] > time.time():
+            self.hits += 1
+            if entry[1] is None:
+                raise DNSError(entry[2])
+            return entry[1]
+        pending = self.pending.get(host)
+        if pending is not None:
+            addresses = pending.get()
+            if addresses is None:
+                # the lookup was interrupted, it is ours now
+                return self.resolve(host)
+            self.hits += 1
+            return addresses
+
+        self.misses += 1
+        pending = self.pending[host] = AsyncResult()
+        start = clock()
+        try:
+            addresses, ttl = self._lookup(host)
+            self.lookup_times[host] = clock() - start
+        except DNSError as err:
+            self.failures += 1
+            ttl = self.negative_ttl if err.ttl is None else min(err.ttl, self.max_ttl)
+            self.cache[host] = (time.time() + ttl, None, str(err))
+            pending.set_exception(err)
+            raise
+        except BaseException:
+            # e.g. a Timeout or GreenletExit of the first caller, which is
+            # not the waiters' - they look the host up again
+            pending.set(None)
+            raise
+        finally:
+            del self.pending[host]
+        if ttl:
+            self.cache[host] = (time.time() + min(ttl, self.max_ttl), addresses, None)
+        pending.set(addresses)
+        return addresses
+
+    def cached(self, host):
+        """
+        Returns the cached addresses of host without blocking, None if it
+        is not in the cache. Raises DNSError for a cached failure
+        """
+        host = normalize(host)
+        if is_ip(host):
+            return [host]
+        entry = self.cache.get(host)
+        if entry is None or entry[0] <= time.time():
+            return None
+        if entry[1] is None:
+            raise DNSError(entry[2])
+        return entry[1]
+
+    def _lookup(self, host):
+        """
+        Returns (addresses, ttl) for host, raises DNSError on failure
+        """
+        if host in self.hosts:
+            return self.hosts[host], DEFAULT_TTL
+        # single label names go through the search domains of the system resolver
+        if not self.nameservers or '.' not in host:
+            return self._getaddrinfo(host)
+
+        for attempt in range(self.retries):
+            for nameserver in self.nameservers:
+                try:
+                    rcode, addresses, ttl = self._query(nameserver, host)
+                except gevent.socket.timeout:
+                    # not ours (the queries time out with _QueryTimeout), but
+                    # e.g. the timeout of the request resolving the host
+                    raise
+                except (_QueryTimeout, gevent.socket.error, ValueError, struct.error):
+                    continue
+                if rcode == RCODE_NXDOMAIN:
+                    raise DNSError("hostname {} does not resolve".format(host), ttl)
+                if rcode == RCODE_NOERROR:
+                    if not addresses:
+                        # no A record, there may be AAAA ones
+                        return self._getaddrinfo(host, ttl)
+                    return addresses, ttl
+        # no usable answer (timeouts, SERVFAIL, truncation) - ask the system
+        return self._getaddrinfo(host)
+
+    def _query(self, nameserver, host):
+        with self.queries:
+            return self._send_query(nameserver, host)
+
+    def _send_query(self, nameserver, host):
+        family = gevent.socket.AF_INET6 if ':' in nameserver else gevent.socket.AF_INET
+        sock = gevent.socket.socket(family, gevent.socket.SOCK_DGRAM)
+        # a Timeout of our own, so that a timeout of the caller is told apart
+        timeout = gevent.Timeout(self.timeout)
+        timeout.start()
+        try:
+            qid = random.randint(0, 0xFFFF)
+            sock.connect((nameserver, self.port))
+            sock.send(build_query(qid, host))
+            while True:
+                rid, rcode, addresses, ttl = parse_response(sock.recv(4096))
+                if rid == qid:
+                    return rcode, addresses, ttl
+        except gevent.Timeout as err:
+            if err is not timeout:
+                raise
+            raise _QueryTimeout()
+        finally:
+            timeout.close()
+            sock.close()
+
+    def _getaddrinfo(self, host, negative_ttl=None):
+        """
+        Returns (addresses, ttl) for host from the system resolver, IPv4
+        addresses first
+
+        :negative_ttl - TTL of a failure, None if unknown
+        """
+        try:
+            infos = gevent.socket.getaddrinfo(host, None, 0, gevent.socket.SOCK_STREAM)
+        except gevent.socket.gaierror as err:
+            raise DNSError("hostname {} does not resolve ({})".format(host, err), negative_ttl)
+        addresses = set(info[4][0] for info in infos
+                        if info[0] in (gevent.socket.AF_INET, gevent.socket.AF_INET6))
+        if not addresses:
+            raise DNSError("hostname {} does not resolve".format(host), negative_ttl)
+        return sorted(addresses, key=lambda address: (':' in address, address)), DEFAULT_TTL
+
+    def prefetch(self, hosts, concurrency=PREFETCH_CONCURRENCY):
+        """
+        Resolves hosts in parallel to warm up the cache. Returns a dictionary
+        of the hosts which failed to resolve and their errors
+        """
+        failed = {}
+        def _prefetch(host):
+            try:
+                self.resolve(host)
+            except DNSError as err:
+                failed[host] = err
+        group = Pool(concurrency)
+        now = time.time()
+        for host in set(normalize(host) for host in hosts):
+            entry = self.cache.get(host)
+            if is_ip(host) or (entry is not None and entry[0] > now):
+                continue
+            group.spawn(_prefetch, host)
+        group.join()
+        return failed
+
+    def stats(self):
+        return {
+            'cached': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'failures': self.failures,
+        }
@@ -0,0 +1,146 @@
+"""
+Per-host circuit breaker and adaptive request timeouts
+
+After `threshold` consecutive connection failures a host's breaker opens and
+further attempts are counted as lost without being sent. After `cooldown`
+seconds a single attempt is let through again (half-open), the others are still
+skipped until it succeeds or fails.
+
+When enabled, request timeouts of healthy hosts follow their observed round
+trip times like TCP's retransmission timer (RFC 6298): srtt + 4 * rttvar, with
+a safety margin, but never above the configured request_timeout. The estimate
+is kept per host, so it only suits hosts whose endpoints answer alike; it is off
+by default.
+"""
+from __future__ import division
+
+import time
+
+FAILURE_THRESHOLD = 3
+COOLDOWN = 60
+MIN_SAMPLES = 3
+MIN_TIMEOUT = 0.25
+TIMEOUT_MARGIN = 2
+
+
+class _Host(object):
+    def __init__(self):
+        self.failures = 0
+        self.opened = None
+        # when the attempt of a half-open breaker was let through, None if
+        # there is none under way
+        self.trial = None
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        # mean duration of the failed attempts, what a skipped one would cost
+        self.failure_time = 0.0
+
+
+class HostHealth(object):
+    """
+    Circuit breakers and round trip time estimates for a set of hosts
+    """
+    def __init__(self, threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, adaptive=False):
+        """
+        :threshold - consecutive failures which open the breaker of a host
+        :cooldown - seconds after which an open breaker lets an attempt through
+        :adaptive - whether timeouts are adapted to the observed round trips
+            of the host
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.adaptive = adaptive
+        self.hosts = {}
+
+        self.skipped = 0
+        self.trips = 0
+        self.cut_short = 0
+        self.saved = 0.0
+
+    def _host(self, key):
+        host = self.hosts.get(key)
+        if host is None:
+            host = self.hosts[key] = _Host()
+        return host
+
+    def allow(self, key):
+        """
+        Returns False if the breaker of the host is open. The skipped attempt
+        is accounted as the mean duration of the failed ones saved
+
+        :key - host key, see amtp.pool.HostPool.key
+        """
+        host = self.hosts.get(key)
+        if host is None or host.opened is None:
+            return True
+        now = time.time()
+        # a trial which neither succeeded nor failed (e.g. killed by the
+        # deadline) is given up on after another cooldown
+        if now - host.opened >= self.cooldown and \
+                (host.trial is None or now - host.trial >= self.cooldown):
+            # half-open: let this one through, success() closes the breaker
+            # and failure() opens it again
+            host.trial = now
+            return True
+        self.skipped += 1
+        self.saved += host.failure_time
+        return False
+
+    def timeout(self, key, request_timeout):
+        """
+        Returns the timeout for the next request to the host
+        """
+        host = self.hosts.get(key)
+        if not self.adaptive or host is None or host.samples < MIN_SAMPLES:
+            return request_timeout
+        rto = max(host.srtt + 4 * host.rttvar, MIN_TIMEOUT) * TIMEOUT_MARGIN
+        return min(rto, request_timeout)
+
+    def success(self, key, rtt):
+        """
+        Records a completed request which took rtt seconds
+        """
+        host = self._host(key)
+        host.failures = 0
+        host.opened = None
+        host.trial = None
+        if host.srtt is None:
+            host.srtt = rtt
+            host.rttvar = rtt / 2
+        else:
+            host.rttvar = 0.75 * host.rttvar + 0.25 * abs(host.srtt - rtt)
+            host.srtt = 0.875 * host.srtt + 0.125 * rtt
+        host.samples += 1
+
+    def failure(self, key, elapsed, timeout=None, request_timeout=None):
+        """
+        Records a failed connection attempt which took elapsed seconds. For
+        timeouts pass the timeout used and the configured one, to account for
+        the time saved
+        """
+        host = self._host(key)
+        host.failures += 1
+        host.failure_time += (elapsed - host.failure_time) / host.failures
+        if timeout is not None and request_timeout is not None and timeout < request_timeout:
+            self.cut_short += 1
+            self.saved += request_timeout - timeout
+        if host.trial is not None:
+            # the attempt of a half-open breaker failed
+            host.trial = None
+            host.opened = time.time()
+            self.trips += 1
+        elif host.opened is None and host.failures >= self.threshold:
+            host.opened = time.time()
+            self.trips += 1
+
+    def stats(self):
+        # copied in one step, the metrics thread reads it while hosts are added
+        hosts = list(self.hosts.values())
+        return {
+            'open': sum(1 for host in hosts if host.opened is not None),
+            'trips': self.trips,
+            'skipped': self.skipped,
+            'cut_short': self.cut_short,
+            'saved': self.saved,
+        }
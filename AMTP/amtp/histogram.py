@@ -0,0 +1,102 @@
+"""
+Compact streaming latency histogram
+
+Samples are counted in logarithmic buckets, so memory depends on the spread of
+the values and not on their number. Percentiles are accurate to the bucket
+precision (1% by default); min and max are exact.
+"""
+from __future__ import division
+
+import math
+
+PRECISION = 0.01
+# values below this (ms) share the first bucket
+RESOLUTION = 0.001
+
+
+class LatencyHistogram(object):
+    """
+    Streaming histogram of latencies in milliseconds
+    """
+    def __init__(self, precision=PRECISION):
+        """
+        :precision - relative width of a bucket
+        """
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        return int(math.log(max(value, RESOLUTION) / RESOLUTION) / self._log_base)
+
+    def add(self, value):
+        """
+        Records a single sample
+
+        :value - latency in milliseconds
+        """
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Adds the samples of another histogram with the same precision
+        """
+        if other.precision != self.precision:
+            raise ValueError("cannot merge histograms of different precision")
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def percentile(self, p):
+        """
+        Returns the value below which p percent of the samples fall
+
+        :p - percentile between 0 and 100
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(p / 100 * self.count)), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                # middle of the bucket, kept within the exact bounds
+                value = RESOLUTION * math.exp((bucket + 0.5) * self._log_base)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self, digits=3):
+        """
+        Returns a dictionary with min, p50, p95, p99 and max (or an empty one
+        if there are no samples)
+        """
+        if not self.count:
+            return {}
+        return {
+            'min': round(self.min, digits),
+            'p50': round(self.percentile(50), digits),
+            'p95': round(self.percentile(95), digits),
+            'p99': round(self.percentile(99), digits),
+            'max': round(self.max, digits),
+        }
@@ -0,0 +1,299 @@
+"""
+Batched ICMP echo pinger
+
+All of the targets are pinged through a single ICMP socket served by one
+receiving greenlet, so thousands of hosts cost one file descriptor. Without
+root an unprivileged datagram socket is used (Linux, net.ipv4.ping_group_range)
+and the kernel picks the identifier; with root a raw socket and an identifier
+of our own. Either way replies are matched by address and sequence number.
+"""
+from __future__ import division
+
+import errno
+import math
+import os
+import random
+import struct
+
+import gevent
+import gevent.socket
+from gevent.event import Event
+
+from .clock import clock
+from .dns import family
+
+COUNT = 5
+# seconds between the echo requests sent to a single host
+INTERVAL = 1.0
+# seconds a reply may take before the request counts as lost
+TIMEOUT = 2.0
+# echo requests per second across all hosts
+RATE = 1000
+PAYLOAD_SIZE = 56
+
+ECHO_REPLY = 0
+ECHO_REQUEST = 8
+MAGIC = b'AMTP'
+
+
+def checksum(data):
+    """
+    Returns the internet checksum (RFC 1071) of data
+    """
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!{}H'.format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_request(ident, seq, size=PAYLOAD_SIZE):
+    """
+    Returns an ICMP echo request packet
+    """
+    payload = (MAGIC * (size // len(MAGIC) + 1))[:size]
+    header = struct.pack('!BBHHH', ECHO_REQUEST, 0, 0, ident, seq)
+    return struct.pack('!BBHHH', ECHO_REQUEST, 0, checksum(header + payload), ident, seq) + payload
+
+
+def parse_reply(packet):
+    """
+    Returns (ident, seq) of an ICMP echo reply or None for anything else.
+    Raw sockets (and datagram ones on some systems) hand out the IP header too
+    """
+    if packet and packet[0] >> 4 == 4:
+        packet = packet[(packet[0] & 0x0f) * 4:]
+    if len(packet) < 8:
+        return None
+    kind, code, _, ident, seq = struct.unpack('!BBHHH', packet[:8])
+    if kind != ECHO_REPLY or not packet[8:].startswith(MAGIC[:len(packet) - 8]):
+        return None
+    return ident, seq
+
+
+def summary(rtts, transmitted):
+    """
+    Returns the statistics of a host from its round trip times in seconds:
+    transmitted, received, loss in percent and rtt min/avg/max/mdev/jitter
+    in ms, mdev as ping(8) reports it and jitter as the mean difference of
+    consecutive round trips
+    """
+    received = len(rtts)
+    stats = {
+        'transmitted': transmitted,
+        'received': received,
+        'loss': (transmitted - received) / transmitted * 100 if transmitted else 100,
+        'rtt': {},
+    }
+    if rtts:
+        ms = [rtt * 1000 for rtt in rtts]
+        avg = sum(ms) / received
+        variance = max(sum(x * x for x in ms) / received - avg * avg, 0)
+        jitter = 0.0
+        if received > 1:
+            jitter = sum(abs(b - a) for a, b in zip(ms, ms[1:])) / (received - 1)
+        stats['rtt'] = {
+            'min': round(min(ms), 3),
+            'avg': round(avg, 3),
+            'max': round(max(ms), 3),
+            'mdev': round(math.sqrt(variance), 3),
+            'jitter': round(jitter, 3),
+        }
+    return stats
+
+
+class _Target(object):
+    def __init__(self):
+        self.transmitted = 0
+        self.rtts = []
+        self.error = None
+
+
+class ICMP(object):
+    """
+    Pings a batch of hosts `count` times each through one ICMP socket
+    """
+    def __init__(self, count=COUNT, interval=INTERVAL, timeout=TIMEOUT, rate=RATE,
+            size=PAYLOAD_SIZE, resolver=None):
+        """
+        :count - echo requests sent to every host
+        :interval - seconds between the requests to a single host
+        :timeout - seconds a reply may take
+        :rate - echo requests sent per second across all of the hosts
+        :size - payload size in bytes
+        :resolver(optional) - amtp.dns.Resolver used to look up the hosts
+        """
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        self.rate = rate
+        self.size = size
+        self.resolver = resolver
+        self.ident = random.randint(0, 0xffff)
+        self.batch = None
+        self.batch_hosts = ()
+        # host -> the greenlet of the batch started by result() it is in
+        self.batches = {}
+        self.next_batch = None
+        self.next_hosts = set()
+
+    def _socket(self):
+        try:
+            return gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_DGRAM,
+                    gevent.socket.IPPROTO_ICMP)
+        except gevent.socket.error as err:
+            if err.errno not in (errno.EACCES, errno.EPERM, errno.EPROTONOSUPPORT):
+                raise
+        return gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_RAW,
+                gevent.socket.IPPROTO_ICMP)
+
+    def _resolve(self, host):
+        if self.resolver is None:
+            return gevent.socket.gethostbyname(host)
+        # ICMPv4 only
+        for address in self.resolver.resolve(host):
+            if family(address) == gevent.socket.AF_INET:
+                return address
+        raise gevent.socket.error('{} has no IPv4 address'.format(host))
+
+    def ping(self, hosts):
+        """
+        Pings hosts and returns a dictionary of their statistics (see
+        summary()), with an 'error' for the hosts which could not be pinged
+        """
+        hosts = list(set(hosts))
+        targets = {}
+        addresses = {}
+        errors = {}
+        jobs = dict((host, gevent.spawn(self._resolve, host)) for host in hosts)
+        gevent.joinall(list(jobs.values()))
+        for host, job in jobs.items():
+            if job.successful():
+                addresses[host] = job.value
+                targets.setdefault(job.value, _Target())
+            else:
+                errors[host] = str(job.exception)
+
+        if targets:
+            try:
+                sock = self._socket()
+            except gevent.socket.error as err:
+                for host in addresses:
+                    errors[host] = 'ICMP socket: {}'.format(os.strerror(err.errno) if err.errno else err)
+                targets = {}
+            else:
+                try:
+                    self._ping(sock, targets)
+                finally:
+                    sock.close()
+
+        results = {}
+        for host in hosts:
+            target = targets.get(addresses.get(host))
+            if target is None:
+                results[host] = summary([], 0)
+                results[host]['error'] = errors[host]
+            else:
+                results[host] = summary(target.rtts, target.transmitted)
+                if target.error and not target.rtts:
+                    results[host]['error'] = target.error
+        return results
+
+    def _ping(self, sock, targets):
+        # (address, seq) -> send time of the requests waiting for a reply
+        pending = {}
+        idle = Event()
+        receiver = gevent.spawn(self._receive, sock, targets, pending, idle)
+        base = random.randint(0, 0xffff)
+        spacing = 1 / self.rate if self.rate else 0
+        try:
+            start = clock()
+            for i in range(self.count):
+                # a round over many hosts may take longer than the interval
+                gevent.sleep(max(start + i * self.interval - clock(), 0))
+                seq = (base + i) & 0xffff
+                packet = build_request(self.ident, seq, self.size)
+                scheduled = clock()
+                for address, target in targets.items():
+                    # sleeping per packet would overshoot, keep to a schedule
+                    scheduled += spacing
+                    if scheduled > clock():
+                        gevent.sleep(scheduled - clock())
+                    target.transmitted += 1
+                    pending[address, seq] = clock()
+                    try:
+                        sock.sendto(packet, (address, 0))
+                    except gevent.socket.error as err:
+                        # unreachable networks and the like, counted as lost
+                        del pending[address, seq]
+                        target.error = os.strerror(err.errno) if err.errno else str(err)
+            if pending:
+                idle.clear()
+                idle.wait(self.timeout)
+        finally:
+            receiver.kill()
+
+    def _receive(self, sock, targets, pending, idle):
+        while True:
+            packet, (address, port) = sock.recvfrom(2048)
+            now = clock()
+            reply = parse_reply(bytearray(packet))
+            if reply is None:
+                continue
+            ident, seq = reply
+            # datagram sockets get their identifier from the kernel and only
+            # ever see their own replies
+            if sock.type == gevent.socket.SOCK_RAW and ident != self.ident:
+                continue
+            sent = pending.pop((address, seq), None)
+            if sent is None:
+                # duplicate or a reply from a previous run
+                continue
+            if now - sent <= self.timeout:
+                targets[address].rtts.append(now - sent)
+            if not pending:
+                idle.set()
+
+    def start(self, hosts):
+        """
+        Starts pinging hosts in the background, the statistics are picked up
+        with result()
+        """
+        self.batch_hosts = set(hosts)
+        self.batch = gevent.spawn(self.ping, self.batch_hosts)
+
+    def result(self, host):
+        """
+        Returns the statistics of host from the background batch. Hosts which
+        are not part of it are pinged in a batch of the hosts asked for until
+        the hub gets to start it (e.g. the pings of a streamed document), each
+        host once however many items ask for it
+        """
+        if self.batch is not None and host in self.batch_hosts:
+            return self.batch.get()[host]
+        return self.queue(host).get()[host]
+
+    def queue(self, host):
+        """
+        Adds host to the batch started once the hub gets to it, unless it is
+        pinged already, and returns the greenlet of the batch it is in
+        """
+        if self.batch is not None and host in self.batch_hosts:
+            return self.batch
+        batch = self.batches.get(host)
+        if batch is None:
+            if self.next_batch is None:
+                self.next_batch = gevent.spawn(self._next_batch)
+            self.next_hosts.add(host)
+            batch = self.batches[host] = self.next_batch
+        return batch
+
+    def _next_batch(self):
+        hosts, self.next_hosts, self.next_batch = self.next_hosts, set(), None
+        return self.ping(hosts)
+
+    def stop(self):
+        if self.batch is not None:
+            self.batch.kill()
+        gevent.killall(set(self.batches.values()))
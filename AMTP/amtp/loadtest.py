@@ -0,0 +1,109 @@
+"""
+In-process HTTP load generator, a gevent replacement for Apache Bench (ab)
+"""
+from __future__ import division
+
+import gevent
+import gevent.socket
+from gevent.pool import Pool
+from geventhttpclient._parser import HTTPParseError
+
+from .clock import clock
+from .histogram import LatencyHistogram
+from .pool import HostPool
+
+REQUEST_TIMEOUT = 30
+BLOCK_SIZE = 64 * 1024
+
+
+class LoadTest(object):
+    """
+    Sends `requests` GET requests to a URL keeping `concurrency` of them in
+    flight at any time, like `ab -n requests -c concurrency url` does
+    """
+    def __init__(self, url, concurrency, requests, timeout=REQUEST_TIMEOUT, resolver=None,
+            shared_pool=None):
+        """
+        :url - geventhttpclient URL object
+        :concurrency - number of requests in flight
+        :requests - total number of requests
+        :timeout - timeout of a single request in seconds
+        :resolver(optional) - amtp.dns.Resolver used to look up the host
+        :shared_pool(optional) - amtp.pool.HostPool of the pings, whose
+            connection slots and rate limiter the load test takes its own
+            from, so both stay within the same budget
+        """
+        self.url = url
+        self.requests = max(int(requests), 0)
+        self.concurrency = max(min(int(concurrency), self.requests), 1)
+        self.timeout = timeout
+        self.resolver = resolver
+        self.shared_pool = shared_pool
+
+        self.remaining = self.requests
+        self.completed = 0
+        self.non_2xx = 0
+        self.errors = {}
+        self.bytes = 0
+        self.elapsed = 0
+        self.latency = LatencyHistogram()
+
+    def _worker(self, http_pool):
+        while self.remaining > 0:
+            self.remaining -= 1
+            start = clock()
+            try:
+                with http_pool.connection(self.url) as http, \
+                        gevent.Timeout(self.timeout, gevent.socket.timeout('timed out')):
+                    res = http.get(self.url.request_uri)
+                    # read in blocks, we only need the size of the body
+                    while True:
+                        block = res.read(BLOCK_SIZE)
+                        if not block:
+                            break
+                        self.bytes += len(block)
+            except (gevent.socket.error, HTTPParseError) as err:
+                name = type(err).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+                continue
+            self.latency.add((clock() - start) * 1000)
+            self.completed += 1
+            if not 200 <= res.status_code < 300:
+                self.non_2xx += 1
+
+    def run(self):
+        """
+        Runs the load test and returns its results (see results())
+        """
+        # clients of our own, the load must not eat the keep-alive connections
+        # of the pings, but the slots and the rate limit are the shared ones
+        limiter = semaphore = None
+        if self.shared_pool is not None:
+            limiter, semaphore = self.shared_pool.limiter, self.shared_pool.semaphore
+        http_pool = HostPool(self.concurrency, self.concurrency, timeout=self.timeout,
+                resolver=self.resolver, limiter=limiter, semaphore=semaphore)
+        group = Pool(self.concurrency)
+        start = clock()
+        try:
+            for i in range(self.concurrency):
+                group.spawn(self._worker, http_pool)
+            group.join()
+        finally:
+            group.kill()
+            http_pool.close()
+        self.elapsed = clock() - start
+        return self.results()
+
+    def results(self):
+        """
+        Returns a dictionary with requests per second, latency percentiles in
+        ms, errors by type, number of non 2xx responses and body bytes read
+        """
+        return {
+            'rps': self.completed / self.elapsed if self.completed and self.elapsed else None,
+            'completed': self.completed,
+            'non_2xx': self.non_2xx,
+            'errors': dict(self.errors),
+            'bytes': self.bytes,
+            'latency': self.latency.summary(),
+        }
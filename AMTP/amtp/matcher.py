@@ -0,0 +1,139 @@
+"""
+Streaming multi-pattern matcher for response bodies
+
+All of the literal expected_response_body patterns are compiled into one
+alternation, so a body is searched for every literal in a single pass.
+Patterns prefixed with 're:' are regular expressions, compiled on their own as
+inline flags and group numbers are theirs.
+"""
+import re
+
+REGEX_PREFIX = 're:'
+MAX_BODY_BYTES = 1024 * 1024
+BLOCK_SIZE = 16 * 1024
+# bytes of the previous block searched again so that matches spanning two
+# blocks are found; literals need no more than their length
+REGEX_OVERLAP = 4096
+
+
+class BodyMatcher(object):
+    """
+    Precompiled set of body patterns which all have to match
+    """
+    def __init__(self, patterns, max_bytes=MAX_BODY_BYTES, block_size=BLOCK_SIZE):
+        """
+        :patterns - list of strings, 're:' prefixed ones are regular expressions
+        :max_bytes - maximum number of body bytes read before giving up
+        :block_size - size of the blocks read from the response
+        """
+        self.patterns = []
+        # index: compiled regular expression
+        self.regexes = {}
+        overlap = 0
+        for pattern in patterns:
+            if pattern.startswith(REGEX_PREFIX):
+                self.patterns.append(pattern[len(REGEX_PREFIX):].encode())
+                self.regexes[len(self.patterns) - 1] = re.compile(self.patterns[-1])
+                overlap = max(overlap, REGEX_OVERLAP)
+            else:
+                literal = pattern.encode()
+                self.patterns.append(re.escape(literal))
+                overlap = max(overlap, len(literal) - 1)
+        self.overlap = overlap
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.all = frozenset(range(len(self.patterns)))
+        self.literals = self.all.difference(self.regexes)
+        # one alternation per set of literals still to be found, the full one
+        # is compiled right away and the rest on first use
+        self._regexes = {}
+        if self.literals:
+            self._regex(self.literals)
+
+    def _regex(self, indexes):
+        regex = self._regexes.get(indexes)
+        if regex is None:
+            regex = re.compile(b'|'.join(b'(?P<_p' + str(i).encode() + b'>' + self.patterns[i] + b')'
+                                         for i in sorted(indexes)))
+            self._regexes[indexes] = regex
+        return regex
+
+    def search(self, data, remaining):
+        """
+        Returns the patterns in remaining which are not found in data
+        """
+        literals = remaining & self.literals
+        pos = 0
+        while literals:
+            match = self._regex(literals).search(data, pos)
+            if match is None:
+                break
+            # several literals may match at the same position, so the search
+            # goes on from there with the literals still missing
+            literals = frozenset(i for i in literals if match.group('_p' + str(i)) is None)
+            pos = match.start()
+        return literals.union(i for i in remaining - self.literals
+                              if self.regexes[i].search(data) is None)
+
+    def scan(self):
+        """
+        Returns a BodyScan for matching a body block by block
+        """
+        return BodyScan(self)
+
+    def match(self, response):
+        """
+        Reads the body of a geventhttpclient response block by block until all
+        of the patterns are found, the body ends or max_bytes are read.
+        Returns True if every pattern was found
+        """
+        scan = self.scan()
+        while scan.wanted():
+            if not scan.feed(response.read(scan.wanted())):
+                break
+        return scan.matched()
+
+    def match_body(self, body):
+        """
+        Returns True if every pattern is found in the byte string body
+        """
+        return not self.search(body[:self.max_bytes], self.all)
+
+
+class BodyScan(object):
+    """
+    The state of matching a body read block by block, so that engines doing
+    their I/O differently share the matching
+    """
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.remaining = matcher.all
+        self.tail = b''
+        self.read = 0
+
+    def wanted(self):
+        """
+        Returns the size of the next block to read, 0 once done
+        """
+        if not self.remaining:
+            return 0
+        return min(self.matcher.block_size, self.matcher.max_bytes - self.read)
+
+    def feed(self, block):
+        """
+        Searches the next block of the body, returns False at its end
+        """
+        if not block:
+            return False
+        self.read += len(block)
+        data = self.tail + block
+        self.remaining = self.matcher.search(data, self.remaining)
+        overlap = self.matcher.overlap
+        self.tail = data[-overlap:] if overlap else b''
+        return True
+
+    def matched(self):
+        """
+        Returns True if every pattern was found
+        """
+        return not self.remaining
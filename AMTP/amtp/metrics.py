@@ -0,0 +1,215 @@
+"""
+Live metrics of a running HTTPPinger in the Prometheus text format
+
+Nothing is added to the hot path: the pinger, the connection pool of its engine
+and HostHealth keep plain integer counters and they are read without locks when
+the metrics are scraped. Served over HTTP on /metrics and/or printed as a
+periodic stats line, both from threads of their own so that they keep
+responding while the asyncio engine blocks the gevent hub.
+"""
+from __future__ import division, print_function
+
+import os
+import sys
+import threading
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+import gevent
+
+from .clock import clock
+
+# seconds between the event loop lag measurements
+LAG_INTERVAL = 0.1
+STATS_INTERVAL = 10
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def open_fds():
+    """
+    Returns the number of open file descriptors or None where /proc is missing
+    """
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+            .replace('"', '\\"')) for key, value in sorted(labels.items())) + '}'
+
+
+class Metrics(object):
+    """
+    Collects the metrics of an HTTPPinger
+    """
+    def __init__(self, pinger, lag_interval=LAG_INTERVAL):
+        """
+        :pinger - the HTTPPinger to report on
+        :lag_interval - seconds between the event loop lag measurements
+        """
+        self.pinger = pinger
+        self.lag_interval = lag_interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.greenlets = []
+        self.threads = []
+        self.stopped = threading.Event()
+        self.server = None
+        self.last = None
+
+    def _monitor_lag(self):
+        while True:
+            start = clock()
+            gevent.sleep(self.lag_interval)
+            # how late the loop got back to us
+            self.lag = max(clock() - start - self.lag_interval, 0)
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def collect(self):
+        """
+        Returns a list of (name, type, help, [(labels, value)]) metrics
+        """
+        pinger = self.pinger
+        engine = pinger.engine
+        connections = pinger.connection_stats()
+        pool = pinger.pool
+        total = pinger.total
+        running = pinger.started - pinger.finished
+        metrics = [
+            ('amtp_pings', 'gauge', 'Pings of the run by state', [
+                ({'state': 'queued'}, total - pinger.started),
+                ({'state': 'running'}, running),
+                ({'state': 'done'}, pinger.finished),
+            ]),
+            ('amtp_pool_greenlets', 'gauge', 'Greenlets in the ping pool',
+                [(None, len(pool))]),
+            ('amtp_pool_size', 'gauge', 'Size of the ping pool', [(None, pool.size)]),
+            ('amtp_connections_active', 'gauge', 'Connection slots in use',
+                [(None, pinger.in_flight())]),
+            ('amtp_connections_limit', 'gauge', 'Connection slots across all hosts',
+                [(None, engine.max_connections)]),
+            ('amtp_hosts', 'gauge', 'Hosts with a client in the connection pool',
+                [(None, connections['hosts'])]),
+            ('amtp_http_requests_total', 'counter', 'HTTP requests started',
+                [(None, connections['requests'])]),
+            ('amtp_http_connects_total', 'counter', 'New HTTP connections',
+                [(None, connections['connects'])]),
+            ('amtp_http_errors_total', 'counter', 'Failed HTTP requests by exception type',
+                [({'type': name}, count) for name, count in sorted(engine.errors().items())]),
+            ('amtp_event_loop_lag_seconds', 'gauge', 'Last measured event loop lag',
+                [(None, self.lag)]),
+            ('amtp_event_loop_lag_max_seconds', 'gauge', 'Highest event loop lag',
+                [(None, self.max_lag)]),
+        ]
+        if pinger.health is not None:
+            health = pinger.health.stats()
+            metrics.append(('amtp_breaker_skipped_total', 'counter',
+                    'Requests skipped by open circuit breakers', [(None, health['skipped'])]))
+            metrics.append(('amtp_breakers_open', 'gauge', 'Hosts with an open circuit breaker',
+                    [(None, health['open'])]))
+        if pinger.modes is not None:
+            probes = pinger.modes.stats()
+            metrics.append(('amtp_probe_requests_total', 'counter',
+                    'Probe requests sent instead of a full GET by kind', [
+                        ({'kind': 'head'}, probes['heads']),
+                        ({'kind': 'ranged'}, probes['ranged']),
+                        ({'kind': 'not_modified'}, probes['not_modified']),
+                    ]))
+            metrics.append(('amtp_probe_bytes_saved_total', 'counter',
+                    'Body bytes the probes did not transfer compared to full GETs',
+                    [(None, probes['saved'])]))
+        if pinger.limiter is not None:
+            metrics.append(('amtp_rate_limit_wait_seconds_total', 'counter',
+                    'Seconds requests waited for rate limit tokens',
+                    [(None, pinger.limiter.waited)]))
+        fds = open_fds()
+        if fds is not None:
+            metrics.append(('amtp_open_fds', 'gauge', 'Open file descriptors', [(None, fds)]))
+        return metrics
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for name, kind, text, samples in self.collect():
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def stats_line(self):
+        """
+        Returns a one line summary, rates are per second since the last call
+        """
+        pinger = self.pinger
+        engine = pinger.engine
+        requests = pinger.connection_stats()['requests']
+        now = clock()
+        rate = 0.0
+        if self.last is not None and now > self.last[0]:
+            rate = (requests - self.last[1]) / (now - self.last[0])
+        self.last = (now, requests)
+        errors = ' '.join('{}={}'.format(name, count)
+                          for name, count in sorted(engine.errors().items()))
+        return ('stats: {}/{} done, {} running, {} queued, pool {}/{}, connections {}/{}, '
+                '{} requests ({:.1f}/s), errors: {}, fds {}, lag {:.1f} ms'.format(
+                pinger.finished, pinger.total, pinger.started - pinger.finished,
+                pinger.total - pinger.started, len(pinger.pool), pinger.pool.size,
+                pinger.in_flight(), engine.max_connections,
+                requests, rate, errors or 'none', open_fds(), self.lag * 1000))
+
+    def _print_stats(self, interval, file):
+        while not self.stopped.wait(interval):
+            print(self.stats_line(), file=file)
+
+    def application(self, env, start_response):
+        if env['PATH_INFO'] not in ('/', '/metrics'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'not found\n']
+        body = self.render().encode('utf8')
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def start(self, port=None, address='127.0.0.1', stats_interval=None, file=sys.stderr):
+        """
+        Starts measuring the event loop lag and optionally serving the metrics
+        on port (0 picks a free one) and printing a stats line every
+        stats_interval seconds
+        """
+        self.greenlets.append(gevent.spawn(self._monitor_lag))
+        self.stopped.clear()
+        if stats_interval:
+            self._thread(self._print_stats, stats_interval, file)
+        if port is not None:
+            self.server = make_server(address, port, self.application,
+                                      handler_class=_QuietHandler)
+            self._thread(self.server.serve_forever)
+
+    def _thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        gevent.killall(self.greenlets)
+        self.greenlets = []
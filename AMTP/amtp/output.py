@@ -0,0 +1,76 @@
+"""
+Streaming NDJSON output of ping results
+
+Every finished ping becomes one compact JSON line:
+{"application": ..., "ping": ..., "items": {...}}
+"""
+import json
+import time
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+
+
+class NDJSONWriter(object):
+    """
+    Writes records as newline delimited JSON, in batches of batch_size lines
+    or at least every flush_interval seconds
+    """
+    def __init__(self, file, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        """
+        :file - text file object the records are written to
+        :batch_size - number of records buffered before a write
+        :flush_interval - maximum number of seconds a record stays buffered
+            (checked whenever a record is written)
+        """
+        self.file = file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.time()
+        self.written = 0
+
+    def write(self, record):
+        self.buffer.append(json.dumps(record, separators=(',', ':')))
+        if len(self.buffer) >= self.batch_size or \
+                time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.written += len(self.buffer)
+            self.buffer = []
+        self.file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+
+def read_records(file):
+    """
+    Yields the records of an NDJSON stream, skipping blank lines and a
+    truncated last line (as left behind by an interrupted run)
+    """
+    for line in file:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # only the last line of an interrupted run may be cut short
+            if line.endswith('\n'):
+                raise
+
+
+def fold(data, records):
+    """
+    Writes the items of the records into the TBMON document data. Returns the
+    number of records folded
+    """
+    count = 0
+    for record in records:
+        data['applications'][record['application']]['pings'][record['ping']]['items'] = record['items']
+        count += 1
+    return count
@@ -0,0 +1,74 @@
+"""
+Check plans - the expected_* tests and items of a TBMON ping compiled once
+
+A plan is immutable and holds everything the per-response checks need in its
+final form, so checking a response does no parsing.
+"""
+from collections import namedtuple
+import re
+
+from .matcher import BodyMatcher, MAX_BODY_BYTES
+
+ITEM_PREFIX = 'do_'
+
+# generated configs repeat the same patterns across thousands of pings,
+# matchers are immutable once built so they are shared
+_matchers = {}
+
+CheckPlan = namedtuple('CheckPlan', [
+    'codes',    # frozenset of int status codes or None
+    'headers',  # tuple of (field, value) pairs or None
+    'body',     # amtp.matcher.BodyMatcher or None
+    'items',    # tuple of (item key, handler function) pairs
+])
+
+
+def compile_headers(headers):
+    """
+    Returns a tuple of (field, value) pairs from 'Field:value' strings, the
+    value is compared as written
+    """
+    compiled = []
+    for header in headers:
+        try:
+            field, value = header.split(':', 1)
+        except ValueError:
+            raise ValueError("invalid expected header '{}'".format(header))
+        compiled.append((field, value))
+    return tuple(compiled)
+
+
+def compile_plan(data, handlers):
+    """
+    Compiles a TBMON ping object into a CheckPlan
+
+    :data - TBMON ping object
+    :handlers - class listing the supported items in ITEMS and providing a
+        do_<item> method for each of them
+    Raises ValueError for unsupported items and invalid regular expressions
+    """
+    codes = None
+    if 'expected_response_codes' in data:
+        codes = frozenset(int(x) for x in data['expected_response_codes'])
+    headers = None
+    if 'expected_headers' in data:
+        headers = compile_headers(data['expected_headers'])
+    body = None
+    if 'expected_response_body' in data:
+        key = (tuple(data['expected_response_body']),
+               int(data.get('response_body_max_bytes', MAX_BODY_BYTES)))
+        body = _matchers.get(key)
+        if body is None:
+            try:
+                body = _matchers[key] = BodyMatcher(*key)
+            except re.error as err:
+                raise ValueError("invalid expected_response_body pattern of ping '{}': {}"
+                                 .format(data.get('name'), err))
+
+    items = []
+    for key in data['items']:
+        handler = getattr(handlers, ITEM_PREFIX + key, None)
+        if key not in handlers.ITEMS or handler is None:
+            raise ValueError("{} does not support item '{}'".format(handlers.__name__, key))
+        items.append((key, handler))
+    return CheckPlan(codes, headers, body, tuple(items))
@@ -0,0 +1,315 @@
+"""
+Shared HTTP connection pool for the HTTP pinger
+
+One geventhttpclient client is kept per (scheme, host, port) so that all pings
+to the same origin share their keep-alive sockets. The connection pools of the
+clients are instrumented to time the DNS, TCP connect and TLS phases of new
+connections for the requests that ask for it (see HostPool.connection)
+"""
+from __future__ import division
+
+import time
+from contextlib import contextmanager
+
+import gevent.local
+import gevent.socket
+from gevent.lock import BoundedSemaphore
+from geventhttpclient import HTTPClient
+from geventhttpclient.connectionpool import ConnectionPool, SSLConnectionPool
+
+from .clock import clock
+from .dns import family, is_ip
+
+MAX_CONNECTIONS = 500
+HOST_CONNECTIONS = 10
+IDLE_TIMEOUT = 30
+CONNECTION_TIMEOUT = 100
+# unread bytes of a body we still read to keep its connection alive
+DRAIN_BYTES = 64 * 1024
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+
+# phase durations of the request made by the current greenlet, if timed
+_timing = gevent.local.local()
+
+
+def _record(phase, seconds):
+    phases = getattr(_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0) + seconds
+
+
+def _addrinfo(address, port):
+    """
+    Returns the getaddrinfo entry of an IPv4 or IPv6 address
+    """
+    if family(address) == gevent.socket.AF_INET6:
+        sockaddr = (address, port, 0, 0)
+    else:
+        sockaddr = (address, port)
+    return family(address), gevent.socket.SOCK_STREAM, gevent.socket.IPPROTO_TCP, '', sockaddr
+
+
+class _CountingPool(object):
+    """
+    Mixin for geventhttpclient connection pools which reports every newly
+    connected and every reused socket back to the owning HostPool and
+    resolves hostnames through its resolver
+    """
+    _tls = False
+
+    def get_socket(self):
+        # _create_socket clears it, also when the connect fails
+        _timing.reused = True
+        sock = super(_CountingPool, self).get_socket()
+        if _timing.reused:
+            self._host_pool.reused += 1
+        return sock
+
+    def _resolve(self):
+        start = clock()
+        try:
+            resolver = self._host_pool.resolver
+            if resolver is None:
+                return super(_CountingPool, self)._resolve()
+            return [_addrinfo(address, self._connection_port)
+                    for address in resolver.resolve(self._connection_host)]
+        finally:
+            # no lookup for an IP address, as in amtp.aio
+            if not is_ip(self._connection_host):
+                _record('dns', clock() - start)
+
+    def _connect_socket(self, sock, address):
+        # _ConnectTimer sits below the SSL pool in the MRO and times the TCP
+        # connect, the rest of this is the TLS handshake
+        phases = getattr(_timing, 'phases', None)
+        if phases is None or not self._tls:
+            return super(_CountingPool, self)._connect_socket(sock, address)
+        connect = phases.get('connect', 0)
+        start = clock()
+        sock = super(_CountingPool, self)._connect_socket(sock, address)
+        _record('tls', clock() - start - (phases.get('connect', 0) - connect))
+        return sock
+
+    def _create_socket(self):
+        _timing.reused = False
+        phases = getattr(_timing, 'phases', None)
+        if phases is None:
+            sock = super(_CountingPool, self)._create_socket()
+            self._host_pool.connects += 1
+            return sock
+        dns, connect = phases.get('dns', 0), phases.get('connect', 0)
+        start = clock()
+        sock = super(_CountingPool, self)._create_socket()
+        self._host_pool.connects += 1
+        if phases.get('connect', 0) == connect:
+            # a geventhttpclient without the _connect_socket hook, TLS included
+            _record('connect', clock() - start - (phases.get('dns', 0) - dns))
+        return sock
+
+
+class _ConnectTimer(object):
+    """
+    Mixin timing the TCP connect of ConnectionPool._connect_socket
+    """
+    def _connect_socket(self, sock, address):
+        start = clock()
+        try:
+            return super(_ConnectTimer, self)._connect_socket(sock, address)
+        finally:
+            _record('connect', clock() - start)
+
+
+def discard_response(response):
+    """
+    Closes the connection of a partially read response instead of handing it
+    back to the pool with the rest of the body still pending
+    """
+    sock, pool = response._sock, response._pool
+    response._sock = response._pool = None
+    if sock is not None and pool is not None:
+        pool.release_socket(sock)
+
+
+def finish_response(response, max_bytes=DRAIN_BYTES):
+    """
+    Makes sure the connection of a response is released. Up to max_bytes of
+    the remaining body are read so that the connection can be reused, for
+    longer bodies the connection is closed
+    """
+    read = 0
+    while not response.message_complete and read < max_bytes:
+        block = response.read(min(max_bytes - read, DRAIN_BYTES))
+        if not block:
+            break
+        read += len(block)
+    if not response.message_complete:
+        discard_response(response)
+
+
+_pool_classes = {}
+
+def _instrument(client, host_pool):
+    """
+    Swaps the class of the client's connection pool for a counting subclass.
+    Done on the instance, so that we don't depend on the constructor arguments
+    of the (SSL)ConnectionPool of a given geventhttpclient version
+    """
+    pool = client._connection_pool
+    cls = pool.__class__
+    if cls not in _pool_classes:
+        if cls is ConnectionPool or not issubclass(cls, ConnectionPool):
+            bases = (_CountingPool, _ConnectTimer, cls)
+        else:
+            # puts _ConnectTimer right above ConnectionPool, below the SSL layer
+            bases = (_CountingPool, cls, _ConnectTimer, ConnectionPool)
+        _pool_classes[cls] = type('Counting' + cls.__name__, bases,
+                {'_tls': issubclass(cls, SSLConnectionPool)})
+    pool.__class__ = _pool_classes[cls]
+    pool._host_pool = host_pool
+
+
+class _Host(object):
+    """
+    A client and its bookkeeping for a single (scheme, host, port)
+    """
+    def __init__(self, client, limit):
+        self.client = client
+        self.semaphore = BoundedSemaphore(limit)
+        self.active = 0
+        self.last_used = time.time()
+
+
+class HostPool(object):
+    """
+    Hands out HTTP clients keyed by (scheme, host, port) with a cap on the
+    connections per host and on the connections overall. Clients which have
+    not been used for idle_timeout seconds are closed.
+    """
+    def __init__(self, max_connections=MAX_CONNECTIONS, host_connections=HOST_CONNECTIONS,
+            idle_timeout=IDLE_TIMEOUT, timeout=CONNECTION_TIMEOUT, resolver=None, limiter=None,
+            semaphore=None):
+        """
+        :max_connections - connections allowed across all hosts
+        :host_connections - connections allowed to a single host
+        :idle_timeout - seconds after which an unused host is evicted
+        :timeout - connection and network timeout of the clients
+        :resolver(optional) - amtp.dns.Resolver used to look up the hosts
+        :limiter(optional) - amtp.ratelimit.RateLimiter every request waits
+            for before it gets a connection slot
+        :semaphore(optional) - semaphore of the connection slots of another
+            HostPool, to keep the connections of both within one budget
+        """
+        self.resolver = resolver
+        self.limiter = limiter
+        self.max_connections = max_connections
+        self.host_connections = min(host_connections, max_connections)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.semaphore = semaphore or BoundedSemaphore(max_connections)
+        self.hosts = {}
+        self.last_sweep = time.time()
+
+        # requests holding a connection slot
+        self.active = 0
+        self.requests = 0
+        self.connects = 0
+        # requests sent on a kept-alive connection
+        self.reused = 0
+        self.evicted = 0
+        # exception type name -> number of requests failed with it
+        self.errors = {}
+
+    @staticmethod
+    def key(url):
+        """
+        Returns the (scheme, host, port) tuple of a geventhttpclient URL
+        """
+        return url.scheme, url.host, url.port
+
+    def _get_host(self, url):
+        key = self.key(url)
+        host = self.hosts.get(key)
+        if host is None:
+            client = HTTPClient.from_url(url,
+                    concurrency=self.host_connections,
+                    connection_timeout=self.timeout,
+                    network_timeout=self.timeout)
+            _instrument(client, self)
+            host = self.hosts[key] = _Host(client, self.host_connections)
+        return host
+
+    @contextmanager
+    def connection(self, url, phases=None):
+        """
+        Context manager yielding the shared client for url. A connection slot
+        for the host and one from the global budget are held until exit, so
+        the response should be read inside the block. With a rate limiter
+        the request waits for its tokens before it takes any slot, so nothing
+        is opened faster than the limits allow.
+
+        :phases(optional) - dictionary the seconds spent on the dns, connect
+            and tls phases of a new connection made inside the block are
+            added to
+        """
+        self.sweep()
+        if self.limiter is not None:
+            self.limiter.acquire(self.key(url))
+        host = self._get_host(url)
+        # host slot first - waiting on a busy host must not hold a global slot
+        host.semaphore.acquire()
+        try:
+            self.semaphore.acquire()
+            try:
+                host.active += 1
+                self.active += 1
+                self.requests += 1
+                _timing.phases = phases
+                try:
+                    yield host.client
+                except Exception as err:
+                    name = type(err).__name__
+                    self.errors[name] = self.errors.get(name, 0) + 1
+                    raise
+                finally:
+                    _timing.phases = None
+                    host.active -= 1
+                    self.active -= 1
+                    host.last_used = time.time()
+            finally:
+                self.semaphore.release()
+        finally:
+            host.semaphore.release()
+
+    def sweep(self, now=None):
+        """
+        Closes the clients of hosts which have been idle for idle_timeout
+        """
+        now = now or time.time()
+        if now - self.last_sweep < self.idle_timeout / 2:
+            return
+        self.last_sweep = now
+        for key, host in list(self.hosts.items()):
+            if not host.active and now - host.last_used >= self.idle_timeout:
+                del self.hosts[key]
+                host.client.close()
+                if self.limiter is not None:
+                    self.limiter.discard(key)
+                self.evicted += 1
+
+    def close(self):
+        for host in self.hosts.values():
+            host.client.close()
+        self.hosts.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary with the connection reuse statistics
+        """
+        return {
+            'hosts': len(self.hosts),
+            'requests': self.requests,
+            'connects': self.connects,
+            'reused': self.reused,
+            'reuse_ratio': self.reused / self.requests if self.requests else 0.0,
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,322 @@
+"""
+Probe requests of the HTTP pinger and the engines sending them
+
+A probe is the requests_count requests of a ping whose outcome is shared by
+its request_* items. Attempt is a single one of them without any I/O: the
+circuit breaker, the adaptive timeout, the request picked by the probe modes,
+the checks of the ping and the bookkeeping of the outcome. An engine does the
+I/O and reports every step to the attempt, so all engines give the same
+results for a TBMON document.
+
+HTTPPinger talks to its engine through the Engine interface only. GeventEngine
+sends the requests of a ping from its greenlet when an item asks for them,
+amtp.aio.AsyncEngine the ones of all pings on an asyncio event loop ahead of
+the run.
+"""
+from __future__ import print_function
+
+import sys
+
+import gevent
+import gevent.socket
+from gevent.pool import Pool
+from geventhttpclient._parser import HTTPParseError
+
+from .clock import clock
+from .histogram import LatencyHistogram
+from .pool import finish_response
+from .probemode import ProbeModes
+
+
+def new_probe():
+    """
+    Returns the outcome of a probe without any requests
+    """
+    # phases - phase: [total seconds, number of requests it occurred in]
+    return {'successful': 0, 'failed': 0, 'latency': LatencyHistogram(), 'phases': {}}
+
+
+class Attempt(object):
+    """
+    A single probe request of a ping. The engine drives it like this:
+
+        attempt = Attempt(ping, probe, key, health, modes)
+        if attempt.allowed():
+            try:
+                # holding a connection slot, within attempt.timeout
+                attempt.start()
+                method, headers = attempt.request()
+                response = send(method, headers)
+                if attempt.retry(response.status_code):
+                    finish(response)
+                    response = send(*attempt.request())
+                passed = attempt.received(response.status_code, header)
+                if passed is None:
+                    passed = match the body with ping.plan.body
+                finish(response)
+                attempt.responded(response.status_code, header, passed, phases)
+            except timeout:
+                attempt.timed_out()
+            except connection or HTTP error:
+                attempt.failed()
+        attempt.finish()
+
+    header is a function returning the first value of a response header or None
+    """
+    def __init__(self, ping, probe, key, health=None, modes=None):
+        """
+        :ping - Ping the request is made for
+        :probe - outcome the request is recorded in, see new_probe()
+        :key - host key of the ping's URL, see amtp.pool.HostPool.key
+        :health(optional) - amtp.health.HostHealth
+        :modes(optional) - amtp.probemode.ProbeModes
+        """
+        self.ping = ping
+        self.probe = probe
+        self.key = key
+        self.health = health
+        self.modes = modes
+        self.timeout = ping.request_timeout
+        self.started = None
+        self.headers = None
+        self.method = 'GET'
+        self.request_headers = {}
+        self.passed = False
+
+    def allowed(self):
+        """
+        Returns False if the host keeps failing, the request then counts as
+        lost without waiting for it. Sets the timeout of the request
+        """
+        if not self.health:
+            return True
+        if not self.health.allow(self.key):
+            self.probe['failed'] += 1
+            return False
+        self.timeout = self.health.timeout(self.key, self.ping.request_timeout)
+        return True
+
+    def start(self):
+        """
+        Called once a connection slot is ours. Waiting for one in a busy pool
+        says nothing about the health of the host
+        """
+        self.started = clock()
+
+    def request(self):
+        """
+        Returns the method and headers of the request to send
+        """
+        if self.modes is not None:
+            self.method, self.request_headers = self.modes.request(self.ping.validator_key,
+                                                                   self.ping.plan)
+        return self.method, self.request_headers
+
+    def retry(self, status_code):
+        """
+        Returns True if the request has to be sent again, after the response
+        was finished, as picked by another call of request()
+        """
+        return self.modes is not None and \
+            self.modes.retry(self.ping.validator_key, self.method, status_code)
+
+    def received(self, status_code, header):
+        """
+        Called once the headers of the final response are in. Returns if the
+        response passes the checks of the ping, None if that depends on its
+        body as well
+        """
+        self.headers = clock()
+        plan = self.ping.plan
+        if self.modes is not None:
+            passed = self.modes.cached(self.ping.validator_key, status_code)
+            if passed is not None:
+                return passed
+        status_code = ProbeModes.status_code(self.request_headers, status_code)
+        if plan.codes is not None and status_code not in plan.codes:
+            return False
+        if plan.headers is not None and not any(header(field) == value
+                                                for field, value in plan.headers):
+            return False
+        if plan.body is not None:
+            return None
+        return True
+
+    def responded(self, status_code, header, passed, phases):
+        """
+        Records the response once it was read
+
+        :phases - dictionary of the dns, connect and tls seconds of a new
+            connection made for the request
+        """
+        if self.modes is not None:
+            self.modes.record(self.ping.validator_key, self.method, status_code, header, passed)
+        # a response stalling past the timeout is lost, even if the tests
+        # passed on its first part
+        self.passed = passed
+        end = clock()
+        elapsed = end - self.started
+        self.probe['latency'].add(elapsed * 1000)
+        # what the request did not spend on a new connection is the request
+        # going out and the server thinking about it
+        phases['ttfb'] = self.headers - self.started - sum(phases.values())
+        phases['transfer'] = end - self.headers
+        for phase, seconds in phases.items():
+            total = self.probe['phases'].setdefault(phase, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+        if self.health:
+            self.health.success(self.key, elapsed)
+
+    def _elapsed(self):
+        return clock() - self.started if self.started else 0
+
+    def timed_out(self):
+        if self.health:
+            self.health.failure(self.key, self._elapsed(), self.timeout,
+                    self.ping.request_timeout)
+
+    def failed(self):
+        if self.health:
+            self.health.failure(self.key, self._elapsed())
+
+    def finish(self):
+        """
+        Counts the request as successful or failed
+        """
+        if self.passed:
+            self.probe['successful'] += 1
+        else:
+            self.probe['failed'] += 1
+
+
+class Engine(object):
+    """
+    Sends the probe requests of pings, the interface HTTPPinger uses
+    """
+    # True if prepare() sends the probe requests ahead of the run
+    ahead = False
+    # connection slots across all hosts
+    max_connections = 0
+
+    @property
+    def active(self):
+        """
+        Number of probe requests holding a connection slot
+        """
+        return 0
+
+    def prepare(self, pings, deadline=None):
+        """
+        Sends the probe requests of pings ahead of the run and returns a
+        dictionary of Ping to its probe, pings not probed within deadline
+        seconds are missing. Nothing is sent unless the engine is ahead
+        """
+        return {}
+
+    def probe(self, ping):
+        """
+        Sends the probe requests of a ping and returns the probe
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Returns the connection reuse statistics, see amtp.pool.HostPool.stats
+        """
+        raise NotImplementedError
+
+    def errors(self):
+        """
+        Returns a dictionary of exception type name to the number of probe
+        requests failed with it
+        """
+        return {}
+
+
+def _header(response):
+    """
+    Returns a function looking up the first value of a header of a
+    geventhttpclient response
+    """
+    return lambda field: (response._headers_index.get_all(field) or [None])[0]
+
+
+class GeventEngine(Engine):
+    """
+    Sends the probe requests of a ping from its greenlet, through the shared
+    amtp.pool.HostPool
+    """
+    def __init__(self, http_pool, health=None, modes=None):
+        """
+        :http_pool - amtp.pool.HostPool shared between pings
+        :health(optional) - amtp.health.HostHealth shared between pings
+        :modes(optional) - amtp.probemode.ProbeModes picking the requests
+        """
+        self.http_pool = http_pool
+        self.health = health
+        self.modes = modes
+
+    @property
+    def active(self):
+        return self.http_pool.active
+
+    @property
+    def max_connections(self):
+        return self.http_pool.max_connections
+
+    def stats(self):
+        return self.http_pool.stats()
+
+    def errors(self):
+        return self.http_pool.errors
+
+    def probe(self, ping):
+        """
+        Sends requests_count requests, up to requests_concurrency at a time
+        """
+        probe = new_probe()
+        group = Pool(min(ping.requests_concurrency, ping.requests_count))
+        try:
+            for i in range(ping.requests_count):
+                group.spawn(self._probe_once, ping, probe)
+            group.join()
+        finally:
+            # no-op unless the ping itself is being cancelled
+            group.kill()
+        return probe
+
+    def _probe_once(self, ping, probe):
+        """
+        Makes a single request and records it in probe
+        """
+        attempt = Attempt(ping, probe, self.http_pool.key(ping.url), self.health, self.modes)
+        if not attempt.allowed():
+            return
+        phases = {}
+        try:
+            # the pool clients are shared, so our timeout is enforced here
+            with self.http_pool.connection(ping.url, phases) as http, \
+                    gevent.Timeout(attempt.timeout, gevent.socket.timeout('timed out')):
+                attempt.start()
+                res = ping.get_response(http, *attempt.request())
+                if attempt.retry(res.status_code):
+                    finish_response(res)
+                    res = ping.get_response(http, *attempt.request())
+                header = _header(res)
+                try:
+                    passed = attempt.received(res.status_code, header)
+                    if passed is None:
+                        passed = ping.plan.body.match(res)
+                finally:
+                    finish_response(res)
+                attempt.responded(res.status_code, header, passed, phases)
+        except gevent.socket.timeout:
+            attempt.timed_out()
+        except gevent.socket.error:
+            attempt.failed()
+        except HTTPParseError as err:
+            # closed without (a valid) response, as good as refused
+            print(err, ping.url, file=sys.stderr)
+            attempt.failed()
+        attempt.finish()
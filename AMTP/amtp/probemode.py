@@ -0,0 +1,164 @@
+"""
+Bandwidth saving probe requests
+
+The request of a probe is picked from the checks of its ping:
+
+    HEAD        no expected_response_body, only the status and headers count
+    ranged GET  a Range of the first response_body_max_bytes, the body
+                matcher never reads past them anyway
+
+GETs are conditional (If-None-Match / If-Modified-Since) once the target has
+sent an ETag or Last-Modified. A 304 means the resource did not change, so
+the outcome of the last full response is reused. The validators and outcomes
+can be saved and loaded, so repeated runs send conditional requests from the
+start. The bytes a full GET would have transferred on top are counted as saved.
+"""
+import hashlib
+import json
+import re
+
+# answers of servers which don't do HEAD
+HEAD_REFUSED = (405, 501)
+_CONTENT_RANGE = re.compile(r'bytes\s+\d+-\d+/(\d+)')
+
+
+def validator_key(url, plan):
+    """
+    Returns the cache key of a ping: its URL and a digest of its checks, as the
+    reused outcome depends on both
+    """
+    checks = repr((sorted(plan.codes) if plan.codes is not None else None, plan.headers,
+                   plan.body.patterns if plan.body is not None else None,
+                   plan.body.max_bytes if plan.body is not None else None))
+    return '{} {}'.format(url, hashlib.sha1(checks.encode('utf8')).hexdigest()[:16])
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProbeModes(object):
+    """
+    Picks the probe requests and keeps the validators of the responses.
+    Engine neutral, the engines pass status codes and a header(field)
+    function returning the first value of a response header or None
+    """
+    def __init__(self, path=None):
+        """
+        :path(optional) - JSON file the validators are loaded from and saved to
+        """
+        self.path = path
+        # key -> [etag, last modified, outcome of the tests, body length]
+        self.cache = {}
+        # keys of the pings whose server refused a HEAD
+        self.no_head = set()
+        self.heads = 0
+        self.ranged = 0
+        self.not_modified = 0
+        self.saved = 0
+        if path:
+            self.load(path)
+
+    def load(self, path):
+        try:
+            with open(path) as file:
+                self.cache.update(json.load(file))
+        except (IOError, OSError, ValueError):
+            # no cache yet, or a broken one which is rewritten on save
+            pass
+
+    def save(self, path=None):
+        path = path or self.path
+        if path:
+            with open(path, 'w') as file:
+                json.dump(self.cache, file)
+
+    def request(self, key, plan):
+        """
+        Returns the (method, headers) of the next probe request of a ping
+        """
+        if plan.body is None and key not in self.no_head:
+            return 'HEAD', {}
+        headers = {}
+        if plan.body is not None:
+            headers['Range'] = 'bytes=0-{}'.format(plan.body.max_bytes - 1)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry[0]:
+                headers['If-None-Match'] = entry[0]
+            if entry[1]:
+                headers['If-Modified-Since'] = entry[1]
+        return 'GET', headers
+
+    def retry(self, key, method, status_code):
+        """
+        Returns True if a HEAD was refused and has to be sent as a GET, which
+        the ping then uses from now on
+        """
+        if method == 'HEAD' and status_code in HEAD_REFUSED:
+            self.no_head.add(key)
+            return True
+        return False
+
+    def cached(self, key, status_code):
+        """
+        Returns the outcome of the last full response for a 304, None otherwise
+        """
+        entry = self.cache.get(key)
+        if status_code != 304 or entry is None:
+            return None
+        self.not_modified += 1
+        self.saved += entry[3] or 0
+        return entry[2]
+
+    @staticmethod
+    def status_code(headers, status_code):
+        """
+        Returns the status code the expected codes are checked against, a 206
+        answering our Range stands for the 200 of the full GET
+        """
+        if status_code == 206 and 'Range' in headers:
+            return 200
+        return status_code
+
+    def record(self, key, method, status_code, header, passed):
+        """
+        Accounts a tested response and keeps its validators and outcome
+        """
+        if status_code == 304:
+            # accounted by cached()
+            return
+        length = _int(header('Content-Length'))
+        if method == 'HEAD':
+            self.heads += 1
+            self.saved += length or 0
+            return
+        if status_code == 206:
+            match = _CONTENT_RANGE.match(header('Content-Range') or '')
+            if match:
+                self.ranged += 1
+                total = int(match.group(1))
+                self.saved += max(total - (length or 0), 0)
+                length = total
+        etag, modified = header('ETag'), header('Last-Modified')
+        if etag or modified:
+            self.cache[key] = [etag, modified, bool(passed), length]
+        else:
+            self.cache.pop(key, None)
+
+    def merge(self, stats, cache):
+        """
+        Adds the stats() and the validators of another instance, e.g. of a worker
+        """
+        self.heads += stats['heads']
+        self.ranged += stats['ranged']
+        self.not_modified += stats['not_modified']
+        self.saved += stats['saved']
+        self.cache.update(cache or {})
+
+    def stats(self):
+        return {'heads': self.heads, 'ranged': self.ranged,
+                'not_modified': self.not_modified, 'saved': self.saved}
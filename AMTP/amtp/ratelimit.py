@@ -0,0 +1,119 @@
+"""
+Request rate limits and the file descriptor budget of a run
+
+Token buckets limit the rate requests are started at, for the whole run and
+per host, so that a big run neither floods its targets nor burns through
+ephemeral ports with connections in TIME_WAIT. fd_budget() caps the number of
+connections so that sockets never fail with EMFILE, which would show up as
+request loss of perfectly healthy targets.
+"""
+from __future__ import division
+
+import gevent
+
+from .clock import clock
+from .metrics import open_fds
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# seconds worth of tokens a bucket can save up
+BURST = 0.1
+# descriptors kept free for files, the ICMP socket, the metrics server etc.
+FD_RESERVE = 32
+
+
+class TokenBucket(object):
+    """
+    Hands out `rate` tokens per second with bursts of up to `burst` tokens.
+    Tokens are reserved in the order they are asked for, so waiters don't
+    overtake each other
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate * BURST, 1)
+        self.tokens = self.burst
+        self.last = clock()
+
+    def reserve(self):
+        """
+        Takes a token and returns the number of seconds to wait before using it
+        """
+        now = clock()
+        self.tokens = min(self.tokens + (now - self.last) * self.rate, self.burst)
+        self.last = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            gevent.sleep(delay)
+
+
+class RateLimiter(object):
+    """
+    A token bucket for the whole run and one per host
+    """
+    def __init__(self, rate=None, host_rate=None):
+        """
+        :rate(optional) - requests per second across all hosts
+        :host_rate(optional) - requests per second to a single host
+        """
+        self.bucket = TokenBucket(rate) if rate else None
+        self.host_rate = host_rate
+        self.hosts = {}
+        self.waited = 0.0
+
+    def acquire(self, key):
+        """
+        Waits until a request to the host can be started
+
+        :key - host key, see amtp.pool.HostPool.key
+        """
+        start = clock()
+        # host first - waiting for a slow host must not hold a token of the run
+        if self.host_rate:
+            self.host_bucket(key).acquire()
+        if self.bucket is not None:
+            self.bucket.acquire()
+        self.waited += clock() - start
+
+    def host_bucket(self, key):
+        bucket = self.hosts.get(key)
+        if bucket is None:
+            bucket = self.hosts[key] = TokenBucket(self.host_rate)
+        return bucket
+
+    def discard(self, key):
+        self.hosts.pop(key, None)
+
+
+def fd_budget(connections, reserve=FD_RESERVE):
+    """
+    Returns how many of connections can be open at the same time without
+    running out of file descriptors. The soft RLIMIT_NOFILE is raised
+    towards the hard limit first if that is needed
+
+    :reserve - descriptors to keep free for everything else
+    """
+    if resource is None:
+        return connections
+    used = open_fds()
+    if used is None:
+        # no /proc, assume stdio and a few more
+        used = 8
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = used + reserve + connections
+    if soft != resource.RLIM_INFINITY and needed > soft:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+            soft = limit
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return connections
+    return max(min(connections, soft - used - reserve), 1)
@@ -0,0 +1,56 @@
+"""
+TBMON schema validation with a process-wide cache of compiled validators
+"""
+import json
+import os
+
+from jsonschema.validators import validator_for
+
+SCHEMA_PATH = 'schema/TBMON_HTTP_Ping_Schema.json'
+
+_validators = {}
+
+
+def get_validator(path):
+    """
+    Returns the validator for the JSON schema file at path. The schema is
+    loaded and checked once per process
+    """
+    path = os.path.realpath(path)
+    validator = _validators.get(path)
+    if validator is None:
+        with open(path, 'r', encoding='utf8') as json_file:
+            schema = json.load(json_file)
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        validator = _validators[path] = cls(schema)
+    return validator
+
+
+class PingValidator(object):
+    """
+    Validates the ping objects of a TBMON document one at a time. Each ping is
+    checked against the full schema as the only ping of a copy of its
+    application, so no knowledge of the schema layout is needed and an invalid
+    ping does not require the rest of the document to be validated again
+    """
+    def __init__(self, validator, data):
+        """
+        :validator - jsonschema validator of the TBMON schema
+        :data - TBMON document the pings belong to
+        """
+        self.validator = validator
+        self.skeleton = dict((key, value) for key, value in data.items() if key != 'applications')
+        self.skeleton['applications'] = {}
+        self.data = data
+
+    def validate(self, application, ping):
+        """
+        Raises jsonschema.ValidationError if the ping is invalid
+        """
+        app = self.skeleton['applications'].get(application)
+        if app is None:
+            app = dict(self.data['applications'][application])
+            self.skeleton['applications'] = {application: app}
+        app['pings'] = {ping: self.data['applications'][application]['pings'][ping]}
+        self.validator.validate(self.skeleton)
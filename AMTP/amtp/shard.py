@@ -0,0 +1,36 @@
+"""
+Splitting of a TBMON document into shards for worker processes
+"""
+
+
+def assign(pings, count):
+    """
+    Splits (application, ping, host) tuples into count lists of (application,
+    ping) pairs. Pings to the same host stay in one shard, so that they can
+    share connections, and the biggest hosts are placed first on the least
+    loaded shard
+    """
+    hosts = {}
+    for application, ping, host in pings:
+        hosts.setdefault(host, []).append((application, ping))
+    shards = [[] for i in range(count)]
+    for group in sorted(hosts.values(), key=len, reverse=True):
+        min(shards, key=len).extend(group)
+    return [shard for shard in shards if shard]
+
+
+def subset(data, pings):
+    """
+    Returns a TBMON document with only the given (application, ping) pairs.
+    The ping objects are shared with data, not copied
+    """
+    shard = dict((key, value) for key, value in data.items() if key != 'applications')
+    shard['applications'] = {}
+    for application, ping in pings:
+        if application not in shard['applications']:
+            app = dict(data['applications'][application])
+            app['pings'] = {}
+            shard['applications'][application] = app
+        shard['applications'][application]['pings'][ping] = \
+                data['applications'][application]['pings'][ping]
+    return shard
@@ -0,0 +1,181 @@
+"""
+Append-only local store of ping results with precomputed rollups
+
+Results are kept in an SQLite database. Every write also updates per-target
+aggregates over 1 minute and 1 hour buckets, so questions like "targets with
+loss in the last hour" are answered from the rollups index instead of the raw
+results.
+
+Numeric item values are stored as they are; object values (request_latency)
+are stored per field as '<item>.<field>', e.g. 'request_latency.p95'.
+"""
+from __future__ import division
+
+import sqlite3
+import time
+
+BATCH_SIZE = 500
+# rollup bucket sizes in seconds
+RESOLUTIONS = (60, 3600)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    application TEXT NOT NULL,
+    ping TEXT NOT NULL,
+    name TEXT,
+    PRIMARY KEY (application, ping)
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    application TEXT NOT NULL,
+    ping TEXT NOT NULL,
+    item TEXT NOT NULL,
+    value REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    application TEXT NOT NULL,
+    ping TEXT NOT NULL,
+    item TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    nonzero INTEGER NOT NULL,
+    PRIMARY KEY (resolution, application, ping, item, bucket)
+);
+CREATE INDEX IF NOT EXISTS rollups_item ON rollups (resolution, item, bucket);
+"""
+
+
+def flatten(items):
+    """
+    Yields (item, value, error, timestamp) for the numeric values of a TBMON
+    items object
+    """
+    for key, item in items.items():
+        value = item.get('value')
+        error = item.get('error')
+        timestamp = item.get('timestamp')
+        if isinstance(value, dict):
+            for field, field_value in value.items():
+                if isinstance(field_value, (int, float)):
+                    yield '{}.{}'.format(key, field), field_value, error, timestamp
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield key, value, error, timestamp
+        elif error:
+            yield key, None, error, timestamp
+
+
+class ResultStore(object):
+    """
+    Batched writer and reader of the result database
+    """
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        """
+        :path - path of the SQLite database, created if missing
+        :batch_size - number of records buffered before they are written
+        """
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.run = None
+        self.records = []
+
+    def start_run(self, started=None):
+        with self.db:
+            cursor = self.db.execute('INSERT INTO runs (started) VALUES (?)',
+                    (int(started or time.time()),))
+        self.run = cursor.lastrowid
+        return self.run
+
+    def add(self, record, name=None):
+        """
+        Buffers the result record of a ping ({application, ping, items})
+
+        :name(optional) - human readable name of the target
+        """
+        if self.run is None:
+            self.start_run()
+        self.records.append((record, name))
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered records and their rollups in one transaction
+        """
+        if not self.records:
+            return
+        now = int(time.time())
+        rows = []
+        targets = []
+        rollups = {}
+        for record, name in self.records:
+            application, ping = record['application'], record['ping']
+            targets.append((application, ping, name))
+            for key, value, error, timestamp in flatten(record['items']):
+                timestamp = int(timestamp or now)
+                rows.append((self.run, timestamp, application, ping, key, value, error))
+                if value is None:
+                    continue
+                for resolution in RESOLUTIONS:
+                    bucket = timestamp // resolution * resolution
+                    rollup_key = (resolution, bucket, application, ping, key)
+                    rollup = rollups.get(rollup_key)
+                    if rollup is None:
+                        rollups[rollup_key] = [1, value, value, value, int(value != 0)]
+                    else:
+                        rollup[0] += 1
+                        rollup[1] += value
+                        rollup[2] = min(rollup[2], value)
+                        rollup[3] = max(rollup[3], value)
+                        rollup[4] += int(value != 0)
+        self.records = []
+
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO targets VALUES (?, ?, ?)', targets)
+            self.db.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('INSERT OR IGNORE INTO rollups VALUES (?, ?, ?, ?, ?, 0, 0, ?, ?, 0)',
+                    [key + (rollup[2], rollup[3]) for key, rollup in rollups.items()])
+            self.db.executemany('''UPDATE rollups SET count = count + ?, sum = sum + ?,
+                    min = MIN(min, ?), max = MAX(max, ?), nonzero = nonzero + ?
+                    WHERE resolution = ? AND bucket = ? AND application = ?
+                    AND ping = ? AND item = ?''',
+                    [tuple(rollup) + key for key, rollup in rollups.items()])
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def query(self, item, since, above=None, resolution=None):
+        """
+        Returns (application, ping, name, count, avg, min, max, nonzero) rows
+        aggregated over the rollups of item since a UNIX timestamp, optionally
+        only the targets whose maximum is above a threshold
+
+        :resolution(optional) - rollup bucket size, by default 1m buckets are
+            used for the last 6 hours and 1h buckets for longer periods
+        """
+        if resolution is None:
+            resolution = RESOLUTIONS[0] if time.time() - since <= 6 * 3600 else RESOLUTIONS[-1]
+        sql = '''SELECT r.application, r.ping, t.name, SUM(r.count), SUM(r.sum) / SUM(r.count),
+                MIN(r.min), MAX(r.max), SUM(r.nonzero)
+                FROM rollups r LEFT JOIN targets t
+                ON t.application = r.application AND t.ping = r.ping
+                WHERE r.resolution = ? AND r.item = ? AND r.bucket >= ?
+                GROUP BY r.application, r.ping'''
+        # the bucket containing `since` is included as a whole
+        params = [resolution, item, since // resolution * resolution]
+        if above is not None:
+            sql += ' HAVING MAX(r.max) > ?'
+            params.append(above)
+        sql += ' ORDER BY MAX(r.max) DESC'
+        return self.db.execute(sql, params).fetchall()
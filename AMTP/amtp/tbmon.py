@@ -0,0 +1,224 @@
+"""
+Incremental reading and writing of TBMON documents
+
+iter_document() parses a document chunk by chunk and yields every ping as
+soon as it has been read, so a run can start probing before a large config
+has finished loading and memory use does not grow with the size of the file.
+Only the values of single pings and of the other small fields are decoded as
+a whole (with json.JSONDecoder.raw_decode), the applications and pings objects
+are walked member by member.
+"""
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+# the rest of a buffer which may be a number cut off by the end of the chunk
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+_decoder = json.JSONDecoder()
+_encoder = json.JSONEncoder()
+
+
+class _Scanner(object):
+    """
+    JSON tokens over a text file read in chunks
+    """
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.offset = 0
+
+    def _fill(self):
+        """
+        Appends the next chunk to the unread part of the buffer, returns
+        False at the end of the file
+        """
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message):
+        return ValueError('{} at character {} of the TBMON document'.format(
+            message, self.offset + self.pos))
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character without consuming it
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise self.error('unexpected end')
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise self.error("expected '{}', got '{}'".format("' or '".join(chars), char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decodes the value at the current position
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # most likely cut off at the end of the buffer
+                if self._fill():
+                    continue
+                raise
+            # a number at the end of the buffer may go on in the next chunk,
+            # raw_decode stops short of a cut off fraction or exponent ("1.")
+            if NUMBER_TAIL.match(self.buffer, end) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """
+        Yields the keys of the object at the current position. The caller
+        has to consume the value of every key before asking for the next one
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise self.error('expected a key')
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def end(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                raise self.error('extra data')
+            if not self._fill():
+                return
+
+
+def iter_document(file, chunk_size=CHUNK_SIZE):
+    """
+    Yields the parts of a TBMON document read from a text file in order:
+
+        ('ping', application, application_fields, ping, ping_data) for every ping
+        ('application', application, application_fields) after its last ping
+        ('document', fields) at the end
+
+    application_fields and fields hold the members other than pings and
+    applications. The application_fields of a ping event are complete only if
+    they come before "pings" in the file, they are filled in as read.
+    Raises ValueError for malformed documents
+    """
+    scanner = _Scanner(file, chunk_size)
+    fields = {}
+    for key in scanner.members():
+        if key != 'applications':
+            fields[key] = scanner.value()
+            continue
+        for application in scanner.members():
+            application_fields = {}
+            for application_key in scanner.members():
+                if application_key != 'pings':
+                    application_fields[application_key] = scanner.value()
+                    continue
+                for ping in scanner.members():
+                    yield 'ping', application, application_fields, ping, scanner.value()
+            yield 'application', application, application_fields
+    scanner.end()
+    yield 'document', fields
+
+
+def load(file, chunk_size=CHUNK_SIZE):
+    """
+    Returns the whole TBMON document, like json.load
+    """
+    applications = {}
+    data = {}
+    for event in iter_document(file, chunk_size):
+        if event[0] == 'ping':
+            application = applications.setdefault(event[1], {'pings': {}})
+            application['pings'][event[3]] = event[4]
+        elif event[0] == 'application':
+            applications.setdefault(event[1], {'pings': {}}).update(event[2])
+        else:
+            data.update(event[1])
+    data['applications'] = applications
+    return data
+
+
+def iter_applications(events, fields):
+    """
+    Turns the events of iter_document back into the applications of
+    write_document, to copy a document through without holding it in memory.
+    The pings of an application have to be consumed before the next one is
+    asked for. The members of the applications and of the document are filled
+    into their application_fields and fields as they are read
+
+    :events - iterable of iter_document events
+    :fields - dictionary the other members of the document are put in
+    """
+    events = iter(events)
+    # the event read ahead of the one being handed out
+    pending = [next(events)]
+
+    def pings(application_fields):
+        event = pending[0]
+        while event[0] == 'ping':
+            yield event[3], event[4]
+            event = next(events)
+        application_fields.update(event[2])
+        pending[0] = next(events)
+
+    while pending[0][0] != 'document':
+        application_fields = {}
+        yield pending[0][1], application_fields, pings(application_fields)
+    fields.update(pending[0][1])
+
+
+def write_document(file, applications, fields=None):
+    """
+    Writes a TBMON document without holding it in memory. The members of an
+    application are written after its pings and the ones of the document
+    after the applications, so they may be filled in while these are read
+
+    :applications - iterable of (application, application_fields, pings),
+        pings being an iterable of (ping, ping_data)
+    :fields(optional) - other members of the document
+    """
+    file.write('{"applications": {')
+    for i, (application, application_fields, pings) in enumerate(applications):
+        file.write('{}{}: {{"pings": {{'.format(', ' if i else '', _encoder.encode(application)))
+        for j, (ping, ping_data) in enumerate(pings):
+            file.write('{}{}: {}'.format(', ' if j else '', _encoder.encode(ping),
+                                          _encoder.encode(ping_data)))
+        file.write('}')
+        for key, value in application_fields.items():
+            file.write(', {}: {}'.format(_encoder.encode(key), _encoder.encode(value)))
+        file.write('}')
+    file.write('}')
+    for key, value in (fields or {}).items():
+        file.write(', {}: {}'.format(_encoder.encode(key), _encoder.encode(value)))
+    file.write('}')
@@ -1,21 +1,39 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
-from jsonschema import validate
+from jsonschema import ValidationError
 from gevent.pool import Pool
-import gevent.socket
+import gevent
 
-from geventhttpclient import HTTPClient
 from geventhttpclient.url import URL
-from geventhttpclient._parser import HTTPParseError
+
+from amtp.clock import clock
+from amtp.pool import HostPool, MAX_CONNECTIONS, HOST_CONNECTIONS
+from amtp.probe import GeventEngine, new_probe
+from amtp.loadtest import LoadTest
+from amtp.dns import Resolver, DNSError
+from amtp.plan import compile_plan
+from amtp.shard import assign, subset
+from amtp.output import NDJSONWriter, BATCH_SIZE
+from amtp.schema import get_validator, PingValidator, SCHEMA_PATH
+from amtp.store import ResultStore
+from amtp.health import HostHealth, FAILURE_THRESHOLD
+from amtp.icmp import ICMP
+from amtp.metrics import Metrics
+from amtp.tbmon import iter_document
+from amtp.ratelimit import RateLimiter, fd_budget, FD_RESERVE
+from amtp.probemode import ProbeModes, validator_key
+from amtp.delta import DeltaWriter
 
 import os
 import sys
 import time
 import re
 import argparse
+import multiprocessing
+import signal
+import traceback
 from pprint import pprint
-from subprocess import Popen, PIPE
 import json
 
 
@@ -24,19 +42,52 @@ if sys.version[0] == "2":
 
 REQUEST_TIMEOUT = 100
 REQUESTS_COUNT = 1
+REQUESTS_CONCURRENCY = 5
+# seconds given to cancelled greenlets to clean up
+KILL_TIMEOUT = 5
+# pings parsed from a streamed config between giving the started ones a turn
+FEED_BATCH = 100
+DEADLINE_ERROR = 'timed out by deadline'
+INTERRUPTED_ERROR = 'interrupted'
+WORKER_ERROR = 'worker failed: {}'
+# engines sending the probe requests, see HTTPPinger
+ENGINES = ('gevent', 'asyncio')
 VERBOSE = False
 
 class Ping(object):
     """
     A class to work with our ping object as specified in TBMON
     """
-    def __init__(self, application, ping,  data):
+    # items answered by the do_<item> methods
+    ITEMS = ('request_loss', 'request_latency', 'request_timing', 'ab_test', 'icmp_loss',
+             'icmp_rtt')
+    # items answered from the probe requests
+    PROBE_ITEMS = ('request_loss', 'request_latency', 'request_timing')
+
+    def __init__(self, application, ping,  data, http_pool=None, health=None, icmp=None,
+            modes=None, engine=None):
         """
         Accepts a single TBMON ping object and it's corresponding application
+
+        :http_pool(optional) - amtp.pool.HostPool shared between pings
+        :health(optional) - amtp.health.HostHealth shared between pings, skips
+            requests to failing hosts and adapts the request timeouts
+        :icmp(optional) - amtp.icmp.ICMP pinging the hosts of all pings in one
+            batch, the host is pinged on its own otherwise
+        :modes(optional) - amtp.probemode.ProbeModes shared between pings,
+            probes are HEAD, ranged and conditional requests where possible
+            instead of full GETs
+        :engine(optional) - amtp.probe.Engine sending the probe requests, a
+            GeventEngine on http_pool by default
         """
         self.application = application
         self.ping = ping
         self.data = data
+        self.http_pool = http_pool or HostPool()
+        self.health = health
+        self.icmp = icmp
+        self.modes = modes
+        self.engine = engine or GeventEngine(self.http_pool, health, modes)
 
         try:
             self.request_timeout = float(data['request_timeout'])
@@ -46,7 +97,19 @@ class Ping(object):
             self.requests_count = int(data['requests_count'])
         except KeyError:
             self.requests_count = REQUESTS_COUNT
-        
+        try:
+            self.requests_concurrency = max(int(data['requests_concurrency']), 1)
+        except KeyError:
+            self.requests_concurrency = REQUESTS_CONCURRENCY
+        self.probe = None
+        # probe sent by another engine ahead of the run, see HTTPPinger.run
+        self.prepared = None
+        self.error = None
+        self.finished = []
+
+        # the expected_* tests and items are parsed once, unknown items raise here
+        self.plan = compile_plan(data, Ping)
+
         url = data['url']
         
         # check whether protocol is present
@@ -56,8 +119,7 @@ class Ping(object):
         else:
             raise TypeError("invalid type for url")
         self.url = URL(url)
-        self.http = HTTPClient.from_url(self.url, concurrency=500)
-        self.http.connection_timeout=self.request_timeout
+        self.validator_key = validator_key(url, self.plan) if modes is not None else None
     
     def run(self):
         """
@@ -65,73 +127,182 @@ class Ping(object):
         """
         if VERBOSE:
             print("Ping started ({})".format(self.data['name']))
-        
-        # check if hostname resolves
-        #try:
-        #    gevent.socket.gethostbyname(self.url.host)
-        #except gevent.socket.error:
-        #    print('{}: error: hostname {} does not resolve'.format(__file__, self.url.host), file=sys.stderr)
+        self.probe, self.prepared = self.prepared, None
+        self.error = None
+        self.finished = []
 
-        for key in self.data['items']:
+        # check if hostname resolves (answered from the cache after prefetching)
+        if self.http_pool.resolver is not None:
             try:
-                eval('self.do_' + key + '()')
-            except AttributeError:
-                print("{}: HTTPPinger does not support item '{}'". format(__file__, key), file=sys.stderr)
-        
-        self.http.close()
+                self.http_pool.resolver.resolve(self.url.host)
+            except DNSError as err:
+                self.error = str(err)
+                print('{}: error: {}'.format(__file__, self.error), file=sys.stderr)
+
+        for key, handler in self.plan.items:
+            handler(self)
+            if self.error:
+                self.data['items'][key]['error'] = self.error
+            self.finished.append(key)
+
+    def cancel(self, error):
+        """
+        Marks the items the cancelled run did not get to answer with an error
+        """
+        timestamp = int(time.time())
+        for key, handler in self.plan.items:
+            if key not in self.finished:
+                self.data['items'][key]['timestamp'] = timestamp
+                self.data['items'][key]['error'] = error
 
-    def get_response(self):
+    def expected_cost(self):
+        """
+        Returns the worst case duration of a run in seconds
+        """
+        cost = 0
+        keys = [key for key, handler in self.plan.items]
+        if self.has_probe():
+            cost += -(-self.requests_count // self.requests_concurrency) * self.request_timeout
+        if 'ab_test' in keys:
+            ab_test = self.data['items']['ab_test']
+            concurrency = max(min(ab_test['concurrency'], ab_test['requests']), 1)
+            cost += -(-ab_test['requests'] // concurrency) * self.request_timeout
+        return cost
+
+    def has_probe(self):
+        """
+        Returns True if any of the items is answered from probe requests
+        """
+        return any(key in self.PROBE_ITEMS for key, handler in self.plan.items)
+
+    def record(self):
+        """
+        Returns the result record of the ping for streaming output
+        """
+        return {'application': self.application, 'ping': self.ping, 'items': self.data['items']}
+
+    def get_response(self, http, method='GET', headers=None):
         """
         Makes a request and returns a geventhttpclient response object
+
+        :http - client handed out by the shared connection pool
         """
-        return self.http.get(self.url.request_uri)
-    
+        return http.request(method, self.url.request_uri, headers=headers or {})
+
+    def get_probe(self):
+        """
+        Sends requests_count requests, up to requests_concurrency at a time,
+        and returns the outcome. The requests are sent once per run (by the
+        engine, see amtp.probe) and shared by the request_* items
+        """
+        if self.probe is None:
+            if self.error:
+                # no point in waiting for requests which can't be sent
+                self.probe = new_probe()
+                self.probe['failed'] = self.requests_count
+            else:
+                self.probe = self.engine.probe(self)
+        return self.probe
+
     def do_request_loss(self):
         """
         Does the request loss test. Results are written in self.data
         """
-        successful = 0
-        failed = 0
-        res = None
-        body = None
-        for i in range(self.requests_count):
-            try:
-                res = self.get_response()
-                body = res.read()
-            except gevent.socket.error:
-                failed += 1
-            except HTTPParseError as err:
-                print(err, self.url, file=sys.stderr)
-                failed += 1
-            if res and body:
-                if self.do_response_tests(res, body, i):
-                    successful += 1
-                else:
-                    failed += 1
-       
+        probe = self.get_probe()
         timestamp = int(time.time())
         self.data['items']['request_loss']['timestamp'] = timestamp
         self.data['items']['request_loss']['units'] = '%'
         self.data['items']['request_loss']['type'] = 'int'
-        self.data['items']['request_loss']['value'] = int(failed / self.requests_count * 100)
+        self.data['items']['request_loss']['value'] = int(probe['failed'] / self.requests_count * 100)
+
+    def do_request_latency(self):
+        """
+        Reports min, p50, p95, p99 and max response time of the probe requests.
+        Results are written in self.data
+        """
+        latency = self.get_probe()['latency'].summary()
+        timestamp = int(time.time())
+        self.data['items']['request_latency']['timestamp'] = timestamp
+        self.data['items']['request_latency']['units'] = 'ms'
+        self.data['items']['request_latency']['type'] = 'object'
+        self.data['items']['request_latency']['value'] = latency or ''
     
-    def do_response_tests(self, response, body, i=None):
+    def do_request_timing(self):
+        """
+        Reports the mean time the probe requests spent on each phase: dns,
+        connect and tls over the requests which opened a new connection, ttfb
+        (request sent to response headers) and transfer (reading the body).
+        Results are written in self.data
+        """
+        phases = self.get_probe()['phases']
+        value = dict((phase, round(total / count * 1000, 3))
+                     for phase, (total, count) in phases.items())
+        # the resolver caches the host, so report what the lookup itself took
+        resolver = self.http_pool.resolver
+        if resolver is not None and self.url.host.lower().rstrip('.') in resolver.lookup_times:
+            value['dns'] = round(resolver.lookup_times[self.url.host.lower().rstrip('.')] * 1000, 3)
+        timestamp = int(time.time())
+        self.data['items']['request_timing']['timestamp'] = timestamp
+        self.data['items']['request_timing']['units'] = 'ms'
+        self.data['items']['request_timing']['type'] = 'object'
+        self.data['items']['request_timing']['value'] = value or ''
+        self.data['items']['request_timing']['connections'] = phases.get('connect', [0, 0])[1]
+
+    def get_icmp(self):
         """
-        Does all of the expected_* tests (should be executed to validate the response)
+        Returns the ICMP echo statistics of the host (see amtp.icmp.summary)
+        """
+        if self.icmp is None:
+            self.icmp = ICMP(resolver=self.http_pool.resolver)
+        return self.icmp.result(self.url.host)
+
+    def do_icmp_loss(self):
+        """
+        Reports the ICMP echo packet loss of the host. Results are written in self.data
+        """
+        stats = self.get_icmp()
+        timestamp = int(time.time())
+        self.data['items']['icmp_loss']['timestamp'] = timestamp
+        self.data['items']['icmp_loss']['units'] = '%'
+        self.data['items']['icmp_loss']['type'] = 'int'
+        self.data['items']['icmp_loss']['value'] = int(stats['loss'])
+        if 'error' in stats:
+            self.data['items']['icmp_loss']['error'] = stats['error']
+
+    def do_icmp_rtt(self):
+        """
+        Reports min, avg, max, mdev and jitter of the ICMP echo round trips.
+        Results are written in self.data
+        """
+        stats = self.get_icmp()
+        timestamp = int(time.time())
+        self.data['items']['icmp_rtt']['timestamp'] = timestamp
+        self.data['items']['icmp_rtt']['units'] = 'ms'
+        self.data['items']['icmp_rtt']['type'] = 'object'
+        self.data['items']['icmp_rtt']['value'] = stats['rtt'] or ''
+        if 'error' in stats:
+            self.data['items']['icmp_rtt']['error'] = stats['error']
+
+    def do_response_tests(self, response, i=None, status_code=None):
+        """
+        Does all of the expected_* tests (should be executed to validate the response).
+        The body is read from the response only as far as needed by the tests
+
+        :status_code(optional) - checked instead of the one of the response
         """
         is_erc, is_ehd, is_erb = True, True, True
 
-        if 'expected_response_codes' in self.data:
-            is_erc = self._test_expected_response_codes(response)
+        if self.plan.codes is not None:
+            is_erc = self._test_expected_response_codes(response, status_code)
             if VERBOSE:
                 print("Testing expected status code - {} - {}".format(" OK " if is_erc else "FAIL", self.url))
-        if 'expected_headers' in self.data:
+        if self.plan.headers is not None:
             is_ehd = self._test_expected_header(response)
             if VERBOSE:
                 print("Testing expected header      - {} - {}".format(" OK " if is_ehd else "FAIL", self.url))
         
-        if 'expected_response_body' in self.data:
-            is_erb = self._test_expected_body(body)
+        if self.plan.body is not None:
+            is_erb = self._test_expected_body(response)
             if VERBOSE:
                 print("Testing expected body        - {} - {}".format(" OK " if is_erb else "FAIL", self.url))
 
@@ -140,60 +311,44 @@ class Ping(object):
     
     def do_ab_test(self):
         """
-        Spawns an apache bench process and performs loadtesting
+        Performs loadtesting with the in-process load generator (amtp.loadtest)
+        using the concurrency and requests parameters ab would get
         """
         if VERBOSE:
             print("Starting ab test for {}".format(self.data['name']))
         c = self.data['items']['ab_test']['concurrency']
         n = self.data['items']['ab_test']['requests']
 
-        # TODO: What happens if we don't have ab on the system?
-        # add / to host if missing (else ab fails)
-        ab_url = str(self.url)
-
-        if self.url.path == '': 
-            ab_url = str(self.url) + '/'
-        try:
-            p = Popen(['ab', '-n', n, '-c', c, ab_url], stdout=PIPE, stderr=PIPE)
-            output, err = p.communicate()
-            rc = p.returncode
-        except FileNotFoundError:
-            print('{}: error: could not find ab'.format(__file__, self.url.host), file=sys.stderr)
-            err = 1 
-        timestamp = int(time.time())
-        #err = None
-        if not err:
-            output = output.decode('utf-8')
-            if VERBOSE:
-                print(output)
-            
-            rps = None
-            for line in output.split("\n"):
-                if "Requests per second" in line:
-                    line = line.split()
-                    rps = line[3]
-                    break 
-            self.data['items']['ab_test']['timestamp'] = timestamp
-            self.data['items']['ab_test']['units'] = 'r/sec'
-            self.data['items']['ab_test']['type'] = 'float'
-            self.data['items']['ab_test']['value'] = float(rps)
+        if self.error:
+            results = {'rps': None, 'latency': {}, 'errors': {}, 'non_2xx': 0, 'bytes': 0}
         else:
-            self.data['items']['ab_test']['timestamp'] = timestamp
-            self.data['items']['ab_test']['units'] = 'r/sec'
-            self.data['items']['ab_test']['type'] = 'float'
-            self.data['items']['ab_test']['value'] = ''
+            # the load generator takes its connection slots and rate limit
+            # tokens from the shared pool, so the pings and it stay in budget
+            c = min(c, self.http_pool.max_connections)
+            results = LoadTest(self.url, c, n, self.request_timeout,
+                    self.http_pool.resolver, self.http_pool).run()
+        if VERBOSE:
+            print("ab test for {}: {}".format(self.data['name'], results))
 
+        timestamp = int(time.time())
+        self.data['items']['ab_test']['timestamp'] = timestamp
+        self.data['items']['ab_test']['units'] = 'r/sec'
+        self.data['items']['ab_test']['type'] = 'float'
+        self.data['items']['ab_test']['value'] = results['rps'] or ''
+        self.data['items']['ab_test']['latency'] = results['latency']
+        self.data['items']['ab_test']['errors'] = results['errors']
+        self.data['items']['ab_test']['non_2xx'] = results['non_2xx']
+        self.data['items']['ab_test']['bytes'] = results['bytes']
 
-    def _test_expected_response_codes(self, response):
+    def _test_expected_response_codes(self, response, status_code=None):
         """
         Returns True if one of the specified response codes is in the response
         
         :response - geventhttpclient response object
         """
-        if response.status_code in [int(x) for x in self.data['expected_response_codes']]:
-            return True
-        else:
-            return False
+        if status_code is None:
+            status_code = response.status_code
+        return status_code in self.plan.codes
     
     def _test_expected_header(self, response):
         """
@@ -201,40 +356,126 @@ class Ping(object):
         
         :response - geventhttpclient response object
         """
-        for field, value in [x.split(':',1) for x in self.data['expected_headers']]:
+        for field, value in self.plan.headers:
             header_value = response._headers_index.get_all(field)
             if header_value:
                 if value == header_value[0]:
                     return True
         return False
 
-    def _test_expected_body(self, response_body):
+    def _test_expected_body(self, response):
         """
-        Returns True if the string specified is to be found in the body of the response
-        
-        :response_body - byte string containing the body of the HTTP response
+        Returns True if all of the expected strings and 're:' prefixed regular
+        expressions are to be found in the body of the response. The body is
+        streamed until everything matched or response_body_max_bytes were read
+
+        :response - geventhttpclient response object
         """
-        return True if self.data['expected_response_body'][0].encode() in response_body else False
+        return self.plan.body.match(response)
 
 class HTTPPinger(object):
     """
     Our main application object. Responsible for managing and conducting the pings
     """
 
-    def __init__(self, data, schema_path=None):
+    def __init__(self, data, schema_path=None, max_connections=MAX_CONNECTIONS,
+            host_connections=HOST_CONNECTIONS, resolver=None, workers=1, validation='full',
+            stream=None, store=None, health=True, keep=True, rate=None, host_rate=None,
+            engine='gevent', modes=True, delta=None):
         """
-        :data - dictionary object parsed from a TBMON json file
+        :data - dictionary object parsed from a TBMON json file, or the events
+            of amtp.tbmon.iter_document to start probing while the document
+            is still being read (validation is per ping then, and the pings
+            are run in the order they are read)
+        :max_connections(optional) - connections allowed across all targets
+        :host_connections(optional) - connections allowed to a single target host
+        :resolver(optional) - amtp.dns.Resolver, a caching one is created by default
+        :workers(optional) - number of processes the pings are split across
+        :validation(optional) - 'full' validates the whole document up front,
+            'lazy' validates each ping right before its Ping object is made
+            and skips invalid ones, None skips validation (already validated data)
+        :stream(optional) - amtp.output.NDJSONWriter receiving a record for
+            every ping as soon as it finishes
+        :store(optional) - amtp.store.ResultStore the results are appended to
+        :health(optional) - amtp.health.HostHealth, a default one (circuit
+            breaker only) is created if True, False disables it
+        :keep(optional) - False drops the pings from self.data once they were
+            written to stream and store, for flat memory use on huge configs
+        :rate(optional) - requests per second started across all targets
+        :host_rate(optional) - requests per second started to a single target host
+        :engine(optional) - 'gevent' sends the probe requests from the greenlet
+            of every ping, 'asyncio' sends those of all pings up front on an
+            asyncio event loop (see amtp.aio), the other items run on gevent
+        :modes(optional) - amtp.probemode.ProbeModes, a default one is created
+            if True, False sends a full GET for every probe request
+        :delta(optional) - amtp.delta.DeltaWriter receiving every ping as
+            soon as it finishes
         """
+        if engine not in ENGINES:
+            raise ValueError("unknown engine '{}'".format(engine))
+        self.source = None
+        if not isinstance(data, dict):
+            if engine != 'gevent':
+                raise ValueError('streamed configs need the gevent engine')
+            self.source = data
+            data = {'applications': {}}
+            if validation:
+                validation = 'lazy'
         self.data = data
+        self.keep = keep
         self.pings = []
+        # pings known so far and those spawned but not finished
+        self.total = 0
+        self.running = set()
+        self.workers = max(workers, 1)
+        self.host_connections = host_connections
+        self.rate = rate
+        self.host_rate = host_rate
+        self.worker_stats = []
+        self.stream = stream
+        self.store = store
+        self.delta = delta
+        self.invalid = []
+        self.interrupted = False
+        self.started = 0
+        self.finished = 0
+        self.resolver = resolver or Resolver()
+        if self.workers == 1:
+            # sockets beyond RLIMIT_NOFILE would fail with EMFILE and look like
+            # request loss, the DNS queries and the ICMP socket need theirs too
+            budget = fd_budget(max_connections, FD_RESERVE + self.resolver.max_queries)
+            if VERBOSE and budget < max_connections:
+                print('Connections: limited to {} by the open file limit'.format(budget),
+                      file=sys.stderr)
+            max_connections = budget
+        self.max_connections = max_connections
+        self.limiter = RateLimiter(rate, host_rate) if rate or host_rate else None
+        self.http_pool = HostPool(max_connections, host_connections, resolver=self.resolver,
+                limiter=self.limiter)
+        self.health = HostHealth() if health is True else health or None
+        self.modes = ProbeModes() if modes is True else modes or None
+        if engine == 'asyncio' and self.workers == 1:
+            # Python 3 only
+            from amtp.aio import AsyncEngine
+            self.engine = AsyncEngine(max_connections, host_connections, self.resolver,
+                    self.health, self.limiter, self.modes)
+        else:
+            self.engine = GeventEngine(self.http_pool, self.health, self.modes)
+        self.engine_name = engine
+        self.icmp = ICMP(resolver=self.resolver)
         
-        # Load TBMON HTTP Ping Schema
-        schema_path = schema_path or 'schema/TBMON_HTTP_Ping_Schema.json'
-        file_dir = os.path.dirname(os.path.realpath(__file__))
-        rel_path = os.path.join(file_dir, schema_path)
-        with open(rel_path, 'r', encoding='utf8') as json_file:
-            schema = json.load(json_file)
-            validate(self.data, schema)
+        # Load TBMON HTTP Ping Schema (compiled once per process)
+        ping_validator = None
+        if validation:
+            schema_path = schema_path or SCHEMA_PATH
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+            rel_path = os.path.join(file_dir, schema_path)
+            validator = get_validator(rel_path)
+            if validation == 'lazy':
+                ping_validator = PingValidator(validator, self.data)
+            else:
+                validator.validate(self.data)
+        self.ping_validator = ping_validator
 
         # gather out Ping objects
         for application_name in self.data['applications']:
@@ -242,13 +483,133 @@ class HTTPPinger(object):
             pings = self.data['applications'][application_name]['pings']
 
             for ping_name in pings:
-                ping = Ping(application_name, ping_name, pings[ping_name])
-                self.pings.append(ping)
-    
+                ping = self.make_ping(application_name, ping_name, pings[ping_name])
+                if ping is not None:
+                    self.pings.append(ping)
+
+        # resolve all of the target hosts in parallel before the first request
+        # (in worker mode every worker does that for its own hosts)
+        if self.workers == 1 and self.source is None:
+            failed = self.resolver.prefetch(ping.url.host for ping in self.pings)
+            if VERBOSE and failed:
+                print('DNS: {} of the target hosts do not resolve'.format(len(failed)), file=sys.stderr)
+
         self.pool = Pool(500) 
+
+    def make_ping(self, application, name, data):
+        """
+        Returns the Ping object of a ping of self.data or None if it is
+        invalid. Raises ValueError for unsupported items unless the pings are
+        validated one at a time
+        """
+        if self.ping_validator:
+            try:
+                self.ping_validator.validate(application, name)
+                ping = Ping(application, name, data, self.http_pool, self.health, self.icmp,
+                        self.modes, self.engine)
+            except (ValidationError, ValueError) as err:
+                message = getattr(err, 'message', str(err))
+                self.invalid.append((application, name, message))
+                print('{}: error: invalid ping {}/{}: {}'.format(__file__, application,
+                        name, message), file=sys.stderr)
+                return None
+        else:
+            ping = Ping(application, name, data, self.http_pool, self.health, self.icmp,
+                    self.modes, self.engine)
+        self.total += 1
+        return ping
+
+    def feed(self):
+        """
+        Yields the Ping objects of a streamed TBMON document as they are read
+        """
+        applications = self.data['applications']
+        for event in self.source:
+            if event[0] == 'ping':
+                kind, application, fields, name, data = event
+                if application not in applications:
+                    # the name may come after the pings, validated at the end
+                    applications[application] = {'name': '', 'pings': {}}
+                applications[application].update(fields)
+                applications[application]['pings'][name] = data
+                ping = self.make_ping(application, name, data)
+                if ping is None:
+                    continue
+                if self.keep:
+                    self.pings.append(ping)
+                if any(key.startswith('icmp_') for key, handler in ping.plan.items):
+                    # the hosts of the pings read together are pinged in one batch
+                    self.icmp.queue(ping.url.host)
+                yield ping
+            elif event[0] == 'application':
+                applications.setdefault(event[1], {'pings': {}}).update(event[2])
+                if 'name' not in event[2]:
+                    print("{}: error: application {} has no 'name'".format(__file__, event[1]),
+                            file=sys.stderr)
+            else:
+                self.data.update(event[1])
+                self.data['applications'] = applications
     
     def shutdown(self):
         self.pool.kill()
+        self.http_pool.close()
+
+    def connection_stats(self):
+        """
+        Returns the connection reuse statistics of the probe requests, summed
+        over the workers of run_workers
+        """
+        if self.workers > 1:
+            stats = dict((key, sum(x[key] for x in self.worker_stats))
+                         for key in ('hosts', 'requests', 'connects', 'reused', 'evicted'))
+            stats['reuse_ratio'] = stats['reused'] / stats['requests'] if stats['requests'] else 0.0
+            return stats
+        return self.engine.stats()
+
+    def in_flight(self):
+        """
+        Returns the number of probe requests of this process holding a
+        connection slot
+        """
+        return self.engine.active
+
+    def prepare_probes(self, pings, deadline=None):
+        """
+        Sends the probe requests of pings ahead of the run if self.engine does
+        that, their items are answered from these probes once run. Pings not
+        probed within the deadline are cancelled. Returns the pings still to
+        run and the seconds left of the deadline
+        """
+        if not self.engine.ahead:
+            return pings, deadline
+        start = clock()
+        probed = [x for x in pings if x.has_probe()]
+        probes = self.engine.prepare(probed, deadline)
+        for x in probed:
+            x.prepared = probes.get(x)
+        self.cancel([x for x in probed if x.prepared is None], DEADLINE_ERROR)
+        # cancelled ones are done with
+        pings = [x for x in pings if not x.has_probe() or x.prepared]
+        if deadline is None:
+            return pings, None
+        return pings, max(deadline - (clock() - start), 0)
+
+    def health_stats(self):
+        """
+        Returns the circuit breaker and adaptive timeout statistics
+        """
+        if self.health is None:
+            return {'open': 0, 'trips': 0, 'skipped': 0, 'cut_short': 0, 'saved': 0.0}
+        return self.health.stats()
+
+    def probe_stats(self):
+        """
+        Returns the HEAD, ranged and not modified probe counts and the bytes
+        they saved
+        """
+        if self.modes is None:
+            return {'heads': 0, 'ranged': 0, 'not_modified': 0, 'saved': 0}
+        return self.modes.stats()
 
     def dump(self, file=None):
         """
@@ -272,16 +633,262 @@ class HTTPPinger(object):
         else:
             return json.dumps(self.data)
 
-    def run(self):
-        for x in self.pings:
-            self.pool.spawn(x.run)
-        self.pool.join()
+    def run(self, deadline=None, metrics_port=None, stats_interval=None):
+        """
+        Runs the pings, the ones with the lowest expected cost first so the
+        most of them get done within the deadline (streamed documents in the
+        order they are read). Pings still running when
+        the deadline expires or on Ctrl-C are cancelled and their unanswered
+        items marked with an error, self.data is left with the partial results
+
+        :deadline(optional) - seconds the whole run may take
+        :metrics_port(optional) - serve live metrics on this local port, the
+            workers of run_workers serve theirs on the following ports
+        :stats_interval(optional) - print a stats line every N seconds
+        """
+        if self.workers > 1:
+            return self.run_workers(deadline, metrics_port, stats_interval)
+        metrics = None
+        if metrics_port is not None or stats_interval:
+            metrics = Metrics(self)
+            metrics.start(metrics_port, stats_interval=stats_interval)
+        error = None
+        expired = True
+        queue = iter([])
+        try:
+            if self.source is not None:
+                queue = self.feed()
+            else:
+                pings, deadline = self.prepare_probes(sorted(self.pings, key=Ping.expected_cost),
+                                                      deadline)
+                queue = iter(pings)
+                # one ICMP batch for the hosts of all of the icmp_* items, after
+                # the probes as an asyncio engine blocks the gevent hub
+                icmp_hosts = [x.url.host for x in self.pings
+                              if any(key.startswith('icmp_') for key, handler in x.plan.items)]
+                if icmp_hosts:
+                    self.icmp.start(icmp_hosts)
+            # silent - we know it expired from expired staying True
+            with gevent.Timeout(deadline, False):
+                for i, x in enumerate(queue, 1):
+                    self.running.add(x)
+                    self.pool.spawn(self.run_ping, x)
+                    if i % FEED_BATCH == 0:
+                        # a streamed document is parsed without blocking,
+                        # let the started pings move on
+                        gevent.sleep(0)
+                self.pool.join()
+                expired = False
+        except KeyboardInterrupt:
+            self.interrupted = True
+            error = INTERRUPTED_ERROR
+        if expired or self.interrupted:
+            self.pool.kill(timeout=KILL_TIMEOUT)
+            # the ones never started are still in the queue
+            self.cancel(list(self.running) + list(queue), error or DEADLINE_ERROR)
+        self.icmp.stop()
+        if metrics:
+            metrics.stop()
+        if VERBOSE:
+            print('Connections: {requests} requests, {connects} connects, '
+                  '{reused} reused ({reuse_ratio:.0%}), {hosts} hosts, '
+                  '{evicted} evicted'.format(**self.connection_stats()), file=sys.stderr)
+            print('DNS: {cached} cached, {hits} hits, {misses} misses, '
+                  '{failures} failures'.format(**self.resolver.stats()), file=sys.stderr)
+            print('Health: {trips} breakers tripped ({open} open), {skipped} requests '
+                  'skipped, {cut_short} timeouts cut short, ~{saved:.1f}s '
+                  'saved'.format(**self.health_stats()), file=sys.stderr)
+            if self.limiter is not None:
+                print('Rate limit: {:.1f}s spent waiting for tokens'.format(self.limiter.waited),
+                      file=sys.stderr)
+            self.print_probe_stats(self.probe_stats())
+        self.http_pool.close()
+
+    def run_ping(self, ping):
+        self.started += 1
+        ping.run()
+        self.finished += 1
+        self.write(ping)
+        self.running.discard(ping)
+
+    def write(self, ping):
+        if self.stream:
+            self.stream.write(ping.record())
+        if self.store:
+            self.store.add(ping.record(), ping.data.get('name'))
+        if self.delta:
+            self.delta.add(ping.application, ping.ping, ping.data)
+        if not self.keep:
+            del self.data['applications'][ping.application]['pings'][ping.ping]
+
+    def print_probe_stats(self, stats):
+        print('Probes: {heads} HEAD, {ranged} ranged, {not_modified} not modified, '
+              '{kb:.1f} KB saved'.format(kb=stats['saved'] / 1024, **stats), file=sys.stderr)
+
+    def cancel(self, pings, error):
+        """
+        Marks the unfinished items of pings with error and writes them out
+        """
+        for ping in pings:
+            ping.cancel(error)
+            self.write(ping)
+        if pings:
+            print('{}: error: {} pings {}'.format(__file__, len(pings), error), file=sys.stderr)
+
+    def run_workers(self, deadline=None, metrics_port=None, stats_interval=None):
+        """
+        Splits the pings across self.workers processes, each running its own
+        gevent hub, and merges the items they filled in back into self.data
+
+        :deadline(optional) - seconds the whole run may take, enforced by
+            every worker
+        """
+        shards = assign([(x.application, x.ping, x.url.host) for x in self.pings], self.workers)
+        # the connection budget and the rate limit are shared by the workers,
+        # a host belongs to a single shard so its rate limit is not split
+        options = {
+            'max_connections': max(self.max_connections // len(shards), 1),
+            'host_connections': self.host_connections,
+            'rate': self.rate / len(shards) if self.rate else None,
+            'host_rate': self.host_rate,
+            'engine': self.engine_name,
+            'verbose': VERBOSE,
+            'health': self.health,
+            # the validators known so far, None for full GETs
+            'validators': self.modes.cache if self.modes is not None else None,
+            # wall clock, the workers take a while to start
+            'deadline': time.time() + deadline if deadline is not None else None,
+            'metrics_port': metrics_port,
+            'stats_interval': stats_interval,
+        }
+        jobs = [(i, subset(self.data, shard), options) for i, shard in enumerate(shards)]
+        start = clock()
+        # spawn - a forked copy of a running gevent hub is no good to anyone
+        workers = multiprocessing.get_context('spawn').Pool(len(shards), _ignore_interrupt)
+        merged = set()
+        error = None
+        # a result which did not make it back from an unknown worker
+        failure = None
+        try:
+            shard_results = workers.imap_unordered(_run_shard, jobs)
+            while True:
+                # the workers cancel their own pings, this only catches hung ones
+                timeout = None
+                if deadline is not None:
+                    timeout = max(options['deadline'] - time.time(), 0) + 2 * KILL_TIMEOUT
+                try:
+                    index, results, stats = shard_results.next(timeout)
+                except StopIteration:
+                    break
+                except multiprocessing.TimeoutError:
+                    error = DEADLINE_ERROR
+                    break
+                except Exception as err:
+                    # e.g. results which could not be pickled, the pings of
+                    # that shard are cancelled with the unmerged ones below
+                    failure = WORKER_ERROR.format(err)
+                    continue
+                if results is None:
+                    # the worker failed, stats is its error
+                    shard = set(shards[index])
+                    merged.update(shard)
+                    self.cancel([x for x in self.pings if (x.application, x.ping) in shard],
+                            WORKER_ERROR.format(stats))
+                    continue
+                for application, ping, items in results:
+                    merged.add((application, ping))
+                    self.data['applications'][application]['pings'][ping]['items'] = items
+                    record = {'application': application, 'ping': ping, 'items': items}
+                    if self.stream:
+                        self.stream.write(record)
+                    if self.store:
+                        name = self.data['applications'][application]['pings'][ping].get('name')
+                        self.store.add(record, name)
+                    if self.delta:
+                        self.delta.add(application, ping,
+                                self.data['applications'][application]['pings'][ping])
+                if self.modes is not None:
+                    self.modes.merge(stats.pop('probes'), stats.pop('validators'))
+                self.worker_stats.append(stats)
+        except KeyboardInterrupt:
+            self.interrupted = True
+            error = INTERRUPTED_ERROR
+        finally:
+            workers.terminate()
+        elapsed = clock() - start
+        self.cancel([x for x in self.pings if (x.application, x.ping) not in merged],
+                error or failure or DEADLINE_ERROR)
+
+        self.worker_stats.sort(key=lambda x: x['worker'])
+        if VERBOSE:
+            for stats in self.worker_stats:
+                print('Worker {worker}: {pings} pings in {seconds:.2f}s '
+                      '({throughput:.1f} pings/s), {requests} requests, '
+                      '{connects} connects, {skipped} skipped, ~{saved:.1f}s '
+                      'saved'.format(**stats), file=sys.stderr)
+            print('Workers: {} pings in {:.2f}s ({:.1f} pings/s)'.format(
+                len(self.pings), elapsed, len(self.pings) / elapsed), file=sys.stderr)
+            self.print_probe_stats(self.probe_stats())
+
+
+def _ignore_interrupt():
+    """
+    Worker process initializer, Ctrl-C is handled by the parent
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_shard(job):
+    """
+    Worker process entry point of HTTPPinger.run_workers. Runs the pings of a
+    TBMON document shard and returns their items and the worker statistics,
+    or None and the error if the worker failed
+    """
+    try:
+        return _probe_shard(*job)
+    except Exception as err:
+        traceback.print_exc()
+        return job[0], None, '{}: {}'.format(type(err).__name__, err)
+
+
+def _probe_shard(index, data, options):
+    global VERBOSE
+    VERBOSE = options['verbose']
+    start = clock()
+    modes = False
+    if options['validators'] is not None:
+        modes = ProbeModes()
+        modes.cache.update(options['validators'])
+    http_pinger = HTTPPinger(data, max_connections=options['max_connections'],
+            host_connections=options['host_connections'], validation=None,
+            health=options['health'], rate=options['rate'], host_rate=options['host_rate'],
+            engine=options['engine'], modes=modes)
+    deadline = options['deadline']
+    metrics_port = options['metrics_port']
+    http_pinger.run(max(deadline - time.time(), 0) if deadline is not None else None,
+            metrics_port + index + 1 if metrics_port is not None else None,
+            options['stats_interval'])
+    seconds = clock() - start
+
+    stats = http_pinger.connection_stats()
+    stats.update(http_pinger.health_stats())
+    stats.update({
+        'worker': index,
+        'pings': len(http_pinger.pings),
+        'seconds': seconds,
+        'throughput': len(http_pinger.pings) / seconds if seconds else 0.0,
+        'probes': http_pinger.probe_stats(),
+        'validators': modes.cache if modes else None,
+    })
+    results = [(x.application, x.ping, x.data['items']) for x in http_pinger.pings]
+    return index, results, stats
 
 
 def get_inputs():
     """
-    Returns a tuple of input file path and output file path  specified as 
-    command line arguments. Additionally sets the VERBOSE mode if defined
+    Returns a tuple of input file path, output file path and the parsed
+    arguments specified on the command line. Additionally sets the VERBOSE
+    mode if defined
     """
     
     # prepare parser
@@ -291,9 +898,59 @@ Asynchronous Multi Target Pinger (AMTP)
     parser.add_argument('-v', '--verbose', help='display additional information', action='store_true')
     parser.add_argument('-o', '--output', metavar="FILE", nargs=1, help='specify path to output the TBMON result file', default='stdout')
     parser.add_argument('-i', '--interactive', help='interactive mode', action='store_true')
+    parser.add_argument('--max-connections', metavar="N", type=int, default=MAX_CONNECTIONS,
+            help='maximum number of connections across all targets (default: %(default)s)')
+    parser.add_argument('-s', '--stream', metavar="FILE",
+            help='write an NDJSON record for every finished ping to FILE ("-" for stdout)')
+    parser.add_argument('--stream-batch', metavar="N", type=int, default=BATCH_SIZE,
+            help='number of NDJSON records written at once (default: %(default)s)')
+    parser.add_argument('--store', metavar="FILE",
+            help='append the results to the SQLite result store FILE (see tools/query_tool.py)')
+    parser.add_argument('--lazy-validation', action='store_true',
+            help='validate every ping on its own and skip the invalid ones')
+    parser.add_argument('-w', '--workers', metavar="N", type=int, default=1,
+            help='split the pings across N processes (default: %(default)s)')
+    parser.add_argument('--host-connections', metavar="N", type=int, default=HOST_CONNECTIONS,
+            help='maximum number of connections to a single host (default: %(default)s)')
+    parser.add_argument('--failure-threshold', metavar="N", type=int, default=FAILURE_THRESHOLD,
+            help='stop probing a host after N consecutive connection failures, 0 never '
+                 'stops (default: %(default)s)')
+    parser.add_argument('--adaptive-timeouts', action='store_true',
+            help='cut request_timeout down to the response times seen from a host, for '
+                 'hosts whose endpoints all answer about as fast')
+    parser.add_argument('--rate', metavar="N", type=float,
+            help='start at most N requests per second across all targets')
+    parser.add_argument('--host-rate', metavar="N", type=float,
+            help='start at most N requests per second to a single target host')
+    parser.add_argument('--engine', choices=ENGINES, default='gevent',
+            help='send the probe requests with gevent (default) or up front on an asyncio '
+                 'event loop, uvloop if installed (Python 3)')
+    parser.add_argument('--full-get', action='store_true',
+            help='probe with full GET requests only, no HEAD, ranged or conditional ones')
+    parser.add_argument('--validator-cache', metavar="FILE",
+            help='keep the ETag/Last-Modified validators of the targets in FILE, so the '
+                 'next run can send conditional requests')
+    parser.add_argument('--delta', metavar="FILE",
+            help='write a JSON Patch (RFC 6902) of the results which changed since the last '
+                 'run to FILE instead of the whole document, needs --snapshot')
+    parser.add_argument('--snapshot', metavar="FILE",
+            help='results of the last run the --delta patch is made against, updated '
+                 'after the run')
+    parser.add_argument('--deadline', metavar="SECONDS", type=float,
+            help='cancel the pings still running after SECONDS and write the partial results')
+    parser.add_argument('--stream-config', action='store_true',
+            help='start probing while the config is being read, pings are validated one '
+                 'at a time (single process only)')
+    parser.add_argument('--metrics-port', metavar="PORT", type=int,
+            help='serve live metrics in the Prometheus text format on 127.0.0.1:PORT/metrics '
+                 '(workers on the following ports)')
+    parser.add_argument('--stats-interval', metavar="SECONDS", type=float,
+            help='print a stats line to stderr every SECONDS')
     requiredNamed = parser.add_argument_group('required arguments')
     requiredNamed.add_argument('-c', '--config', metavar="FILE", nargs=1, type=str, help='specify path to a TBMON configuration file', required=True)
     args = parser.parse_args()
+    if args.delta and not args.snapshot:
+        parser.error('--delta needs --snapshot')
     
     # set verbosity
     global VERBOSE
@@ -328,21 +985,75 @@ Asynchronous Multi Target Pinger (AMTP)
                     file=sys.stderr)
             sys.exit()
     
-    return input_file_path, output_file_path
+    return input_file_path, output_file_path, args
 
 
 def main():      
     inputs = get_inputs()
-    with open(inputs[0], 'r') as file:
-        data = json.load(file)
-    http_pinger = HTTPPinger(data)
-    http_pinger.run()
-  
+    options = inputs[2]
+    config = open(inputs[0], 'r', encoding='utf8')
+    if options.stream_config and options.workers == 1 and options.engine == 'gevent':
+        # read while the pings run
+        data = iter_document(config)
+    else:
+        with config:
+            data = json.load(config)
+
+    stream = None
+    if options.stream == '-':
+        stream = NDJSONWriter(sys.stdout, options.stream_batch)
+    elif options.stream:
+        stream = NDJSONWriter(open(options.stream, 'w'), options.stream_batch)
+    store = ResultStore(options.store) if options.store else None
+    delta = DeltaWriter(open(options.delta, 'w'), options.snapshot) if options.delta else None
+    health = False
+    if options.failure_threshold > 0 or options.adaptive_timeouts:
+        health = HostHealth(options.failure_threshold or float('inf'),
+                adaptive=options.adaptive_timeouts)
+    try:
+        http_pinger = HTTPPinger(data, max_connections=options.max_connections,
+                host_connections=options.host_connections, workers=options.workers,
+                validation='lazy' if options.lazy_validation else 'full', stream=stream,
+                store=store, health=health, rate=options.rate, host_rate=options.host_rate,
+                engine=options.engine,
+                modes=False if options.full_get else ProbeModes(options.validator_cache),
+                delta=delta,
+                # nothing needs the whole document when results are streamed
+                keep=bool(inputs[1]) or not (stream or delta))
+    except (ValueError, ValidationError) as err:
+        print('{}: error: {}'.format(__file__, err), file=sys.stderr)
+        sys.exit(1)
+    completed = False
+    try:
+        http_pinger.run(options.deadline, options.metrics_port, options.stats_interval)
+        completed = True
+    except ValueError as err:
+        # a malformed streamed config
+        print('{}: error: {}'.format(__file__, err), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        # whatever finished before an interruption is not lost
+        config.close()
+        if stream:
+            stream.close()
+        if store:
+            store.close()
+        if http_pinger.modes is not None:
+            http_pinger.modes.save()
+        if delta:
+            # a failed run must not move the snapshot on
+            if completed:
+                delta.close(http_pinger.data)
+            else:
+                delta.abort()
+
     if inputs[1]:
         with open(inputs[1], 'w') as file:
             http_pinger.dump(file)
-    else:
+    elif not stream and not delta:
         http_pinger.dump()
+    if http_pinger.interrupted:
+        sys.exit(130)
 
 if __name__ == '__main__':
     main()
@@ -1,30 +1,70 @@
 import csv
-import json
-import copy
-
-
-with open('tests/input.json') as jsonfile:
-    data = json.loads(jsonfile.read())
-    data['applications']['application_key_1']['name'] = 'Ping top 500 websites'
-    new = data['applications']['application_key_1']['pings']['google']
-    with open('urls.csv') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            print(row['URL'])
-            data['applications']['application_key_1']['pings'][str(row['Rank'])] = copy.deepcopy(new)
-            cur = data['applications']['application_key_1']['pings'][str(row['Rank'])]
-            cur['name'] = row['URL']
-            cur['request_timeout'] = 5
-            cur['requests_count'] = 1
-            cur['url'] = row['URL']
-            del cur['items']['ab_test']
-            print(cur['items'])
-
-    del data['applications']['application_key_1']['pings']['google']
-
-    with open('tests/500.json', 'w') as file:
-        json.dump(data, file)
-            #data['applications']
-            #print(row['URL'])
+import os
+import sys
 
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
 
+from amtp.tbmon import iter_applications, iter_document, write_document
+
+APPLICATION = 'application_key_1'
+TEMPLATE = 'google'
+NAME = 'Ping top 500 websites'
+
+
+def pings(template, csvfile, request_timeout):
+    # one ping at a time, written out before the next row is read
+    reader = csv.DictReader(csvfile)
+    for row in reader:
+        print(row['URL'])
+        cur = dict(template)
+        cur['name'] = row['URL']
+        cur['request_timeout'] = request_timeout
+        cur['requests_count'] = 1
+        cur['url'] = row['URL']
+        cur['items'] = dict((key, value) for key, value in template['items'].items()
+                            if key != 'ab_test')
+        print(cur['items'])
+        yield str(row['Rank']), cur
+
+
+def replace_template(application_pings, application_fields, csvfile, request_timeout):
+    """
+    Yields the pings of the application other than the template, then a ping
+    made from the template for every row of csvfile
+    """
+    template = None
+    for ping, ping_data in application_pings:
+        if ping == TEMPLATE:
+            template = ping_data
+        else:
+            yield ping, ping_data
+    if template is None:
+        raise ValueError("application {} has no '{}' ping".format(APPLICATION, TEMPLATE))
+    # the members of the application are read by now
+    application_fields['name'] = NAME
+    for ping in pings(template, csvfile, request_timeout):
+        yield ping
+
+
+def prepare(input_path, csv_path, output_path, request_timeout=5):
+    """
+    Copies the TBMON document at input_path to output_path with the template
+    ping of APPLICATION replaced by a ping of every URL of csv_path. The rest
+    of the document is streamed through untouched
+    """
+    fields = {}
+    with open(input_path) as jsonfile, open(csv_path) as csvfile, \
+            open(output_path, 'w') as file:
+        def applications():
+            for application, application_fields, application_pings in \
+                    iter_applications(iter_document(jsonfile), fields):
+                if application == APPLICATION:
+                    application_pings = replace_template(application_pings, application_fields,
+                                                         csvfile, request_timeout)
+                yield application, application_fields, application_pings
+
+        write_document(file, applications(), fields)
+
+
+if __name__ == '__main__':
+    prepare('tests/input.json', 'urls.csv', 'tests/500.json')
@@ -0,0 +1,54 @@
+"""
+Fixtures shared by the tests, run with pytest from the AMTP directory
+"""
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+except ImportError: # Python < 3.7
+    ThreadingHTTPServer = None
+
+import pytest
+
+from geventhttpclient.url import URL
+
+
+if ThreadingHTTPServer is not None:
+    class Handler(BaseHTTPRequestHandler):
+        """
+        Keep-alive server answering GET with 'ok' and refusing HEAD
+        """
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = b'ok'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_HEAD(self):
+            self.send_response(405)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+
+@pytest.fixture
+def url():
+    """
+    URL of a keep-alive HTTP server on loopback, run in a thread so that
+    both the gevent and the asyncio clients can reach it
+    """
+    if ThreadingHTTPServer is None:
+        pytest.skip('Python 3.7+ only')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield URL('http://127.0.0.1:{}/'.format(server.server_address[1]))
+    server.shutdown()
+    server.server_close()
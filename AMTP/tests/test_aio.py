@@ -0,0 +1,67 @@
+"""
+Tests of the HTTP client of amtp/aio.py, run with pytest from the AMTP directory
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+aio = pytest.importorskip('amtp.aio')
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def head(data):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await aio._read_head(aio._Connection(reader, None), 'GET')
+    return run(read())
+
+
+def test_read_head():
+    response = head(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nX-A: 1\r\nX-A: 2\r\n\r\nok')
+    assert response.status_code == 200
+    assert response.headers['x-a'] == ['1', '2']
+    assert response.remaining == 2 and response.keep_alive
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'garbage\r\n\r\n',
+    b'HTTP/1.1 200 OK\r\nno colon\r\n\r\n',
+    b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n',
+    # over the 64 KiB line limit of the reader
+    b'HTTP/1.1 200 OK\r\nX-Big: ' + b'a' * (1 << 17) + b'\r\n\r\n',
+], ids=['closed', 'status line', 'header', 'truncated', 'long header'])
+def test_malformed_head(data):
+    with pytest.raises(aio.HTTPError):
+        head(data)
+
+
+def test_retry_reuses_the_connection(url):
+    async def probe():
+        pool = aio.AsyncHostPool()
+        async with pool.connection(url) as client:
+            response = await client.request('HEAD', '/')
+            assert response.status_code == 405
+            await aio.finish_response(response)
+            response = await client.request('GET', '/')
+            assert response.status_code == 200
+            await aio.finish_response(response)
+        idle = pool.idle[pool.key(url)]
+        pool.close()
+        return pool.connects, len(idle)
+
+    # the connection of the HEAD request is handed back before the GET
+    assert run(probe()) == (1, 1)
@@ -0,0 +1,153 @@
+"""
+Tests of amtp/delta.py, run with pytest from the AMTP directory
+"""
+import copy
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.delta import DeltaWriter, apply_patch, diff_items, pointer
+
+
+class PatchFile(io.StringIO):
+    """
+    Keeps the patch readable once the writer closed the file
+    """
+    def close(self):
+        self.patch = json.loads(self.getvalue())
+
+
+def ping(loss, timestamp, url='example.test'):
+    return {'name': 'Example', 'url': url,
+            'items': {'request_loss': {'value': loss, 'timestamp': timestamp},
+                      'request_latency': {'value': {'p50': loss * 2, 'unit': 'ms'},
+                                          'timestamp': timestamp}}}
+
+
+def run(snapshot, results, document=None):
+    """
+    Writes the delta of a run with results {application: {ping: data}} and
+    returns the patch
+    """
+    file = PatchFile()
+    writer = DeltaWriter(file, snapshot)
+    for application, pings in results.items():
+        for name, data in pings.items():
+            writer.add(application, name, data)
+    writer.close(document)
+    return file.patch
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def test_pointer():
+    assert pointer() == ''
+    assert pointer('applications', 'a/b', 'm~n', 0) == '/applications/a~1b/m~0n/0'
+    document = {'a/b': {'m~n': 1}}
+    apply_patch(document, [{'op': 'replace', 'path': pointer('a/b', 'm~n'), 'value': 2}])
+    assert document == {'a/b': {'m~n': 2}}
+
+
+def test_apply_patch():
+    document = {'a': {'b': 1}, 'list': [1, 2]}
+    result = apply_patch(document, [
+        {'op': 'add', 'path': '/a/c', 'value': [3]},
+        {'op': 'replace', 'path': '/a/b', 'value': 2},
+        {'op': 'remove', 'path': '/list/0'},
+        {'op': 'add', 'path': '/list/-', 'value': 4},
+        {'op': 'add', 'path': '/list/0', 'value': 0},
+        {'op': 'test', 'path': '/list', 'value': [0, 2, 4]},
+    ])
+    assert result is document
+    assert document == {'a': {'b': 2, 'c': [3]}, 'list': [0, 2, 4]}
+    assert apply_patch(document, [{'op': 'replace', 'path': '', 'value': [1]}]) == [1]
+
+
+@pytest.mark.parametrize('op', [
+    {'op': 'remove', 'path': '/missing'},
+    {'op': 'replace', 'path': '/a/missing', 'value': 1},
+    {'op': 'add', 'path': '/missing/b', 'value': 1},
+    {'op': 'add', 'path': '/a/b/c', 'value': 1},
+    {'op': 'test', 'path': '/a/b', 'value': 2},
+    {'op': 'test', 'path': '', 'value': {}},
+    {'op': 'move', 'path': '/a', 'from': '/b'},
+    {'op': 'remove', 'path': ''},
+    {'op': 'add', 'path': 'a', 'value': 1},
+], ids=['remove', 'replace', 'add parent', 'add scalar', 'test', 'test root', 'move',
+        'remove root', 'relative'])
+def test_apply_patch_errors(op):
+    with pytest.raises(ValueError):
+        apply_patch({'a': {'b': 1}}, [op])
+
+
+def test_diff_items():
+    old = ping(0, 100)['items']
+    # only the timestamp changed, nothing to patch
+    assert diff_items(['items'], old, ping(0, 200)['items']) == []
+    new = ping(0, 200)['items']
+    new['request_loss']['value'] = 20
+    ops = diff_items(['items'], old, new)
+    assert sorted(ops, key=lambda op: op['path']) == [
+        {'op': 'replace', 'path': '/items/request_loss/timestamp', 'value': 200},
+        {'op': 'replace', 'path': '/items/request_loss/value', 'value': 20},
+    ]
+    patched = apply_patch(copy.deepcopy({'items': old}), ops)['items']
+    assert patched['request_loss'] == new['request_loss']
+    # the unchanged item keeps the time of its last change
+    assert patched['request_latency'] == old['request_latency']
+
+
+def test_round_trip(tmp_path):
+    """
+    Replaying the patches of the runs gives the snapshot of the last one
+    """
+    snapshot = str(tmp_path / 'snapshot.json')
+    runs = [
+        ({'app': {'a': ping(0, 100), 'b': ping(0, 100)}}, {'version': 1, 'applications': {}}),
+        # a changes, b only gets a new timestamp, c is new and so is app2
+        ({'app': {'a': ping(50, 200), 'b': ping(0, 200), 'c': ping(0, 200)},
+          'app2': {'d': ping(0, 200)}}, {'version': 2, 'applications': {}}),
+        # b is gone, the url of c changed and app2 is gone
+        ({'app': {'a': ping(50, 300), 'c': ping(0, 300, url='other.test')}},
+         {'version': 2, 'applications': {}}),
+    ]
+    replayed = {'applications': {}}
+    patches = []
+    for results, document in runs:
+        patch = run(snapshot, results, document)
+        patches.append(patch)
+        replayed = apply_patch(replayed, patch)
+        assert replayed == load(snapshot)
+    # the unchanged b of the second run is not in its patch
+    assert not any('/b/' in op['path'] for op in patches[1])
+    final = load(snapshot)
+    assert final['version'] == 2
+    assert sorted(final['applications']) == ['app']
+    assert sorted(final['applications']['app']['pings']) == ['a', 'c']
+    a = final['applications']['app']['pings']['a']['items']
+    # the time of the last change
+    assert a['request_loss'] == {'value': 50, 'timestamp': 200}
+    assert final['applications']['app']['pings']['c']['url'] == 'other.test'
+    # nothing changed, nothing to patch
+    assert run(snapshot, {'app': {'a': ping(50, 400), 'c': ping(0, 400, url='other.test')}},
+               {'version': 2, 'applications': {}}) == []
+
+
+def test_abort(tmp_path):
+    snapshot = str(tmp_path / 'snapshot.json')
+    run(snapshot, {'app': {'a': ping(0, 100)}})
+    before = load(snapshot)
+    file = PatchFile()
+    writer = DeltaWriter(file, snapshot)
+    writer.add('app', 'a', ping(100, 200))
+    writer.abort()
+    assert file.patch == []
+    assert load(snapshot) == before
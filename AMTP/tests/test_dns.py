@@ -0,0 +1,227 @@
+"""
+Tests of amtp/dns.py against a stub nameserver on loopback, run with pytest
+from the AMTP directory
+"""
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import gevent
+import gevent.socket
+import pytest
+from gevent.server import DatagramServer
+from geventhttpclient.url import URL
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp import dns
+from amtp.dns import DNSError, Resolver
+from amtp.pool import HostPool, finish_response
+from conftest import Handler
+
+
+def _name(query):
+    labels = []
+    offset = 12
+    while query[offset]:
+        length = query[offset]
+        labels.append(query[offset + 1:offset + 1 + length].decode('ascii'))
+        offset += 1 + length
+    return '.'.join(labels)
+
+
+def _answer(query, rcode, addresses, ttl, soa_ttl):
+    question = query[12:]
+    header = struct.pack('!HHHHHH', struct.unpack('!H', query[:2])[0], 0x8180 | rcode, 1,
+                         len(addresses), 1 if soa_ttl is not None else 0, 0)
+    records = b''
+    for address in addresses:
+        records += struct.pack('!HHHIH', 0xC00C, dns.TYPE_A, dns.CLASS_IN, ttl, 4)
+        records += socket.inet_aton(address)
+    if soa_ttl is not None:
+        # root names for MNAME and RNAME, MINIMUM last
+        rdata = b'\0\0' + struct.pack('!IIIII', 1, 60, 60, 60, soa_ttl)
+        records += struct.pack('!HHHIH', 0xC00C, dns.TYPE_SOA, dns.CLASS_IN, 3600, len(rdata))
+        records += rdata
+    return header + question + records
+
+
+class Stub(DatagramServer):
+    """
+    Nameserver answering from records: name -> (rcode, addresses, ttl,
+    SOA minimum or None, seconds to wait before answering)
+    """
+    def __init__(self, records):
+        super(Stub, self).__init__(('127.0.0.1', 0))
+        self.records = records
+        self.queries = {}
+
+    def handle(self, data, address):
+        data = bytearray(data)
+        name = _name(data)
+        self.queries[name] = self.queries.get(name, 0) + 1
+        rcode, addresses, ttl, soa_ttl, delay = self.records.get(
+            name, (dns.RCODE_NXDOMAIN, [], 0, 30, 0))
+        if delay:
+            gevent.sleep(delay)
+        self.socket.sendto(_answer(data, rcode, addresses, ttl, soa_ttl), address)
+
+
+@pytest.fixture
+def stub():
+    server = Stub({
+        'a.test': (dns.RCODE_NOERROR, ['10.0.0.1', '10.0.0.2'], 30, None, 0),
+        'long.test': (dns.RCODE_NOERROR, ['10.0.0.3'], 86400, None, 0),
+        'nx.test': (dns.RCODE_NXDOMAIN, [], 0, 20, 0),
+        'slow.test': (dns.RCODE_NOERROR, ['10.0.0.4'], 30, None, 0.2),
+        # no A record
+        'v6.test': (dns.RCODE_NOERROR, [], 0, 40, 0),
+    })
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def resolver(stub):
+    resolver = Resolver(['127.0.0.1'], port=stub.server_port, timeout=1, retries=1,
+                        max_ttl=3600)
+    resolver.hosts = {}
+    return resolver
+
+
+@pytest.fixture
+def later(monkeypatch):
+    """
+    Moves the clock of the cache on by the seconds passed
+    """
+    offset = [0]
+    now = time.time
+    monkeypatch.setattr(dns.time, 'time', lambda: now() + offset[0])
+    def move(seconds):
+        offset[0] += seconds
+    return move
+
+
+def test_ttl_cache(stub, resolver, later):
+    assert resolver.resolve('a.test') == ['10.0.0.1', '10.0.0.2']
+    assert resolver.resolve('A.Test.') == ['10.0.0.1', '10.0.0.2']
+    assert resolver.cached('a.test') == ['10.0.0.1', '10.0.0.2']
+    assert stub.queries['a.test'] == 1
+    assert resolver.stats()['hits'] == 1
+    later(31)
+    assert resolver.cached('a.test') is None
+    resolver.resolve('a.test')
+    assert stub.queries['a.test'] == 2
+
+
+def test_max_ttl(stub, resolver, later):
+    resolver.resolve('long.test')
+    later(3601)
+    resolver.resolve('long.test')
+    assert stub.queries['long.test'] == 2
+
+
+def test_negative_cache(stub, resolver, later):
+    for i in range(2):
+        with pytest.raises(DNSError):
+            resolver.resolve('nx.test')
+    with pytest.raises(DNSError):
+        resolver.cached('nx.test')
+    assert stub.queries['nx.test'] == 1
+    assert resolver.stats()['failures'] == 1
+    # the MINIMUM of the SOA record
+    later(21)
+    assert resolver.cached('nx.test') is None
+    with pytest.raises(DNSError):
+        resolver.resolve('nx.test')
+    assert stub.queries['nx.test'] == 2
+
+
+def test_shared_lookup(stub, resolver):
+    jobs = [gevent.spawn(resolver.resolve, 'slow.test') for i in range(5)]
+    gevent.joinall(jobs, raise_error=True)
+    assert [job.value for job in jobs] == [['10.0.0.4']] * 5
+    assert stub.queries['slow.test'] == 1
+
+
+@pytest.mark.parametrize('interrupt', ['kill', 'timeout'])
+def test_interrupted_lookup(stub, resolver, interrupt):
+    def first(host):
+        with gevent.Timeout(0.05):
+            resolver.resolve(host)
+    job = gevent.spawn(first if interrupt == 'timeout' else resolver.resolve, 'slow.test')
+    gevent.sleep(0.01)
+    waiter = gevent.spawn(resolver.resolve, 'slow.test')
+    gevent.sleep(0.01)
+    if interrupt == 'kill':
+        job.kill()
+    waiter.join()
+    # the waiter looked the host up itself, it didn't get the first one's error
+    assert waiter.value == ['10.0.0.4']
+    assert stub.queries['slow.test'] == 2
+    assert not resolver.pending
+
+
+def test_prefetch(stub, resolver):
+    failed = resolver.prefetch(['A.TEST', 'a.test.', 'a.test', 'nx.test', '10.1.2.3', '[::1]'])
+    assert list(failed) == ['nx.test']
+    assert stub.queries == {'a.test': 1, 'nx.test': 1}
+    resolver.prefetch(['A.Test'])
+    assert stub.queries['a.test'] == 1
+
+
+def test_literals(resolver):
+    assert resolver.resolve('10.1.2.3') == ['10.1.2.3']
+    assert resolver.resolve('[::1]') == ['::1']
+    assert resolver.cached('[2001:DB8::1]') == ['2001:db8::1']
+
+
+def test_ipv6_fallback(stub, resolver, monkeypatch):
+    calls = []
+    def getaddrinfo(host, port, family=0, type=0, *args):
+        calls.append((host, family))
+        return [(socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('2001:db8::1', 0, 0, 0))]
+    monkeypatch.setattr(dns.gevent.socket, 'getaddrinfo', getaddrinfo)
+    assert resolver.resolve('v6.test') == ['2001:db8::1']
+    assert calls == [('v6.test', 0)]
+
+
+def test_ipv6_fallback_failure(stub, resolver, monkeypatch):
+    def getaddrinfo(*args):
+        raise gevent.socket.gaierror('no address')
+    monkeypatch.setattr(dns.gevent.socket, 'getaddrinfo', getaddrinfo)
+    with pytest.raises(DNSError) as info:
+        resolver.resolve('v6.test')
+    # cached for the MINIMUM of the SOA record
+    assert info.value.ttl == 40
+    with pytest.raises(DNSError):
+        resolver.cached('v6.test')
+
+
+def test_ipv6_pool(resolver):
+    class Server(ThreadingHTTPServer):
+        address_family = socket.AF_INET6
+    try:
+        server = Server(('::1', 0), Handler)
+    except OSError:
+        pytest.skip('no IPv6 loopback')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        resolver.hosts = {'six.test': ['::1']}
+        pool = HostPool(timeout=5, resolver=resolver)
+        for url in ('http://six.test:{}/', 'http://[::1]:{}/'):
+            with pool.connection(URL(url.format(server.server_address[1]))) as http:
+                response = http.get('/')
+                assert response.status_code == 200
+                finish_response(response)
+        pool.close()
+    finally:
+        server.shutdown()
+        server.server_close()
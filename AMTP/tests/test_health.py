@@ -0,0 +1,108 @@
+"""
+Tests of amtp/health.py, run with pytest from the AMTP directory
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp import health
+from amtp.health import MIN_SAMPLES, MIN_TIMEOUT, TIMEOUT_MARGIN, HostHealth
+
+KEY = ('http', 'example.test', 80)
+
+
+@pytest.fixture
+def later(monkeypatch):
+    """
+    Moves the clock of the breakers on by the seconds passed
+    """
+    offset = [0]
+    now = time.time
+    monkeypatch.setattr(health.time, 'time', lambda: now() + offset[0])
+    def move(seconds):
+        offset[0] += seconds
+    return move
+
+
+def test_breaker(later):
+    hosts = HostHealth(threshold=3, cooldown=60)
+    # closed
+    for i in range(2):
+        hosts.failure(KEY, 1.0)
+        assert hosts.allow(KEY)
+    # open
+    hosts.failure(KEY, 1.0)
+    assert not hosts.allow(KEY)
+    assert hosts.stats() == {'open': 1, 'trips': 1, 'skipped': 1, 'cut_short': 0,
+                             'saved': 1.0}
+    # half-open: one attempt goes through, the others are still skipped
+    later(60)
+    assert hosts.allow(KEY)
+    assert not hosts.allow(KEY)
+    # the trial fails, open again for another cooldown
+    hosts.failure(KEY, 1.0)
+    assert hosts.stats()['trips'] == 2
+    later(30)
+    assert not hosts.allow(KEY)
+    later(30)
+    assert hosts.allow(KEY)
+    # the trial succeeds, closed
+    hosts.success(KEY, 0.1)
+    assert hosts.allow(KEY) and hosts.allow(KEY)
+    assert hosts.stats()['open'] == 0
+    # and counts from scratch again
+    hosts.failure(KEY, 1.0)
+    assert hosts.allow(KEY)
+
+
+def test_unfinished_trial(later):
+    hosts = HostHealth(threshold=1, cooldown=60)
+    hosts.failure(KEY, 1.0)
+    later(60)
+    assert hosts.allow(KEY)
+    # the trial neither succeeded nor failed, another one goes after a cooldown
+    later(59)
+    assert not hosts.allow(KEY)
+    later(1)
+    assert hosts.allow(KEY)
+
+
+def test_fixed_by_default():
+    hosts = HostHealth()
+    for i in range(10):
+        hosts.success(KEY, 0.01)
+    assert hosts.timeout(KEY, 10) == 10
+
+
+def test_rto():
+    hosts = HostHealth(adaptive=True)
+    # too few samples
+    for i in range(MIN_SAMPLES - 1):
+        hosts.success(KEY, 1.0)
+        assert hosts.timeout(KEY, 10) == 10
+    hosts.success(KEY, 1.0)
+    host = hosts.hosts[KEY]
+    assert hosts.timeout(KEY, 10) == pytest.approx((host.srtt + 4 * host.rttvar) * TIMEOUT_MARGIN)
+    # never above request_timeout
+    assert hosts.timeout(KEY, 2) == 2
+    # unknown hosts get request_timeout
+    assert hosts.timeout(('http', 'other.test', 80), 10) == 10
+
+
+def test_rto_floor():
+    hosts = HostHealth(adaptive=True)
+    for i in range(50):
+        hosts.success(KEY, 0.001)
+    assert hosts.timeout(KEY, 10) == MIN_TIMEOUT * TIMEOUT_MARGIN
+
+
+def test_cut_short():
+    hosts = HostHealth(adaptive=True)
+    hosts.failure(KEY, 0.5, timeout=0.5, request_timeout=2)
+    hosts.failure(KEY, 2, timeout=2, request_timeout=2)
+    assert hosts.stats()['cut_short'] == 1
+    assert hosts.stats()['saved'] == 1.5
@@ -0,0 +1,65 @@
+"""
+Tests of amtp/histogram.py, run with pytest from the AMTP directory
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.histogram import RESOLUTION, LatencyHistogram
+
+
+def exact(values, p):
+    values = sorted(values)
+    return values[max(-(-p * len(values) // 100), 1) - 1]
+
+
+def test_percentiles():
+    rng = random.Random(1)
+    values = [rng.lognormvariate(3, 1) for i in range(10000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.add(value)
+    for p in (1, 50, 95, 99, 100):
+        assert histogram.percentile(p) == pytest.approx(exact(values, p), rel=0.01)
+    summary = histogram.summary()
+    assert summary['min'] == round(min(values), 3)
+    assert summary['max'] == round(max(values), 3)
+    assert histogram.mean() == pytest.approx(sum(values) / len(values))
+
+
+def test_bounds():
+    histogram = LatencyHistogram()
+    for value in (0, 0.0001, 5.0):
+        histogram.add(value)
+    # the tiny values share the first bucket
+    assert histogram.percentile(50) == pytest.approx(RESOLUTION, rel=0.01)
+    assert histogram.percentile(100) == pytest.approx(5.0, rel=0.01)
+    # the middle of a bucket is kept within the exact min and max
+    histogram = LatencyHistogram()
+    histogram.add(7.0)
+    assert histogram.percentile(1) == histogram.percentile(99) == 7.0
+
+
+def test_empty():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean() is None
+    assert histogram.summary() == {}
+
+
+def test_merge():
+    first, second, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for value in range(1, 100):
+        (first if value % 2 else second).add(value)
+        both.add(value)
+    first.merge(second)
+    first.merge(LatencyHistogram())
+    assert first.counts == both.counts
+    assert (first.count, first.total, first.min, first.max) == \
+        (both.count, both.total, both.min, both.max)
+    with pytest.raises(ValueError):
+        first.merge(LatencyHistogram(precision=0.05))
@@ -0,0 +1,128 @@
+"""
+Tests of amtp/icmp.py, run with pytest from the AMTP directory. The loopback
+ping is skipped without the permission to open an ICMP socket
+"""
+import os
+import struct
+import sys
+
+import gevent
+import gevent.socket
+import pytest
+from gevent.event import Event
+from gevent.queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.icmp import (ECHO_REPLY, ECHO_REQUEST, ICMP, MAGIC, _Target, build_request,
+                       checksum, clock, parse_reply, summary)
+
+
+def reply(ident, seq, payload=MAGIC * 4, ip_header=False):
+    packet = struct.pack('!BBHHH', ECHO_REPLY, 0, 0, ident, seq) + payload
+    if ip_header:
+        # version 4, 5 words
+        packet = b'\x45' + b'\0' * 19 + packet
+    return bytearray(packet)
+
+
+def test_checksum():
+    # the example of RFC 1071
+    assert checksum(b'\x00\x01\xf2\x03\xf4\xf5\xf6\xf7') == 0x220d
+    assert checksum(b'') == 0xffff
+    # odd lengths are padded with a zero byte
+    assert checksum(b'\x01\x02\x03') == checksum(b'\x01\x02\x03\x00')
+
+
+@pytest.mark.parametrize('size', [0, 1, 7, 56])
+def test_build_request(size):
+    packet = build_request(0x1234, 0xfffe, size)
+    assert len(packet) == 8 + size
+    kind, code, _, ident, seq = struct.unpack('!BBHHH', packet[:8])
+    assert (kind, code, ident, seq) == (ECHO_REQUEST, 0, 0x1234, 0xfffe)
+    # a valid checksum sums up to zero
+    assert checksum(packet) == 0
+
+
+def test_parse_reply():
+    assert parse_reply(reply(7, 9)) == (7, 9)
+    assert parse_reply(reply(7, 9, ip_header=True)) == (7, 9)
+    assert parse_reply(reply(7, 9, payload=b'')) == (7, 9)
+    # echo requests, foreign payloads and short packets are not ours
+    assert parse_reply(bytearray(build_request(7, 9))) is None
+    assert parse_reply(reply(7, 9, payload=b'ping')) is None
+    assert parse_reply(bytearray(b'\0\0\0')) is None
+    assert parse_reply(bytearray()) is None
+
+
+def test_summary():
+    stats = summary([0.010, 0.020, 0.030], 4)
+    assert (stats['transmitted'], stats['received'], stats['loss']) == (4, 3, 25.0)
+    assert stats['rtt'] == {'min': 10.0, 'avg': 20.0, 'max': 30.0, 'mdev': 8.165,
+                            'jitter': 10.0}
+    stats = summary([0.005], 1)
+    assert stats['loss'] == 0
+    assert stats['rtt']['mdev'] == 0 and stats['rtt']['jitter'] == 0
+    assert summary([], 3) == {'transmitted': 3, 'received': 0, 'loss': 100, 'rtt': {}}
+    assert summary([], 0)['loss'] == 100
+
+
+class FakeSocket(object):
+    def __init__(self, kind):
+        self.type = kind
+        self.packets = Queue()
+
+    def recvfrom(self, size):
+        return self.packets.get()
+
+
+@pytest.mark.parametrize('kind', [gevent.socket.SOCK_RAW, gevent.socket.SOCK_DGRAM])
+def test_receive(kind):
+    icmp = ICMP(timeout=10)
+    sock = FakeSocket(kind)
+    targets = {'10.0.0.1': _Target(), '10.0.0.2': _Target()}
+    # sent now, apart from the third one which is past the timeout
+    now = clock()
+    pending = {('10.0.0.1', 1): now, ('10.0.0.1', 2): now, ('10.0.0.2', 1): now,
+               ('10.0.0.2', 2): now - 11}
+    idle = Event()
+    # another pinger's identifier, only a raw socket sees those
+    sock.packets.put((reply(icmp.ident ^ 1, 2), ('10.0.0.1', 0)))
+    sock.packets.put((reply(icmp.ident, 1), ('10.0.0.1', 0)))
+    # duplicate, unknown sequence, unknown address and not an echo reply
+    sock.packets.put((reply(icmp.ident, 1), ('10.0.0.1', 0)))
+    sock.packets.put((reply(icmp.ident, 5), ('10.0.0.1', 0)))
+    sock.packets.put((reply(icmp.ident, 1), ('10.0.0.3', 0)))
+    sock.packets.put((bytearray(build_request(icmp.ident, 2)), ('10.0.0.1', 0)))
+    receiver = gevent.spawn(icmp._receive, sock, targets, pending, idle)
+    gevent.sleep(0.01)
+    assert len(targets['10.0.0.1'].rtts) == (1 if kind == gevent.socket.SOCK_RAW else 2)
+    assert not targets['10.0.0.2'].rtts
+    assert not idle.is_set()
+    sock.packets.put((reply(icmp.ident, 1), ('10.0.0.2', 0)))
+    sock.packets.put((reply(icmp.ident, 2), ('10.0.0.1', 0)))
+    sock.packets.put((reply(icmp.ident, 2), ('10.0.0.2', 0)))
+    assert idle.wait(1)
+    receiver.kill()
+    assert not pending
+    # the late reply is matched but not counted
+    assert len(targets['10.0.0.2'].rtts) == 1
+    assert all(0 <= rtt < 1 for rtt in targets['10.0.0.1'].rtts + targets['10.0.0.2'].rtts)
+
+
+def test_no_ipv4_address():
+    class Resolver(object):
+        def resolve(self, host):
+            return ['2001:db8::1']
+    result = ICMP(count=1, resolver=Resolver()).ping(['six.test'])['six.test']
+    assert result['transmitted'] == 0 and result['loss'] == 100
+    assert 'no IPv4 address' in result['error']
+
+
+def test_loopback():
+    result = ICMP(count=3, interval=0.05, timeout=1).ping(['127.0.0.1'])['127.0.0.1']
+    if result.get('error', '').startswith('ICMP socket'):
+        pytest.skip(result['error'])
+    assert (result['transmitted'], result['received'], result['loss']) == (3, 3, 0)
+    assert set(result['rtt']) == {'min', 'avg', 'max', 'mdev', 'jitter'}
+    assert 0 <= result['rtt']['min'] <= result['rtt']['avg'] <= result['rtt']['max']
@@ -0,0 +1,73 @@
+"""
+Tests of amtp/matcher.py, run with pytest from the AMTP directory
+"""
+import io
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.matcher import BodyMatcher
+
+
+def match(patterns, body, block_size=16):
+    return BodyMatcher(patterns, block_size=block_size).match(io.BytesIO(body))
+
+
+def test_literals():
+    assert match(['hello', 'world'], b'hello world')
+    assert not match(['hello', 'there'], b'hello world')
+    # both at the same position
+    assert match(['hell', 'hello'], b'oh hello')
+    assert match(['a.c'], b'xa.cx')
+    assert not match(['a.c'], b'xabcx')
+
+
+def test_inline_flags():
+    assert match(['re:(?i)HELLO'], b'say hello')
+    assert match(['literal', 're:(?i)HELLO', 're:(?s)a.b'], b'literal HeLLo a\nb')
+    assert not match(['re:(?i)HELLO', 're:a.b'], b'hello a\nb')
+
+
+def test_backreferences():
+    assert match(['re:(ab)\\1'], b'xxababxx')
+    assert not match(['re:(ab)\\1'], b'xxabacxx')
+    # the numbers of the groups of a pattern don't depend on the others
+    assert match(['re:(x)(y)', 're:(c)(d)\\2\\1', 'lit'], b'xy cddc lit')
+    assert not match(['re:(x)(y)', 're:(c)(d)\\2\\1'], b'xy cdcd')
+    assert match(['re:(?P<tag>\\w+)=(?P=tag)'], b'a=b foo=foo')
+
+
+def test_invalid_regex():
+    with pytest.raises(re.error):
+        BodyMatcher(['re:(unclosed'])
+
+
+@pytest.mark.parametrize('block_size', range(1, 12))
+def test_spanning_blocks(block_size):
+    body = b'0123456789 needle ' * 3 + b'id=42; end'
+    assert match(['needle', 're:id=\\d+;', 're:(?i)END'], body, block_size)
+    assert not match(['needle', 're:id=\\d{3};'], body, block_size)
+
+
+def test_max_bytes():
+    matcher = BodyMatcher(['needle'], max_bytes=20, block_size=8)
+    assert matcher.match(io.BytesIO(b'x' * 10 + b'needle'))
+    assert not matcher.match(io.BytesIO(b'x' * 20 + b'needle'))
+    assert not matcher.match_body(b'x' * 20 + b'needle')
+    assert matcher.match_body(b'needle')
+
+
+def test_scan():
+    scan = BodyMatcher(['ab', 're:c+d'], block_size=4).scan()
+    assert scan.wanted() == 4
+    assert scan.feed(b'xxa')
+    assert scan.feed(b'bcc')
+    assert not scan.matched()
+    assert scan.feed(b'd')
+    assert scan.matched()
+    assert scan.wanted() == 0
+    assert not scan.feed(b'')
@@ -0,0 +1,48 @@
+"""
+Tests of amtp/metrics.py, run with pytest from the AMTP directory
+"""
+import io
+import os
+import sys
+import time
+
+try:
+    from urllib.request import urlopen
+except ImportError: # Python 2
+    from urllib2 import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.metrics import Metrics
+
+
+def pinger(url):
+    import main
+    pings = {'ping_1': {'name': 'ping_1', 'url': str(url), 'items': {'request_loss': {}}}}
+    return main.HTTPPinger({'applications': {'app': {'name': 'app', 'pings': pings}}},
+                           validation=None)
+
+
+def test_serves_while_the_hub_is_blocked(url):
+    metrics = Metrics(pinger(url))
+    stats = io.StringIO()
+    metrics.start(0, stats_interval=0.05, file=stats)
+    try:
+        # blocking calls, the gevent hub doesn't run meanwhile, as with the
+        # asyncio engine probing
+        port = metrics.server.server_port
+        response = urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=5)
+        body = response.read().decode('utf8')
+        assert response.getcode() == 200
+        assert 'amtp_pings{state="queued"} 1' in body
+        assert 'amtp_http_requests_total 0' in body
+        time.sleep(0.3)
+    finally:
+        metrics.stop()
+    lines = stats.getvalue().splitlines()
+    assert len(lines) >= 2
+    assert lines[0].startswith('stats: 0/1 done')
+    # nothing is printed or served once stopped
+    time.sleep(0.1)
+    assert len(stats.getvalue().splitlines()) == len(lines)
+    assert metrics.server is None
@@ -0,0 +1,67 @@
+"""
+Tests of amtp/output.py, run with pytest from the AMTP directory
+"""
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp import output
+from amtp.output import NDJSONWriter, fold, read_records
+
+
+def record(ping):
+    return {'application': 'app', 'ping': ping, 'items': {'request_loss': {'value': 0}}}
+
+
+def test_batches():
+    file = io.StringIO()
+    writer = NDJSONWriter(file, batch_size=2, flush_interval=3600)
+    writer.write(record('a'))
+    assert file.getvalue() == ''
+    writer.write(record('b'))
+    writer.write(record('c'))
+    assert file.getvalue().count('\n') == 2
+    writer.close()
+    assert writer.written == 3
+    lines = file.getvalue().splitlines()
+    assert [json.loads(line)['ping'] for line in lines] == ['a', 'b', 'c']
+    # compact
+    assert ' ' not in lines[0]
+
+
+def test_flush_interval(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(output.time, 'time', lambda: now[0])
+    file = io.StringIO()
+    writer = NDJSONWriter(file, batch_size=100, flush_interval=1)
+    writer.write(record('a'))
+    assert file.getvalue() == ''
+    now[0] += 1
+    writer.write(record('b'))
+    assert writer.written == 2
+
+
+def test_read_records():
+    lines = [json.dumps(record(ping)) for ping in 'abc']
+    text = '\n'.join(lines[:2]) + '\n\n' + lines[2][:10]
+    # a truncated last line is skipped
+    assert [x['ping'] for x in read_records(io.StringIO(text))] == ['a', 'b']
+    # a broken line in the middle is not
+    with pytest.raises(ValueError):
+        list(read_records(io.StringIO(lines[2][:10] + '\n' + lines[0] + '\n')))
+
+
+def test_fold():
+    data = {'applications': {'app': {'pings': {
+        'a': {'url': 'a.test', 'items': {'request_loss': {}}},
+        'b': {'url': 'b.test', 'items': {'request_loss': {}}},
+    }}}}
+    assert fold(data, [record('a')]) == 1
+    pings = data['applications']['app']['pings']
+    assert pings['a'] == {'url': 'a.test', 'items': {'request_loss': {'value': 0}}}
+    assert pings['b']['items'] == {'request_loss': {}}
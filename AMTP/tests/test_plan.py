@@ -0,0 +1,65 @@
+"""
+Tests of amtp/plan.py, run with pytest from the AMTP directory
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.plan import compile_headers, compile_plan
+
+
+class Handlers(object):
+    ITEMS = ['request_loss']
+
+    def do_request_loss(self):
+        pass
+
+
+def ping(**fields):
+    data = {'name': 'ping_1', 'url': 'http://127.0.0.1:9/', 'items': {'request_loss': {}}}
+    data.update(fields)
+    return data
+
+
+def test_headers_compared_as_written():
+    assert compile_headers(['Server:nginx', 'X-Cache: HIT', 'Via:a:b']) == \
+        (('Server', 'nginx'), ('X-Cache', ' HIT'), ('Via', 'a:b'))
+    with pytest.raises(ValueError):
+        compile_headers(['no colon'])
+
+
+def test_plan():
+    plan = compile_plan(ping(expected_response_codes=['200', '204'],
+                             expected_headers=['Server:nginx'],
+                             expected_response_body=['ok', 're:(?i)OK']), Handlers)
+    assert plan.codes == frozenset([200, 204])
+    assert plan.headers == (('Server', 'nginx'),)
+    assert plan.body.match_body(b'ok')
+    assert [key for key, handler in plan.items] == ['request_loss']
+    plan = compile_plan(ping(), Handlers)
+    assert plan.codes is None and plan.headers is None and plan.body is None
+
+
+def test_invalid_regex():
+    with pytest.raises(ValueError) as info:
+        compile_plan(ping(expected_response_body=['re:(?i']), Handlers)
+    assert "ping 'ping_1'" in str(info.value)
+
+
+def test_unsupported_item():
+    with pytest.raises(ValueError):
+        compile_plan(ping(items={'ab_test': {}}), Handlers)
+
+
+def test_lazy_validation_marks_the_ping_invalid():
+    import main
+    pings = {'good': ping(name='good', expected_response_body=['re:(?i)ok']),
+             'bad': ping(name='bad', expected_response_body=['re:(?i'])}
+    pinger = main.HTTPPinger({'applications': {'app': {'name': 'app', 'pings': pings}}},
+                             validation='lazy')
+    assert [p.ping for p in pinger.pings] == ['good']
+    assert [(application, name) for application, name, message in pinger.invalid] == \
+        [('app', 'bad')]
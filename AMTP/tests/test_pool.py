@@ -0,0 +1,63 @@
+"""
+Tests of the connection reuse statistics of amtp/pool.py and amtp/aio.py,
+run with pytest from the AMTP directory
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from geventhttpclient.url import URL
+
+from amtp.pool import HostPool, finish_response
+
+
+def test_keep_alive(url):
+    pool = HostPool(timeout=5)
+    for i in range(3):
+        with pool.connection(url) as http:
+            response = http.get('/')
+            assert response.status_code == 200
+            finish_response(response)
+    stats = pool.stats()
+    assert (stats['requests'], stats['connects'], stats['reused']) == (3, 1, 2)
+    pool.close()
+
+
+def test_refused_is_no_reuse():
+    pool = HostPool(timeout=1)
+    for i in range(3):
+        with pytest.raises(Exception):
+            with pool.connection(URL('http://127.0.0.1:1/')) as http:
+                http.get('/')
+    stats = pool.stats()
+    assert stats['requests'] == 3
+    assert stats['reused'] == 0
+    assert stats['reuse_ratio'] == 0.0
+
+
+def test_async_keep_alive(url):
+    from amtp.aio import AsyncHostPool, finish_response as finish
+
+    async def run():
+        pool = AsyncHostPool()
+        for i in range(3):
+            async with pool.connection(url) as client:
+                response = await client.get('/')
+                assert response.status_code == 200
+                await finish(response)
+        with pytest.raises(OSError):
+            async with pool.connection(URL('http://127.0.0.1:1/')) as client:
+                await client.get('/')
+        pool.close()
+        return pool.stats()
+
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert (stats['requests'], stats['connects'], stats['reused']) == (4, 1, 2)
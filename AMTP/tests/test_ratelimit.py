@@ -0,0 +1,58 @@
+"""
+Tests of amtp/ratelimit.py, run with pytest from the AMTP directory
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp import ratelimit
+from amtp.ratelimit import RateLimiter, TokenBucket, fd_budget
+
+
+@pytest.fixture
+def now(monkeypatch):
+    """
+    The clock of the buckets, set by the test
+    """
+    now = [100.0]
+    monkeypatch.setattr(ratelimit, 'clock', lambda: now[0])
+    return now
+
+
+def test_token_bucket(now):
+    bucket = TokenBucket(10, burst=2)
+    # the burst goes out at once, then one every 0.1s in the order asked
+    assert [bucket.reserve() for i in range(2)] == [0, 0]
+    assert [bucket.reserve() for i in range(3)] == pytest.approx([0.1, 0.2, 0.3])
+    now[0] += 0.3
+    assert bucket.reserve() == pytest.approx(0.1)
+    # tokens saved up while idle are capped at the burst
+    now[0] += 60
+    assert [bucket.reserve() for i in range(3)] == pytest.approx([0, 0, 0.1])
+
+
+def test_default_burst():
+    assert TokenBucket(1000).burst == 100
+    assert TokenBucket(2).burst == 1
+
+
+def test_rate_limiter(now, monkeypatch):
+    slept = []
+    monkeypatch.setattr(ratelimit.gevent, 'sleep', slept.append)
+    limiter = RateLimiter(host_rate=1)
+    limiter.acquire('a')
+    limiter.acquire('b')
+    assert slept == []
+    limiter.acquire('a')
+    assert slept == [1]
+    limiter.discard('a')
+    limiter.acquire('a')
+    assert slept == [1]
+
+
+def test_fd_budget():
+    assert fd_budget(10) == 10
+    assert fd_budget(10 ** 9) >= 1
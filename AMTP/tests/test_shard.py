@@ -0,0 +1,41 @@
+"""
+Tests of amtp/shard.py, run with pytest from the AMTP directory
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.shard import assign, subset
+
+
+def test_assign():
+    pings = [('app', 'p{}'.format(i), 'big.test') for i in range(4)] + \
+        [('app', 'q{}'.format(i), 'mid.test') for i in range(3)] + \
+        [('other', 'r', 'small.test'), ('other', 's', 'tiny.test')]
+    shards = assign(pings, 2)
+    assert sorted(len(shard) for shard in shards) == [4, 5]
+    hosts = dict((ping[:2], ping[2]) for ping in pings)
+    # a host stays in a single shard
+    for host in ('big.test', 'mid.test'):
+        assert sum(1 for shard in shards if any(hosts[x] == host for x in shard)) == 1
+    assert sorted(x for shard in shards for x in shard) == sorted(x[:2] for x in pings)
+
+
+def test_assign_fewer_hosts():
+    shards = assign([('app', 'a', 'one.test'), ('app', 'b', 'one.test')], 4)
+    assert shards == [[('app', 'a'), ('app', 'b')]]
+    assert assign([], 2) == []
+
+
+def test_subset():
+    data = {'version': 1, 'applications': {
+        'app': {'name': 'App', 'pings': {'a': {'url': 'a'}, 'b': {'url': 'b'}}},
+        'other': {'pings': {'c': {'url': 'c'}}},
+    }}
+    shard = subset(data, [('app', 'b')])
+    assert shard == {'version': 1, 'applications': {'app': {'name': 'App',
+                                                             'pings': {'b': {'url': 'b'}}}}}
+    # the pings are shared, the containers are not
+    assert shard['applications']['app']['pings']['b'] is data['applications']['app']['pings']['b']
+    assert len(data['applications']['app']['pings']) == 2
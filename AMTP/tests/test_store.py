@@ -0,0 +1,147 @@
+"""
+Tests of amtp/store.py and tools/query_tool.py, run with pytest from the AMTP
+directory
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.store import ResultStore, flatten
+
+TOOLS = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'tools')
+sys.path.insert(0, TOOLS)
+
+import query_tool
+
+# the start of an hour, an hour ago
+HOUR = (int(time.time()) - 3600) // 3600 * 3600
+
+
+def record(ping, loss, timestamp, p95=None):
+    items = {'request_loss': {'value': loss, 'timestamp': timestamp}}
+    if p95 is not None:
+        items['request_latency'] = {'value': {'p95': p95, 'unit': 'ms'}, 'timestamp': timestamp}
+    return {'application': 'app', 'ping': ping, 'items': items}
+
+
+def rollups(store, resolution, ping, item='request_loss'):
+    return store.db.execute('''SELECT bucket, count, sum, min, max, nonzero FROM rollups
+        WHERE resolution = ? AND ping = ? AND item = ? ORDER BY bucket''',
+        (resolution, ping, item)).fetchall()
+
+
+def test_flatten():
+    items = {
+        'request_loss': {'value': 20, 'timestamp': 1},
+        'request_latency': {'value': {'p50': 1.5, 'p95': 3, 'unit': 'ms'}, 'timestamp': 2},
+        'ab_test': {'value': True},
+        'icmp_loss': {'error': 'timed out', 'timestamp': 3},
+        'icmp_rtt': {},
+    }
+    assert sorted(flatten(items)) == sorted([
+        ('request_loss', 20, None, 1),
+        ('request_latency.p50', 1.5, None, 2),
+        ('request_latency.p95', 3, None, 2),
+        ('icmp_loss', None, 'timed out', 3),
+    ])
+
+
+def test_rollups(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'), batch_size=2)
+    store.add(record('a', 0, HOUR + 10, p95=100))
+    store.add(record('a', 50, HOUR + 20, p95=300))
+    # flushed here, the next batch adds up to the same hour
+    store.add(record('a', 10, HOUR + 70))
+    store.add(record('a', 0, HOUR + 3600 + 5))
+    store.flush()
+    assert rollups(store, 60, 'a') == [
+        (HOUR, 2, 50.0, 0.0, 50.0, 1),
+        (HOUR + 60, 1, 10.0, 10.0, 10.0, 1),
+        (HOUR + 3600, 1, 0.0, 0.0, 0.0, 0),
+    ]
+    assert rollups(store, 3600, 'a') == [
+        (HOUR, 3, 60.0, 0.0, 50.0, 2),
+        (HOUR + 3600, 1, 0.0, 0.0, 0.0, 0),
+    ]
+    assert rollups(store, 60, 'a', 'request_latency.p95') == [(HOUR, 2, 400.0, 100.0, 300.0, 2)]
+    assert store.db.execute('SELECT COUNT(*) FROM results').fetchone() == (6,)
+    store.close()
+
+
+def test_errors_are_not_rolled_up(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    store.add({'application': 'app', 'ping': 'a',
+               'items': {'request_loss': {'error': 'timed out', 'timestamp': HOUR}}})
+    store.flush()
+    assert store.db.execute('SELECT item, value, error FROM results').fetchall() == \
+        [('request_loss', None, 'timed out')]
+    assert rollups(store, 60, 'a') == []
+    store.close()
+
+
+def test_query(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    store.add(record('a', 0, HOUR + 10), 'Target A')
+    store.add(record('a', 40, HOUR + 20), 'Target A')
+    store.add(record('b', 0, HOUR + 30), 'Target B')
+    store.add(record('c', 100, HOUR - 7200), 'Target C')
+    store.flush()
+    rows = store.query('request_loss', HOUR)
+    assert rows == [('app', 'a', 'Target A', 2, 20.0, 0.0, 40.0, 1),
+                    ('app', 'b', 'Target B', 1, 0.0, 0.0, 0.0, 0)]
+    assert store.query('request_loss', HOUR, above=0) == rows[:1]
+    # the bucket containing since is included as a whole
+    assert store.query('request_loss', HOUR + 59, resolution=60) == rows
+    assert store.query('request_loss', HOUR + 60, resolution=60) == []
+    # the 1h buckets further back
+    assert [row[1] for row in store.query('request_loss', HOUR - 7200)] == ['c', 'a', 'b']
+    assert store.query('request_latency.p95', HOUR) == []
+    store.close()
+
+
+def test_duration():
+    assert query_tool.duration('90') == 90
+    assert query_tool.duration('90s') == 90
+    assert query_tool.duration('15m') == 900
+    assert query_tool.duration('1h') == 3600
+    assert query_tool.duration('7d') == 604800
+    for text in ('', 'h', '1.5h', '1w', '-1h'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            query_tool.duration(text)
+
+
+def query(*args):
+    return subprocess.run([sys.executable, os.path.join(TOOLS, 'query_tool.py')] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def test_query_tool(tmp_path):
+    path = str(tmp_path / 'results.db')
+    store = ResultStore(path)
+    now = int(time.time())
+    store.add(record('a', 40, now), 'Target A')
+    store.add(record('b', 0, now))
+    store.close()
+    result = query('-d', path, '--since', '10m')
+    assert result.returncode == 0
+    lines = result.stdout.splitlines()
+    assert lines[0].split() == ['target', 'count', 'avg', 'min', 'max', 'nonzero']
+    assert lines[1].split() == ['app/Target', 'A', '1', '40.00', '40.00', '40.00', '1']
+    # the ping key stands in for a missing name
+    assert lines[2].split() == ['app/b', '1', '0.00', '0.00', '0.00', '0']
+    result = query('-d', path, '--above', '0', '--resolution', '1h')
+    assert len(result.stdout.splitlines()) == 2
+
+
+def test_query_tool_missing_db(tmp_path):
+    result = query('-d', str(tmp_path / 'missing.db'))
+    assert result.returncode == 1
+    assert 'is not a file' in result.stderr
+    assert not os.path.exists(str(tmp_path / 'missing.db'))
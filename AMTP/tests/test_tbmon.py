@@ -0,0 +1,84 @@
+"""
+Tests of amtp/tbmon.py, run with pytest from the AMTP directory
+"""
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.tbmon import iter_applications, iter_document, load, write_document
+
+DOCUMENT = {
+    'version': 1.5,
+    'limits': [1e3, -2.5E-3, 0, -0.0, 12345678901234567890, 1.0e+10],
+    'flags': [True, False, None],
+    'applications': {
+        'app_1': {
+            'name': 'first é "quoted" \\ app',
+            'weight': 0.25,
+            'pings': {
+                'ping_1': {'url': 'http://127.0.0.1:8765/', 'request_timeout': 1.5,
+                           'items': {'request_loss': {}, 'request_latency': {}}},
+                'ping_2': {'url': 'localhost/', 'requests_count': 10, 'scale': -1e-7},
+            },
+        },
+        'app_2': {'pings': {}, 'name': 'second', 'ratio': 3.14159},
+        'app_3': {'name': 'empty', 'pings': {}},
+    },
+    'total': 2.0,
+}
+
+
+@pytest.mark.parametrize('indent', [None, 1])
+def test_load_every_chunk_size(indent):
+    text = json.dumps(DOCUMENT, indent=indent)
+    for chunk_size in range(1, len(text) + 2):
+        assert load(io.StringIO(text), chunk_size) == DOCUMENT, chunk_size
+
+
+@pytest.mark.parametrize('text', ['1.', '1e', '1.5e+', '-', '12', 'tr'])
+def test_number_cut_at_chunk_end(text):
+    document = '{"value": ' + text
+    rest = {'1.': '25}', '1e': '3}', '1.5e+': '2}', '-': '7}', '12': '34}', 'tr': 'ue}'}[text]
+    expected = dict(json.loads(document + rest), applications={})
+    assert load(io.StringIO(document + rest), len(document)) == expected
+
+
+def test_events_in_order():
+    events = list(iter_document(io.StringIO(json.dumps(DOCUMENT)), 7))
+    kinds = [event[0] for event in events]
+    assert kinds == ['ping', 'ping', 'application', 'application', 'application', 'document']
+    assert [event[3] for event in events[:2]] == ['ping_1', 'ping_2']
+    assert events[-1][1] == dict((key, value) for key, value in DOCUMENT.items()
+                                 if key != 'applications')
+
+
+@pytest.mark.parametrize('text', ['', '{', '{"applications": {"a": {"pings": {"p": 1.}}}}',
+                                  '{"a": 1} x', '[1]', '{"a" 1}'])
+def test_malformed(text):
+    for chunk_size in (1, 3, 1024):
+        with pytest.raises(ValueError):
+            load(io.StringIO(text), chunk_size)
+
+
+def test_write_document_round_trip():
+    file = io.StringIO()
+    applications = ((name, dict((key, value) for key, value in application.items()
+                                if key != 'pings'), application['pings'].items())
+                    for name, application in DOCUMENT['applications'].items())
+    fields = dict((key, value) for key, value in DOCUMENT.items() if key != 'applications')
+    write_document(file, applications, fields)
+    assert json.loads(file.getvalue()) == DOCUMENT
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1024])
+def test_copy_through(chunk_size):
+    file = io.StringIO()
+    fields = {}
+    events = iter_document(io.StringIO(json.dumps(DOCUMENT)), chunk_size)
+    write_document(file, iter_applications(events, fields), fields)
+    assert json.loads(file.getvalue()) == DOCUMENT
@@ -0,0 +1,81 @@
+"""
+Tests of HTTPPinger.run_workers of main.py, run with pytest from the AMTP
+directory. The shards run one after the other in this process
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import main
+
+
+class SerialPool(object):
+    """
+    Stands in for the process pool, a job runs when its result is asked for
+    """
+    def __init__(self, processes, initializer=None):
+        pass
+
+    def imap_unordered(self, func, jobs):
+        self.func = func
+        self.jobs = iter(jobs)
+        return self
+
+    def next(self, timeout=None):
+        return self.func(next(self.jobs))
+
+    def terminate(self):
+        pass
+
+
+class Context(object):
+    Pool = SerialPool
+
+
+@pytest.fixture
+def pinger(url, monkeypatch):
+    monkeypatch.setattr(main.multiprocessing, 'get_context', lambda method: Context())
+    # TBMON urls come without the scheme
+    pings = {
+        'good': {'name': 'good', 'url': '127.0.0.1:{}/'.format(url.port),
+                 'items': {'request_loss': {}}},
+        # another host, another shard
+        'bad': {'name': 'bad', 'url': 'localhost:{}/'.format(url.port),
+                'items': {'request_loss': {}}},
+    }
+    return main.HTTPPinger({'applications': {'app': {'name': 'app', 'pings': pings}}},
+                           workers=2)
+
+
+def items(pinger, ping):
+    return pinger.data['applications']['app']['pings'][ping]['items']
+
+
+def test_failed_worker(pinger, monkeypatch):
+    probe_shard = main._probe_shard
+    def failing(index, data, options):
+        if 'bad' in data['applications']['app']['pings']:
+            raise RuntimeError('boom')
+        return probe_shard(index, data, options)
+    monkeypatch.setattr(main, '_probe_shard', failing)
+    pinger.run()
+    assert items(pinger, 'bad')['request_loss']['error'] == 'worker failed: RuntimeError: boom'
+    assert 'error' not in items(pinger, 'good')['request_loss']
+    assert items(pinger, 'good')['request_loss']['value'] == 0
+    # the output is still written
+    assert '"worker failed: RuntimeError: boom"' in pinger.dump_json()
+
+
+def test_lost_result(pinger, monkeypatch):
+    run_shard = main._run_shard
+    def failing(job):
+        if 'bad' in job[1]['applications']['app']['pings']:
+            raise ValueError('unpicklable')
+        return run_shard(job)
+    monkeypatch.setattr(main, '_run_shard', failing)
+    pinger.run()
+    assert items(pinger, 'bad')['request_loss']['error'] == 'worker failed: unpicklable'
+    assert 'error' not in items(pinger, 'good')['request_loss']
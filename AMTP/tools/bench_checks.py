@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the per-response checks: the old per-response parsing and
+eval dispatch against the compiled check plan of a Ping
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from geventhttpclient.response import HTTPResponse
+from main import Ping
+
+NUMBER = 100000
+
+DATA = {
+    'name': 'bench',
+    'url': 'example.com/',
+    'expected_response_codes': ['200', '301', '302', '304'],
+    'expected_headers': ['Server:nginx', 'Content-Type:text/html'],
+    'items': {'request_loss': {}, 'request_latency': {}},
+}
+
+
+def legacy_codes(data, response):
+    return response.status_code in [int(x) for x in data['expected_response_codes']]
+
+def legacy_header(data, response):
+    for field, value in [x.split(':', 1) for x in data['expected_headers']]:
+        header_value = response._headers_index.get_all(field)
+        if header_value:
+            if value == header_value[0]:
+                return True
+    return False
+
+def legacy_dispatch(ping):
+    for key in ping.data['items']:
+        eval('ping.do_' + key)
+
+
+def plan_codes(ping, response):
+    return ping._test_expected_response_codes(response)
+
+def plan_header(ping, response):
+    return ping._test_expected_header(response)
+
+def plan_dispatch(ping):
+    for key, handler in ping.plan.items:
+        handler
+
+
+def bench(name, func, *args):
+    seconds = min(timeit.repeat(lambda: func(*args), number=NUMBER, repeat=3))
+    print('{:<16} {:>8.0f} ns/call'.format(name, seconds / NUMBER * 1e9))
+    return seconds
+
+
+def main():
+    response = HTTPResponse()
+    response.feed(b'HTTP/1.1 200 OK\r\nContent-Type:text/html\r\n'
+                  b'Server:nginx\r\nContent-Length: 0\r\n\r\n')
+    ping = Ping('application', 'bench', DATA)
+    assert legacy_codes(DATA, response) == plan_codes(ping, response)
+    assert legacy_header(DATA, response) == plan_header(ping, response)
+
+    before = bench('legacy codes', legacy_codes, DATA, response)
+    before += bench('legacy headers', legacy_header, DATA, response)
+    before += bench('legacy dispatch', legacy_dispatch, ping)
+    after = bench('plan codes', plan_codes, ping, response)
+    after += bench('plan headers', plan_header, ping, response)
+    after += bench('plan dispatch', plan_dispatch, ping)
+    print('per response: {:.0f} ns before, {:.0f} ns after ({:.1f}x)'.format(
+        before / NUMBER * 1e9, after / NUMBER * 1e9, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""
+Benchmarks HTTPPinger against a local farm of stand-in HTTP targets
+
+The farm is a gevent server in a process of its own. Every target describes
+its behavior in the query string of its URL, so the generated TBMON configs
+are the whole benchmark definition:
+
+    lat     - median response latency in ms
+    jit     - standard deviation of the latency in ms
+    err     - fraction of the requests answered with 500
+    stall   - seconds to stall after half of the body was sent
+    size    - body size in bytes
+    ka      - 0 to close the connection after every response
+    n       - number of the request, seeds its latency and error
+
+The farm listens on the loopback addresses of the targets only.
+
+Configs of 500, 5k and 50k pings spread across --hosts loopback addresses are
+run each in a fresh process, which reports wall time, throughput, peak RSS
+and peak number of open file descriptors. Everything runs offline and the
+profile mix is deterministic, so results can be compared between commits.
+
+With --engines gevent asyncio every size is run on both engines of
+HTTPPinger. Requests/s and the memory per in-flight probe (RSS growth during
+the run over the highest number of requests in flight) compare the two.
+
+With --workers N the RSS and descriptors are those of the run process and its
+workers together and the requests those the workers report. The requests in
+flight are not known outside of the workers, so neither is the memory per
+probe.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+AMTP_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, AMTP_DIR)
+
+SIZES = [500, 5000, 50000]
+ENGINES = ['gevent']
+SAMPLE_INTERVAL = 0.05
+HOSTS = 1000
+PORT = 18080
+REQUEST_TIMEOUT = 2
+# profile -> (weight, target behavior)
+PROFILES = {
+    'fast': (70, {'lat': 5, 'jit': 2, 'size': 512}),
+    'slow': (10, {'lat': 300, 'jit': 100, 'size': 2048}),
+    'errors': (8, {'lat': 10, 'jit': 5, 'err': 0.3, 'size': 512}),
+    'stall': (2, {'lat': 10, 'stall': REQUEST_TIMEOUT * 2, 'size': 65536}),
+    'huge': (4, {'lat': 10, 'size': 4 * 1024 * 1024}),
+    'close': (6, {'lat': 5, 'jit': 2, 'size': 512, 'ka': 0}),
+}
+
+
+def _parse_query(query):
+    params = {}
+    for pair in query.split('&'):
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            params[key] = float(value)
+    return params
+
+
+def address(host):
+    """
+    Returns the loopback address of the farm host with index host
+    """
+    return '127.{}.{}.{}'.format(host // 62500 + 1, host // 250 % 250, host % 250 + 1)
+
+
+def handle(sock, peer):
+    """
+    Serves the farm targets over one client connection. Responses are sent
+    in as few writes as possible, so that delayed ACKs don't skew latencies.
+    The latency and error of a request come from a generator seeded with its
+    target, which holds the number of the request (n), so they don't depend
+    on the order the greenlets run in
+    """
+    import gevent
+    rfile = sock.makefile('rb')
+    try:
+        while True:
+            line = rfile.readline()
+            if not line:
+                break
+            while rfile.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            target = line.split()[1].decode('latin1')
+            params = _parse_query(target.partition('?')[2])
+            rng = random.Random(target)
+            latency = rng.gauss(params.get('lat', 0), params.get('jit', 0))
+            if latency > 0:
+                gevent.sleep(latency / 1000)
+            status = b'500 Internal Server Error' if rng.random() < params.get('err', 0) \
+                else b'200 OK'
+            size = int(params.get('size', 0))
+            body = (b'<html>' + b'x' * size)[:size]
+            keep_alive = params.get('ka', 1) != 0
+            head = (b'HTTP/1.1 ' + status + b'\r\nContent-Type: text/html\r\nContent-Length: ' +
+                    str(size).encode() + b'\r\n' + (b'' if keep_alive else b'Connection: close\r\n') +
+                    b'\r\n')
+            if params.get('stall'):
+                sock.sendall(head + body[:size // 2])
+                gevent.sleep(params['stall'])
+                break
+            sock.sendall(head + body)
+            if not keep_alive:
+                break
+    except (IOError, OSError):
+        pass
+    finally:
+        rfile.close()
+        sock.close()
+
+
+def serve(port, hosts):
+    """
+    Farm process entry point, listens on the loopback addresses of the hosts
+    only
+    """
+    import gevent
+    from gevent.server import StreamServer
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    servers = [StreamServer((address(host), port), handle, backlog=4096)
+               for host in range(hosts)]
+    for server in servers:
+        server.start()
+    gevent.wait()
+
+
+def generate(size, port=PORT, hosts=HOSTS, seed=0):
+    """
+    Returns a TBMON document with size pings to the farm. The profiles are
+    picked by weight from a seeded generator, so a size always gives the same
+    document
+    """
+    rng = random.Random(seed)
+    names = sorted(PROFILES)
+    weights = [PROFILES[name][0] for name in names]
+    pings = {}
+    for i in range(size):
+        name = rng.choices(names, weights)[0]
+        behavior = PROFILES[name][1]
+        query = '&'.join('{}={}'.format(key, value) for key, value in sorted(behavior.items()))
+        pings[str(i)] = {
+            'name': '{} {}'.format(name, i),
+            # the request number seeds the latency and error of the target
+            'url': '{}:{}/{}?{}&n={}'.format(address(i % hosts), port, name, query, i),
+            'request_timeout': REQUEST_TIMEOUT,
+            'requests_count': 1,
+            'expected_response_codes': ['200'],
+            'expected_response_body': ['<html'],
+            'items': {'request_loss': {}, 'request_latency': {}},
+        }
+    return {'applications': {'application_key_1': {'name': 'farm', 'pings': pings}}}
+
+
+def _rss(pid='self'):
+    with open('/proc/{}/statm'.format(pid)) as file:
+        return int(file.read().split()[1]) * resource.getpagesize()
+
+
+def _usage():
+    """
+    Returns the RSS and open descriptors of this process and its workers
+    """
+    rss = fds = 0
+    for pid in ['self'] + [child.pid for child in multiprocessing.active_children()]:
+        try:
+            rss += _rss(pid)
+            fds += len(os.listdir('/proc/{}/fd'.format(pid)))
+        except (IOError, OSError):
+            # a worker which just exited
+            pass
+    return rss, fds
+
+
+def _sample(http_pinger, peak, done):
+    """
+    Samples open descriptors, RSS and requests in flight into peak. A thread,
+    so that it keeps sampling while the asyncio engine blocks the gevent hub
+    """
+    while not done.wait(SAMPLE_INTERVAL):
+        rss, fds = _usage()
+        peak['fds'] = max(peak['fds'], fds)
+        peak['rss'] = max(peak['rss'], rss)
+        peak['in_flight'] = max(peak['in_flight'], http_pinger.in_flight())
+
+
+def measure(job):
+    """
+    Benchmark process entry point, runs the pinger over a generated config
+    """
+    size, port, hosts, options = job
+    from main import HTTPPinger
+    data = generate(size, port, hosts)
+    start = time.time()
+    http_pinger = HTTPPinger(data, validation=None, **options)
+    baseline = _usage()[0]
+    peak = {'fds': 0, 'rss': baseline, 'in_flight': 0}
+    done = threading.Event()
+    sampler = threading.Thread(target=_sample, args=(http_pinger, peak, done))
+    sampler.daemon = True
+    sampler.start()
+    run_start = time.time()
+    http_pinger.run()
+    end = time.time()
+    done.set()
+    sampler.join()
+    elapsed = end - start
+    lost = sum(1 for ping in http_pinger.pings
+               if ping.data['items']['request_loss'].get('value'))
+    # kilobytes on Linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, peak['rss'])
+    in_flight = peak['in_flight'] if http_pinger.workers == 1 else None
+    return {
+        'engine': options.get('engine', 'gevent'),
+        'pings': size,
+        'seconds': round(elapsed, 3),
+        'throughput': round(size / elapsed, 1),
+        'requests_per_second': round(http_pinger.connection_stats()['requests'] /
+                                     (end - run_start), 1),
+        'peak_rss_mb': round(peak_rss / 1024 / 1024, 1),
+        'peak_in_flight': in_flight,
+        'kb_per_in_flight': round((peak['rss'] - baseline) / 1024 / in_flight, 1)
+                            if in_flight else None,
+        'peak_fds': peak['fds'],
+        'lost': lost,
+    }
+
+
+def _measure_to(job, connection):
+    connection.send(measure(job))
+    connection.close()
+
+
+def run_measure(context, job):
+    """
+    Runs measure(job) in a fresh process, so peak RSS is that of this run. A
+    process of its own and not a pool worker, which could not start the
+    workers of HTTPPinger
+    """
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measure_to, args=(job, sender))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError('benchmark process exited with {}'.format(process.exitcode))
+    finally:
+        process.join()
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=AMTP_DIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', metavar='N', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--hosts', metavar='N', type=int, default=HOSTS,
+            help='loopback addresses the pings are spread across (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', metavar='N', type=int, default=1,
+            help='HTTPPinger worker processes (default: %(default)s)')
+    parser.add_argument('--engines', nargs='+', choices=['gevent', 'asyncio'],
+            default=ENGINES, help='HTTPPinger engines to compare (default: %(default)s)')
+    parser.add_argument('--results', metavar='FILE',
+            help='append the results as a JSON line to FILE')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    farm = context.Process(target=serve, args=(args.port, args.hosts))
+    farm.daemon = True
+    farm.start()
+    time.sleep(1)
+
+    results = {'revision': revision(), 'timestamp': int(time.time()), 'hosts': args.hosts,
+               'workers': args.workers, 'sizes': {}, 'engines': {}}
+    print('{:<8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        'engine', 'pings', 'wall (s)', 'pings/s', 'req/s', 'RSS (MB)', 'KB/probe',
+        'FDs', 'lost'))
+    try:
+        for engine in args.engines:
+            for size in args.sizes:
+                result = run_measure(context, (size, args.port, args.hosts,
+                        {'workers': args.workers, 'engine': engine}))
+                results['engines'].setdefault(engine, {})[size] = result
+                if engine == args.engines[0]:
+                    results['sizes'][size] = result
+                print('{engine:<8} {pings:>8} {seconds:>10.2f} {throughput:>10.1f} '
+                      '{requests_per_second:>10.1f} {peak_rss_mb:>10.1f} {kb:>10} '
+                      '{peak_fds:>8} {lost:>8}'.format(kb='-' if result['kb_per_in_flight'] is None
+                      else '{:.1f}'.format(result['kb_per_in_flight']), **result))
+    finally:
+        farm.terminate()
+
+    if args.results:
+        with open(args.results, 'a') as file:
+            file.write(json.dumps(results) + '\n')
+
+
+if __name__ == '__main__':
+    main()
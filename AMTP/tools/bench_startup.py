@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Tracks HTTPPinger startup time (schema validation and Ping construction) for
+generated TBMON documents of 500, 5k and 50k pings
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+AMTP_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, AMTP_DIR)
+
+from main import HTTPPinger
+from amtp import schema
+
+SIZES = [500, 5000, 50000]
+
+
+def generate(size):
+    """
+    Returns a TBMON document with size pings. IP literals keep DNS out of it
+    """
+    pings = {}
+    for i in range(size):
+        pings[str(i)] = {
+            'name': 'target {}'.format(i),
+            'url': '127.0.{}.{}/index.html'.format(i // 250 % 250, i % 250 + 1),
+            'request_timeout': 5,
+            'requests_count': 1,
+            'expected_response_codes': ['200', '301'],
+            'expected_headers': ['Content-Type:text/html'],
+            'expected_response_body': ['<html'],
+            'items': {'request_loss': {}},
+        }
+    return {'applications': {'application_key_1': {'name': 'startup', 'pings': pings}}}
+
+
+def measure(data, validation):
+    start = time.time()
+    HTTPPinger(data, validation=validation)
+    return time.time() - start
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=AMTP_DIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', metavar='N', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--results', metavar='FILE',
+            help='append the results as a JSON line to FILE')
+    args = parser.parse_args()
+
+    schema_path = os.path.join(AMTP_DIR, schema.SCHEMA_PATH)
+    start = time.time()
+    schema.get_validator(schema_path)
+    compile_time = time.time() - start
+    start = time.time()
+    schema.get_validator(schema_path)
+    print('validator: {:.2f} ms compiled, {:.4f} ms cached'.format(
+        compile_time * 1000, (time.time() - start) * 1000))
+
+    results = {'revision': revision(), 'timestamp': int(time.time()), 'sizes': {}}
+    print('{:>8} {:>10} {:>10} {:>10}'.format('pings', 'none (s)', 'full (s)', 'lazy (s)'))
+    for size in args.sizes:
+        data = generate(size)
+        times = dict((validation or 'none', measure(data, validation))
+                     for validation in (None, 'full', 'lazy'))
+        results['sizes'][size] = times
+        print('{:>8} {none:>10.3f} {full:>10.3f} {lazy:>10.3f}'.format(size, **times))
+
+    if args.results:
+        with open(args.results, 'a') as file:
+            file.write(json.dumps(results) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Measures the overhead of the per-phase request timing (HostPool.connection
+with phases) against a local server, for reused and for new connections
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gevent.server import StreamServer
+from geventhttpclient.url import URL
+
+from amtp.clock import clock
+from amtp.pool import HostPool, finish_response
+
+REQUESTS = 2000
+REPEAT = 5
+BODY = b'<html>hello world</html>'
+RESPONSE = (b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: ' +
+            str(len(BODY)).encode() + b'\r\n{}\r\n' + BODY)
+
+
+def handle(sock, address):
+    """
+    Minimal HTTP/1.1 server, the response goes out in a single write so the
+    numbers are not skewed by Nagle's algorithm and delayed ACKs
+    """
+    data = b''
+    while True:
+        block = sock.recv(4096)
+        if not block:
+            break
+        data += block
+        while b'\r\n\r\n' in data:
+            request, data = data.split(b'\r\n\r\n', 1)
+            close = request.startswith(b'GET /close')
+            sock.sendall(RESPONSE.replace(b'{}', b'Connection: close\r\n' if close else b''))
+            if close:
+                sock.close()
+                return
+
+
+def run(url, requests, timed):
+    http_pool = HostPool(1, 1)
+    start = clock()
+    for i in range(requests):
+        phases = {} if timed else None
+        with http_pool.connection(url, phases) as http:
+            finish_response(http.get(url.request_uri))
+    elapsed = clock() - start
+    http_pool.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', metavar='N', type=int, default=REQUESTS)
+    parser.add_argument('--repeat', metavar='N', type=int, default=REPEAT,
+            help='best of N runs (default: %(default)s)')
+    args = parser.parse_args()
+
+    server = StreamServer(('127.0.0.1', 0), handle)
+    server.start()
+    try:
+        print('{:<12} {:>12} {:>12} {:>10}'.format('connection', 'plain (us)', 'timed (us)', 'overhead'))
+        for name, path in (('reused', '/'), ('new', '/close')):
+            url = URL('http://127.0.0.1:{}{}'.format(server.server_port, path))
+            plain = min(run(url, args.requests, False) for i in range(args.repeat))
+            timed = min(run(url, args.requests, True) for i in range(args.repeat))
+            print('{:<12} {:>12.1f} {:>12.1f} {:>9.1%}'.format(name,
+                    plain / args.requests * 1e6, timed / args.requests * 1e6, timed / plain - 1))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,18 @@
 #!/usr/bin/env python
-import csv
-import json
-import copy
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.tbmon import iter_document
 
 
 with open('../tests/500_o.json') as jsonfile:
-    data = json.loads(jsonfile.read())
-    for name in data['applications']['application_key_1']['pings']:
-        ping = data['applications']['application_key_1']['pings'][name]
+    # the pings are checked as they are read, the document is never loaded whole
+    for event in iter_document(jsonfile):
+        if event[0] != 'ping' or event[1] != 'application_key_1':
+            continue
+        ping = event[4]
         url = ping['url']
         if 'value' in ping['items']['request_loss']:
             if ping['items']['request_loss']['value'] > 0:
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+Folds an NDJSON result stream (main.py --stream) back into the full TBMON
+document of the configuration it was produced from
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.output import read_records, fold
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--config', metavar="FILE", required=True,
+            help='TBMON configuration file the stream was produced from')
+    parser.add_argument('-s', '--stream', metavar="FILE",
+            help='NDJSON stream (default: stdin)')
+    parser.add_argument('-o', '--output', metavar="FILE",
+            help='path of the TBMON result file (default: stdout)')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        data = json.load(file)
+    if args.stream:
+        with open(args.stream, 'r') as file:
+            count = fold(data, read_records(file))
+    else:
+        count = fold(data, read_records(sys.stdin))
+    print('{}: folded {} records'.format(os.path.basename(__file__), count), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(data, file)
+    else:
+        print(json.dumps(data))
+
+
+if __name__ == '__main__':
+    main()
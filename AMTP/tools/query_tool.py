@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Queries the AMTP result store (main.py --store) through its rollups
+
+Example - targets with request loss in the last hour:
+    query_tool.py -d results.db --item request_loss --above 0 --since 1h
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.store import ResultStore
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def duration(text):
+    """
+    Returns the number of seconds in a duration like 90s, 15m, 1h or 7d
+    """
+    match = re.match(r'^(\d+)([smhd]?)$', text)
+    if not match:
+        raise argparse.ArgumentTypeError("invalid duration '{}'".format(text))
+    return int(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-d', '--db', metavar="FILE", required=True, help='result store')
+    parser.add_argument('--item', default='request_loss',
+            help="item to query, fields of object items as 'request_latency.p95' (default: %(default)s)")
+    parser.add_argument('--since', metavar="DURATION", type=duration, default=3600,
+            help='look back this far, e.g. 15m, 1h, 7d (default: 1h)')
+    parser.add_argument('--above', metavar="VALUE", type=float,
+            help='only targets whose maximum is above VALUE')
+    parser.add_argument('--resolution', choices=['1m', '1h'],
+            help='rollup buckets to use (default: 1m up to 6h back, 1h beyond)')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.db):
+        print('{}: error: {} is not a file'.format(os.path.basename(__file__), args.db), file=sys.stderr)
+        sys.exit(1)
+    store = ResultStore(args.db)
+    resolution = duration(args.resolution) if args.resolution else None
+    rows = store.query(args.item, time.time() - args.since, args.above, resolution)
+    print('{:<30} {:>6} {:>10} {:>10} {:>10} {:>8}'.format(
+        'target', 'count', 'avg', 'min', 'max', 'nonzero'))
+    for application, ping, name, count, avg, low, high, nonzero in rows:
+        target = '{}/{}'.format(application, name or ping)
+        print('{:<30} {:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}'.format(
+            target, count, avg, low, high, nonzero))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Rebuilds the result document of a run from the delta patches (main.py --delta)
+of the runs up to it, applied in order to the document they started from
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from amtp.delta import apply_patch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('patches', metavar="PATCH", nargs='+',
+            help='JSON Patch files, oldest first')
+    parser.add_argument('-b', '--base', metavar="FILE",
+            help='snapshot the first patch was made against '
+                 '(default: none, i.e. the first patch is of a first run)')
+    parser.add_argument('-o', '--output', metavar="FILE",
+            help='path of the rebuilt result file (default: stdout)')
+    args = parser.parse_args()
+
+    if args.base:
+        with open(args.base, 'r') as file:
+            data = json.load(file)
+    else:
+        data = {'applications': {}}
+    count = 0
+    for path in args.patches:
+        with open(path, 'r') as file:
+            ops = json.load(file)
+        try:
+            data = apply_patch(data, ops)
+        except ValueError as err:
+            print('{}: error: {}: {}'.format(__file__, path, err), file=sys.stderr)
+            sys.exit(1)
+        count += len(ops)
+    print('{}: applied {} operations of {} patches'.format(
+        os.path.basename(__file__), count, len(args.patches)), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(data, file)
+    else:
+        print(json.dumps(data))
+
+
+if __name__ == '__main__':
+    main()
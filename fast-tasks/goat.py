@@ -1,4 +1,5 @@
 from __future__ import division # Python 2.7 compatibility 
+from bisect import bisect_right
 from itertools import combinations
 import collections
 import math
@@ -12,29 +13,44 @@ def handle_input():
         if (sys.version_info > (3, 0)): fl = input()
         else: fl = raw_input() # Python 2 compatibility
         n, k = [int(x) for x in fl.split(" ")]
-        if n <= 0 or n >= 1001: 
-            error_message = "Invalid value {0} for N. (1<=N<=1000)".format(n)
-            raise ValueError
-        if k <= 0 or k >= 1001: 
-            error_message = "Invalid value {0} for K. (1<=K<=1000)".format(k)
+        error = _check_input(n, k)
+        if error:
+            error_message = error
             raise ValueError
         if (sys.version_info > (3, 0)): sl = input()
         else: sl = raw_input() # Python 2 compatibility
         weights = [int(x) for x in sl.split(" ")]
-        # check for correct number of weights
-        for w in weights:
-            if w <= 0 or w >= 100000: 
-                error_message = "Invalid weight value (W). (1<=W<=100000)"
-                raise ValueError
-        if len(weights) != n: 
-            error_message = "N not equal to the number of weights provided. " + \
-                    "Expected {0} but received {1}".format(n,len(weights))
+        error = _check_input(n, k, weights)
+        if error:
+            error_message = error
             raise ValueError
     except ValueError as e:
         sys.exit("ERROR: " + error_message)
     else: 
         return n, k, weights
 
+def _check_input(n, k, weights=None):
+    """\
+Returns the error message if N, K or the weights are out of range, None
+otherwise
+    """
+    error_message = None
+    if n <= 0 or n >= 1001: 
+        error_message = "Invalid value {0} for N. (1<=N<=1000)".format(n)
+    elif k <= 0 or k >= 1001: 
+        error_message = "Invalid value {0} for K. (1<=K<=1000)".format(k)
+    elif weights is not None:
+        # check for correct number of weights
+        for w in weights:
+            if w <= 0 or w >= 100000: 
+                error_message = "Invalid weight value (W). (1<=W<=100000)"
+                break
+        else:
+            if len(weights) != n: 
+                error_message = "N not equal to the number of weights provided. " + \
+                        "Expected {0} but received {1}".format(n,len(weights))
+    return error_message
+
 def calculate(k,ws):
     """\
 Returns the minimum weight capacity of the boat using sums of combinations
@@ -81,10 +97,6 @@ Returns the minimum weight capacity of the boat using "binary search"
     high = _get_high(k,ws,max_w)
     guessed = False
     while not guessed:
-        if __debug__:
-            print("Capacity: {0}".format(max_w))
-            print("Low: {0}".format(low))
-            print("High: {0}".format(high))
         if strategy(k,ws,max_w): high = max_w
         else: low = max_w
         if high - low <= 1: guessed = True
@@ -106,11 +118,9 @@ param k - number of courses
 param ws - a list of weights
 param cap - max boat capacity (weight)
     """
-    if __debug__: print("Testing strategy for capacity:{0}".format(cap))
     ws = sorted(ws, reverse = True)
     weights = ws[:]
     for i in range(1,k):
-        if __debug__: print("Course #{0}".format(i))
         w = 0
         wl = []
         # NOTE: Funny things happen if you try to remove an
@@ -119,21 +129,145 @@ param cap - max boat capacity (weight)
             # That's why you use a different one. There should be
             # a smarter way to achieve this. ws = what's left
             if x in ws:
-                if __debug__: print("{0} + {1}".format(w,x))
                 w += x
-                if __debug__: print(cap)
                 if w > cap:
                     w -= x
                 else:
                     wl.append(x)
                     ws.remove(x)
-        if __debug__: print("Boat #{0}:{1}".format(i,wl))
-    if __debug__: print("Boat #{0}:{1}".format(k,ws))
     if sum(ws) > cap:
         return False
     else: 
         return True
 
+def calculate_fast(k,ws):
+    """\
+Returns the minimum weight capacity of the boat using binary search over
+fits(), with the weights sorted once. The capacity is at least the heaviest
+goat and ceil(sum/K). The greedy fills every course but the last past
+cap - max(ws) while goats are left, so ceil(sum/K) + max(ws) - 1 always fits
+    """
+    ws = sorted(ws)
+    total = sum(ws)
+    per_course = -(-total // k)
+    low = max(ws[-1], per_course)
+    if fits(k, ws, low, total):
+        return low
+    high = max(per_course + ws[-1] - 1, low + 1)
+    while high - low > 1:
+        cap = (low + high)//2
+        if fits(k, ws, cap, total): high = cap
+        else: low = cap
+    return high
+
+def fits(k,ws,cap,total=None):
+    """\
+Returns True if the goats fit in k courses of a boat of capacity cap, the same
+greedy strategy() tries, in O(N log N): each course takes the heaviest goat
+left that fits, until none does
+param ws - a list of weights, sorted ascending
+param total(optional) - sum(ws)
+    """
+    if not ws:
+        return True
+    if ws[-1] > cap:
+        return False
+    left = sum(ws) if total is None else total
+    bank = _Bank(ws)
+    for i in range(1,k):
+        room = cap
+        while True:
+            w = bank.take(room)
+            if w is None: break
+            room -= w
+            left -= w
+        if not left:
+            return True
+    return left <= cap
+
+class _Bank(object):
+    """\
+The goats left on the bank: a Fenwick tree of counts over the sorted weights,
+which finds the heaviest goat up to a weight in O(log N)
+    """
+    def __init__(self, ws):
+        n = len(ws)
+        tree = [0] + [1] * n
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.ws = ws
+        self.n = n
+        self.tree = tree
+        # highest power of 2 <= n, where the search down the tree starts
+        self.top = 1 << (n.bit_length() - 1)
+
+    def take(self, cap):
+        """\
+Removes the heaviest goat of weight <= cap and returns its weight, None if
+there is none
+        """
+        tree = self.tree
+        # goats left among the first i weights, i.e. those <= cap
+        i = bisect_right(self.ws, cap)
+        count = 0
+        while i:
+            count += tree[i]
+            i -= i & -i
+        if not count:
+            return None
+        # the position of the count-th goat left
+        pos = 0
+        step = self.top
+        while step:
+            if pos + step <= self.n and tree[pos + step] < count:
+                pos += step
+                count -= tree[pos]
+            step >>= 1
+        i = pos + 1
+        while i <= self.n:
+            tree[i] -= 1
+            i += i & -i
+        return self.ws[pos]
+
+def batch(stream, check=False):
+    """\
+Answers every test case of stream (N K and N weights, one after another) with
+a line of output. Exits on the first invalid case
+param check - cross-check each answer against calculate_bf
+    """
+    tokens = (int(x) for line in stream for x in line.split())
+    mismatches = 0
+    case = 0
+    while True:
+        case += 1
+        try:
+            n = next(tokens)
+        except StopIteration:
+            break
+        except ValueError:
+            sys.exit("ERROR: case #{0}: Invalid input format".format(case))
+        try:
+            k = next(tokens)
+            error = _check_input(n, k)
+            weights = [next(tokens) for i in range(n)] if not error else None
+        except (StopIteration, ValueError):
+            error = "Invalid input format"
+        error = error or _check_input(n, k, weights)
+        if error:
+            sys.exit("ERROR: case #{0}: {1}".format(case, error))
+        min_cap = calculate_fast(k, weights)
+        print(min_cap)
+        if check:
+            expected = calculate_bf(k, weights)
+            if expected != min_cap:
+                mismatches += 1
+                sys.stderr.write("MISMATCH: case #{0}: {1}, calculate_bf {2}\n".format(
+                    case, min_cap, expected))
+    if mismatches:
+        sys.exit(1)
+
 def test():
     print("""\
 Enter input in the following format:
@@ -150,11 +284,14 @@ Example:
 """)
     n, k, weights = handle_input()
     start_time = time.time()
-    min_cap = calculate_bs(k,weights)
+    min_cap = calculate_fast(k,weights)
     print("Output:")
     print(min_cap)
     print("--- %s seconds ---" % (time.time() - start_time))
 
 if __name__ == "__main__":
-    test()
+    if "--batch" in sys.argv[1:]:
+        batch(sys.stdin, check="--check" in sys.argv[1:])
+    else:
+        test()
    
@@ -0,0 +1,83 @@
+"""
+Tests of goat.py, run with pytest from tests/
+"""
+import io
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from goat import batch, calculate_bf, calculate_bs, calculate_fast, fits
+
+
+def cases(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        n = rng.randint(1, 9)
+        k = rng.randint(1, 6)
+        top = rng.choice([3, 10, 100])
+        yield k, [rng.randint(1, top) for j in range(n)]
+
+
+@pytest.mark.parametrize('k, ws', list(cases(500)))
+def test_random(k, ws):
+    assert calculate_fast(k, ws) == calculate_bf(k, ws)
+
+
+@pytest.mark.parametrize('k, ws, expected', [
+    # the example of the task
+    (2, [26, 7, 10, 30, 5, 4], 42),
+    # one goat
+    (1, [7], 7),
+    (5, [7], 7),
+    # all equal
+    (3, [4] * 6, 8),
+    (2, [4] * 5, 12),
+    (6, [4] * 6, 4),
+    # a single course takes them all
+    (1, [3, 1, 2], 6),
+    # the heaviest goat is the bound
+    (2, [10, 1, 1, 1], 10),
+    # exactly ceil(sum/K)
+    (2, [5, 5, 3, 3, 2, 2], 10),
+    (3, [1, 1, 1, 1, 1, 1, 1], 3),
+    # the greedy needs more than ceil(sum/K)
+    (2, [2, 2, 2], 4),
+    (2, [1, 3, 3, 3], 6),
+], ids=['example', 'one goat', 'one goat, more courses', 'equal, 2 each', 'equal, uneven',
+        'equal, 1 each', 'one course', 'heaviest', 'ceil', 'ceil, uneven', 'greedy',
+        'greedy, lightest last'])
+def test_edges(k, ws, expected):
+    assert calculate_bf(k, ws) == expected
+    assert calculate_fast(k, ws) == expected
+    assert calculate_bs(k, ws) == expected
+
+
+@pytest.mark.parametrize('k, ws', list(cases(100, seed=1)))
+def test_boundary(k, ws):
+    # the answer fits, one less does not
+    cap = calculate_fast(k, ws)
+    assert fits(k, sorted(ws), cap)
+    assert not fits(k, sorted(ws), cap - 1)
+
+
+def test_fast_does_not_change_the_weights():
+    ws = [5, 1, 4]
+    calculate_fast(2, ws)
+    assert ws == [5, 1, 4]
+
+
+def test_batch(capsys):
+    batch(io.StringIO(u'6 2\n26 7 10 30 5 4\n1 1 7\n3 2 4 4 4\n'), check=True)
+    out, err = capsys.readouterr()
+    assert out.split() == ['42', '7', '8']
+    assert err == ''
+
+
+def test_batch_invalid():
+    with pytest.raises(SystemExit) as info:
+        batch(io.StringIO(u'2 1\n1 2\n2 1\n1\n'))
+    assert str(info.value) == 'ERROR: case #2: Invalid input format'
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+JSON::Patch::Diff in Python - the JSON Patch (RFC 6902) difference from a
+source to a destination document
+
+Produces the same operations as GetPatch() of lib/JSON/Patch/Diff.pm, with
+the same options (keep_old, use_replace, use_depth) plus use_move, and is used
+to cross-check it (tests/evaluate.py --engine). Two things differ inside:
+
+    equality    every subtree is hashed once, bottom up, and the hashes are
+                memoized, so comparing two subtrees is comparing two ints
+                instead of encoding both to canonical JSON text
+    arrays      the elements are numbered by equality, the hashes picking the
+                ones to compare, and the longest common subsequence of the
+                numbers is found with Myers' linear space algorithm,
+                O((N + M) D) time and O(N + M) memory for N and M elements
+                with D of them differing
+
+use_move turns a remove followed by an add of the same value into a move, as
+long as none of the operations in between touch the moved value or, in an
+array, its siblings.
+"""
+import argparse
+import json
+import sys
+
+# removes, latest first, tried as the source of a move for each add
+MOVE_TRIES = 4
+
+
+def get_json_pointer(path):
+    """
+    Returns the JSON Pointer string of a path of keys and indexes
+    """
+    return ''.join('/' + str(point).replace('~', '~0').replace('/', '~1') for point in path)
+
+
+def get_patch(src, dst, keep_old=False, use_replace=False, use_depth=False, use_move=False):
+    """
+    Returns the JSON Patch turning src into dst
+
+    :keep_old - add the replaced or removed value as `old` to the operations
+    :use_replace - a replace instead of a remove and an add at the same array index
+    :use_depth - compare array elements replaced with one of the same type
+        in depth, implies use_replace
+    :use_move - a move instead of a remove and an add of the same value
+    """
+    differ = Differ(keep_old=keep_old, use_replace=use_replace or use_depth,
+                    use_depth=use_depth)
+    diff = []
+    differ.compare_values([], src, dst, diff)
+    if use_move:
+        diff = differ.optimize_with_move(diff)
+    return differ.normalize(diff)
+
+
+class Differ(object):
+    """
+    Compares values into a list of operations whose paths are lists of object
+    keys (str) and array indexes (int). The removes keep their value until
+    normalize(), for optimize_with_move()
+    """
+    def __init__(self, keep_old=False, use_replace=False, use_depth=False):
+        self.keep_old = keep_old
+        self.use_replace = use_replace
+        self.use_depth = use_depth
+        # id of an object or array -> structural hash, the values are
+        # referenced by the documents for as long as the Differ is used
+        self.hashes = {}
+
+    def hash(self, value):
+        """
+        Returns the structural hash of a value: equal for equal JSON values, a
+        string never equals a number and true never equals 1
+        """
+        if isinstance(value, dict):
+            key = id(value)
+            result = self.hashes.get(key)
+            if result is None:
+                result = self.hashes[key] = hash(
+                    ('o', frozenset((name, self.hash(item)) for name, item in value.items())))
+            return result
+        if isinstance(value, list):
+            key = id(value)
+            result = self.hashes.get(key)
+            if result is None:
+                result = self.hashes[key] = hash(('a', tuple(self.hash(item) for item in value)))
+            return result
+        if isinstance(value, bool):
+            return hash(('b', value))
+        if isinstance(value, (int, float)):
+            # 1 and 1.0 are the same JSON number
+            return hash(('n', value))
+        return hash(('s', value))
+
+    def classes(self, src, dst):
+        """
+        Returns a number per element of the arrays src and dst, the same for
+        equal elements. The hashes only narrow down the elements compared,
+        different values can hash the same (hash(-1) == hash(-2))
+        """
+        # hash -> [(value, number)]
+        classes = {}
+        numbers = ([], [])
+        count = 0
+        for values, result in zip((src, dst), numbers):
+            for value in values:
+                candidates = classes.setdefault(self.hash(value), [])
+                for other, number in candidates:
+                    if self.equal(other, value):
+                        break
+                else:
+                    number = count
+                    count += 1
+                    candidates.append((value, number))
+                result.append(number)
+        return numbers
+
+    def equal(self, src, dst):
+        # == confirms what are nearly always equal values, in C
+        return src is dst or (self.hash(src) == self.hash(dst) and src == dst)
+
+    def compare_values(self, path, src, dst, diff):
+        if self.equal(src, dst):
+            return
+        if isinstance(src, dict) and isinstance(dst, dict):
+            self.compare_hashes(path, src, dst, diff)
+        elif isinstance(src, list) and isinstance(dst, list):
+            self.compare_arrays(path, src, dst, diff)
+        else:
+            self.push_operation(diff, 'replace', path, dst, src)
+
+    def compare_hashes(self, path, src, dst, diff):
+        for key, value in src.items():
+            if key not in dst:
+                self.push_operation(diff, 'remove', path + [key], value, value)
+            else:
+                self.compare_values(path + [key], value, dst[key], diff)
+        for key, value in dst.items():
+            if key not in src:
+                self.push_operation(diff, 'add', path + [key], value)
+
+    def compare_arrays(self, path, src, dst, diff):
+        """
+        Removes the elements of src and adds the elements of dst which are not
+        in their longest common subsequence, gap by gap. With use_replace the
+        removes and adds of a gap at the same index are replaces
+        """
+        matches = common_subsequence(*self.classes(src, dst))
+        matches.append((len(src), len(dst)))
+        i = j = 0
+        for next_i, next_j in matches:
+            removed = next_i - i
+            added = next_j - j
+            # the gap is at index j of the document, dst[:j] is done already
+            replaced = min(removed, added) if self.use_replace else 0
+            for offset in range(removed - 1, replaced - 1, -1):
+                self.push_operation(diff, 'remove', path + [j + offset], src[i + offset],
+                                    src[i + offset])
+            for offset in range(replaced):
+                old = src[i + offset]
+                new = dst[j + offset]
+                if self.use_depth and (isinstance(old, dict) and isinstance(new, dict)
+                                       or isinstance(old, list) and isinstance(new, list)):
+                    self.compare_values(path + [j + offset], old, new, diff)
+                else:
+                    self.push_operation(diff, 'replace', path + [j + offset], new, old)
+            for offset in range(replaced, added):
+                self.push_operation(diff, 'add', path + [j + offset], dst[j + offset])
+            i = next_i + 1
+            j = next_j + 1
+
+    def push_operation(self, diff, name, path, value, old=None):
+        operation = {'op': name, 'path': path, 'value': value}
+        if self.keep_old and name != 'add':
+            operation['old'] = old
+        diff.append(operation)
+
+    def optimize_with_move(self, diff):
+        """
+        Returns diff with removes followed by an add of the same value turned
+        into moves, placed where the add was
+        """
+        # value hash -> indexes of the removes not moved yet
+        removes = {}
+        result = list(diff)
+        for j, operation in enumerate(diff):
+            if operation['op'] == 'remove':
+                removes.setdefault(self.hash(operation['value']), []).append(j)
+                continue
+            if operation['op'] != 'add':
+                continue
+            candidates = removes.get(self.hash(operation['value']))
+            for i in reversed((candidates or [])[-MOVE_TRIES:]):
+                if not self.equal(diff[i]['value'], operation['value']):
+                    continue
+                source = _move_source(result, i, j)
+                target = operation['path']
+                # a value can't be moved into itself
+                if source is None or source != target and target[:len(source)] == source:
+                    continue
+                candidates.remove(i)
+                result[i] = None
+                # None if it is removed and added back where it was
+                result[j] = {'op': 'move', 'from': source, 'path': target} \
+                    if source != target else None
+                break
+        return [operation for operation in result if operation is not None]
+
+    def normalize(self, diff):
+        """
+        Returns diff as JSON Patch operations
+        """
+        for operation in diff:
+            operation['path'] = get_json_pointer(operation['path'])
+            if 'from' in operation:
+                operation['from'] = get_json_pointer(operation['from'])
+            if operation['op'] == 'remove':
+                del operation['value']
+        return diff
+
+
+def _move_source(diff, i, j):
+    """
+    Returns where the value removed by diff[i] is right before diff[j] if
+    it is left in place until then, None if an operation in between depends
+    on it being gone or changes it
+    """
+    path = list(diff[i]['path'])
+    in_array = isinstance(path[-1], int)
+    for operation in diff[i + 1:j]:
+        if operation is None:
+            continue
+        if operation['op'] == 'move':
+            steps = [('remove', operation['from']), ('add', operation['path'])]
+        else:
+            steps = [(operation['op'], operation['path'])]
+        for name, other in steps:
+            if other[:len(path)] == path:
+                # the value itself or something in it
+                return None
+            if in_array and other[:len(path) - 1] == path[:-1]:
+                # a sibling, whose index assumed the value was gone
+                return None
+            depth = len(other) - 1
+            if other[:depth] != path[:depth] or not isinstance(other[-1], int):
+                # not in an array the value is in
+                continue
+            index = path[depth]
+            if other[-1] == index:
+                if name != 'add':
+                    # an array element the value is in is replaced or removed
+                    return None
+                path[depth] += 1
+            elif other[-1] < index:
+                path[depth] += 1 if name == 'add' else -1 if name == 'remove' else 0
+    return path
+
+
+def common_subsequence(src, dst):
+    """
+    Returns the (i, j) index pairs of a longest common subsequence of the
+    sequences src and dst, in order (Myers' linear space algorithm)
+    """
+    matches = []
+    # (src start, src end, dst start, dst end) of the parts left to match
+    parts = [(0, len(src), 0, len(dst))]
+    while parts:
+        x0, x1, y0, y1 = parts.pop()
+        # common prefix and suffix first, they are the usual case
+        while x0 < x1 and y0 < y1 and src[x0] == dst[y0]:
+            matches.append((x0, y0))
+            x0 += 1
+            y0 += 1
+        while x0 < x1 and y0 < y1 and src[x1 - 1] == dst[y1 - 1]:
+            x1 -= 1
+            y1 -= 1
+            matches.append((x1, y1))
+        if x0 == x1 or y0 == y1:
+            continue
+        (sx0, sy0, sx1, sy1), edits = _middle_snake(src, dst, x0, x1, y0, y1)
+        if edits <= 1:
+            # one element of the longer part is not in the other
+            i, j = x0, y0
+            while i < x1 and j < y1:
+                if src[i] == dst[j]:
+                    matches.append((i, j))
+                    i += 1
+                    j += 1
+                elif x1 - x0 > y1 - y0:
+                    i += 1
+                else:
+                    j += 1
+            continue
+        for offset in range(sx1 - sx0):
+            matches.append((sx0 + offset, sy0 + offset))
+        parts.append((x0, sx0, y0, sy0))
+        parts.append((sx1, x1, sy1, y1))
+    matches.sort()
+    return matches
+
+
+def _middle_snake(src, dst, x0, x1, y0, y1):
+    """
+    Returns the middle snake ((x start, y start, x end, y end) of a run of
+    equal elements) of a shortest edit script of src[x0:x1] into dst[y0:y1],
+    and the number of edits of the script
+    """
+    n = x1 - x0
+    m = y1 - y0
+    delta = n - m
+    odd = delta % 2 == 1
+    limit = (n + m + 1) // 2 + 1
+    # furthest x reached on each diagonal k = x - y, forwards and backwards
+    # (backwards x counts from the ends), k offset by limit
+    forward = [0] * (2 * limit + 1)
+    backward = [0] * (2 * limit + 1)
+    for d in range(limit):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[limit + k - 1] < forward[limit + k + 1]):
+                x = forward[limit + k + 1]
+            else:
+                x = forward[limit + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and src[x0 + x] == dst[y0 + y]:
+                x += 1
+                y += 1
+            forward[limit + k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1):
+                if x + backward[limit + delta - k] >= n:
+                    return (x0 + start_x, y0 + start_y, x0 + x, y0 + y), 2 * d - 1
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[limit + k - 1] < backward[limit + k + 1]):
+                x = backward[limit + k + 1]
+            else:
+                x = backward[limit + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and src[x1 - 1 - x] == dst[y1 - 1 - y]:
+                x += 1
+                y += 1
+            backward[limit + k] = x
+            if not odd and -d <= delta - k <= d:
+                if x + forward[limit + delta - k] >= n:
+                    return (x1 - x, y1 - y, x1 - start_x, y1 - start_y), 2 * d
+    raise AssertionError('no middle snake')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints the JSON Patch from FILE1 to FILE2')
+    parser.add_argument('src', metavar='FILE1', help='source JSON document')
+    parser.add_argument('dst', metavar='FILE2', help='destination JSON document')
+    parser.add_argument('-p', '--pretty', action='store_true', help='pretty print the patch')
+    parser.add_argument('-k', '--keep-old', action='store_true',
+                        help='add the old values of replaced and removed values')
+    parser.add_argument('-r', '--use-replace', action='store_true',
+                        help='replace array elements instead of a remove and an add')
+    parser.add_argument('-d', '--use-depth', action='store_true',
+                        help='compare replaced array elements in depth')
+    parser.add_argument('-m', '--use-move', action='store_true',
+                        help='move values instead of a remove and an add')
+    args = parser.parse_args()
+
+    with open(args.src, 'r', encoding='utf-8') as file:
+        src = json.load(file)
+    with open(args.dst, 'r', encoding='utf-8') as file:
+        dst = json.load(file)
+    diff = get_patch(src, dst, keep_old=args.keep_old, use_replace=args.use_replace,
+                     use_depth=args.use_depth, use_move=args.use_move)
+    json.dump(diff, sys.stdout, indent=4 if args.pretty else None)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
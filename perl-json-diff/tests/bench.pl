@@ -0,0 +1,75 @@
+#!/usr/bin/perl -w
+# ---------------------------------------------------------------------------- #
+# ------------------------------   BENCHMARK   ------------------------------- #
+# ---------------------------------------------------------------------------- #
+# Diffs the cases of a corpus of generate.py with JSON::Patch::Diff, for
+# benchmark.py. Prints a line of JSON per case: its index, the time GetPatch
+# took in ms and the patch. The corpus is read one case at a time.
+#
+# Usage: perl bench.pl CORPUS [OPTIONS_JSON]
+use FindBin;
+use lib "$FindBin::Bin/../lib";
+use JSON::Patch::Diff;
+
+use strict;
+use warnings;
+
+use JSON;
+use Time::HiRes qw(time);
+
+my $corpus_file = $ARGV[0] or die "$0: error: missing corpus file\n";
+my $options = $ARGV[1] ? decode_json($ARGV[1])
+                       : {'keep_old'=>0, 'use_replace'=>1, 'use_depth'=>1};
+
+my $json = JSON->new->allow_nonref;
+my $out = JSON->new->allow_nonref->canonical;
+
+open ( my $fh, '<:encoding(UTF-8)', $corpus_file )
+    or die "Could not open file $corpus_file $!";
+
+$| = 1;
+
+sub ReadMore
+{
+    my $read = read($fh, my $buf, 65536);
+    die "$0: error: reading $corpus_file: $!" if !defined $read;
+    die "$0: error: $corpus_file: truncated JSON array\n" if !$read;
+    $json->incr_parse($buf);  # void context, only appends
+    return;
+}
+
+## skip the opening "[", then parse the cases one at a time
+ReadMore() until $json->incr_text =~ s/^\s*\[//;
+
+my $index = 0;
+while (1)
+{
+    $json->incr_text =~ s/^\s*//;
+    ReadMore() until length $json->incr_text;
+    last if $json->incr_text =~ s/^\]//;
+
+    my $case;
+    ReadMore() until defined($case = $json->incr_parse);
+
+    my $start = time;
+    my $diff = JSON::Patch::Diff::GetPatch(${$case}{doc}, ${$case}{expected}, {%$options});
+    my $diff_ms = (time - $start) * 1000;
+
+    print $out->encode({"index" => $index, "diff_ms" => $diff_ms, "patch" => $diff}), "\n";
+    $index += 1;
+
+    ## the separating "," or the final "]"
+    while (1)
+    {
+        $json->incr_text =~ s/^\s*//;
+        last if $json->incr_text =~ s/^,//;
+        if ($json->incr_text =~ /^\]/)
+        {
+            last;
+        }
+        die "$0: error: $corpus_file: parse error near " . substr($json->incr_text, 0, 20) . "\n"
+            if length $json->incr_text;
+        ReadMore();
+    }
+}
+close $fh;
@@ -0,0 +1,205 @@
+"""
+Benchmarks the diff engines on a corpus of generate.py
+
+Per engine and case it measures the time to diff the documents, the time to
+apply the patch (with jsonpatch), the peak memory of the diff and the size of
+the patch over the size of the patch the case was generated with, which is
+close to optimal. The summary of every run is appended to --results with the
+commit it was made at, and compared with the last run of the same engine on
+the same corpus, so that regressions between commits show.
+
+Memory is the peak of the Python heap (tracemalloc) during a second, untimed
+diff for the python engine and the peak RSS of bench.pl for the perl one.
+"""
+from jsonpatch import JsonPatch, JsonPatchException, JsonPointerException
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'python'))
+
+from json_patch_diff import get_patch
+from evaluate import iter_array, DIFF_OPTIONS
+
+ENGINES = ['python', 'perl']
+RESULTS = 'files/benchmark.ndjson'
+BENCH_PL = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bench.pl')
+
+
+def size(patch):
+    return len(json.dumps(patch, separators=(',', ':')))
+
+
+def diff_python(corpus, options):
+    """
+    Yields (case, diff_ms, peak_kb, patch) of the cases of corpus
+    """
+    with open(corpus, 'r', encoding='utf-8') as file:
+        for text in iter_array(file):
+            case = json.loads(text)
+            start = time.perf_counter()
+            patch = get_patch(case['doc'], case['expected'], **options)
+            diff_ms = (time.perf_counter() - start) * 1000
+            tracemalloc.start()
+            get_patch(case['doc'], case['expected'], **options)
+            peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            yield case, diff_ms, peak_kb, patch
+
+
+def diff_perl(corpus, options):
+    """
+    Yields (case, diff_ms, peak_kb, patch) of the cases of corpus, diffed by
+    bench.pl. The peak is of the whole bench.pl process, known at the end
+    """
+    options = {'keep_old': 0, 'use_replace': int(options.get('use_replace', False)),
+               'use_depth': int(options.get('use_depth', False))}
+    process = subprocess.Popen(['perl', BENCH_PL, corpus, json.dumps(options)],
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        with open(corpus, 'r', encoding='utf-8') as file:
+            for text, line in zip(iter_array(file), process.stdout):
+                result = json.loads(line)
+                yield json.loads(text), result['diff_ms'], None, result['patch']
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError('bench.pl exited with {}'.format(process.returncode))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def benchmark(engine, corpus, options, cases=None):
+    """
+    Returns the summary of the cases of corpus diffed by engine, writing a
+    record per case to cases (optional)
+    """
+    diff = diff_python if engine == 'python' else diff_perl
+    diff_times = []
+    apply_ms = 0.0
+    peak_kb = 0.0
+    patch_size = reference_size = 0
+    worst = None
+    failures = 0
+    for index, (case, diff_ms, peak, patch) in enumerate(diff(corpus, options)):
+        start = time.perf_counter()
+        try:
+            result = JsonPatch(patch).apply(case['doc'], in_place=True)
+        except (JsonPatchException, JsonPointerException, TypeError, KeyError, IndexError):
+            result = None
+        case_apply_ms = (time.perf_counter() - start) * 1000
+        ok = result == case['expected']
+        ratio = size(patch) / size(case['patch']) if case['patch'] else None
+        diff_times.append(diff_ms)
+        apply_ms += case_apply_ms
+        peak_kb = max(peak_kb, peak or 0)
+        patch_size += size(patch)
+        reference_size += size(case['patch'])
+        if ratio is not None and (worst is None or ratio > worst):
+            worst = ratio
+        failures += not ok
+        if cases is not None:
+            cases.write(json.dumps({'engine': engine, 'index': index, 'comment': case['comment'],
+                                    'diff_ms': diff_ms, 'apply_ms': case_apply_ms,
+                                    'peak_kb': peak, 'ops': len(patch), 'size': size(patch),
+                                    'over_optimal': ratio, 'ok': ok}) + '\n')
+    if engine == 'perl':
+        peak_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    diff_times.sort()
+    return {'engine': engine, 'cases': len(diff_times), 'failures': failures,
+            'diff_ms': sum(diff_times), 'diff_p50_ms': percentile(diff_times, 0.5),
+            'diff_p95_ms': percentile(diff_times, 0.95),
+            'diff_max_ms': diff_times[-1] if diff_times else None,
+            'apply_ms': apply_ms, 'peak_kb': peak_kb, 'size': patch_size,
+            'over_optimal': patch_size / reference_size if reference_size else None,
+            'worst_over_optimal': worst}
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.realpath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_run(path, run):
+    """
+    Returns the last run in the results file path of the same engine, options
+    and corpus as run, None if there is none
+    """
+    last = None
+    try:
+        with open(path, 'r') as file:
+            for line in file:
+                other = json.loads(line)
+                if all(other.get(key) == run[key]
+                       for key in ('engine', 'options', 'corpus', 'corpus_bytes')):
+                    last = other
+    except (IOError, OSError, ValueError):
+        pass
+    return last
+
+
+def show(run, last):
+    def change(key):
+        if last is None or not last.get(key) or run[key] is None:
+            return ''
+        return ' ({:+.1f}% since {})'.format((run[key] / last[key] - 1) * 100, last['commit'])
+
+    print("engine: {}".format(run['engine']))
+    print("CASES {}, FAIL {}".format(run['cases'], run['failures']))
+    print("DIFF  {:.3f} ms, p50 {:.3f} ms, p95 {:.3f} ms{}".format(
+        run['diff_ms'], run['diff_p50_ms'] or 0, run['diff_p95_ms'] or 0, change('diff_ms')))
+    print("APPLY {:.3f} ms{}".format(run['apply_ms'], change('apply_ms')))
+    print("PEAK  {:.0f} KB{}".format(run['peak_kb'], change('peak_kb')))
+    if run['over_optimal'] is not None:
+        print("SIZE  {} bytes, {:.2f} x optimal, worst {:.2f}{}".format(
+            run['size'], run['over_optimal'], run['worst_over_optimal'], change('over_optimal')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', metavar='CORPUS', help='corpus file of generate.py')
+    parser.add_argument('-e', '--engine', choices=ENGINES, nargs='+', default=['python'],
+                        help='diff engines (default: python)')
+    parser.add_argument('-m', '--use-move', action='store_true',
+                        help='let the python engine move values')
+    parser.add_argument('--results', metavar='FILE', default=RESULTS,
+                        help='file the summaries are appended to (default: %(default)s)')
+    parser.add_argument('--cases', metavar='FILE',
+                        help='write the measurements of every case to FILE')
+    args = parser.parse_args()
+
+    options = dict(DIFF_OPTIONS, use_move=args.use_move)
+    cases = open(args.cases, 'w') if args.cases else None
+    try:
+        for engine in args.engine:
+            run = benchmark(engine, args.corpus, options, cases)
+            run.update({'commit': commit(),
+                        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                        'options': options if engine == 'python' else DIFF_OPTIONS,
+                        'corpus': os.path.basename(args.corpus),
+                        'corpus_bytes': os.path.getsize(args.corpus)})
+            show(run, last_run(args.results, run))
+            with open(args.results, 'a') as file:
+                file.write(json.dumps(run, sort_keys=True) + '\n')
+    finally:
+        if cases is not None:
+            cases.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,364 @@
-from jsonpatch import JsonPatch, JsonPatchConflict, JsonPointerException, make_patch
+"""
+Applies the patches of the test output files (tests.pl) to their source
+documents and checks that they give the destination documents
+
+--engine python diffs the documents with python/json_patch_diff.py instead of
+taking the patches of JSON::Patch::Diff, --engine both does both and compares
+the size of the patches and the time taken to make them.
+
+The files are read incrementally, one test case at a time, and the cases are
+applied in a pool of worker processes, so corpora of any size are evaluated in
+bounded memory. The apply time, op count and size of every patch can be written
+to --cases and the failed cases to --failures, both as one JSON object per line.
+"""
+from jsonpatch import JsonPatch, JsonPatchConflict, JsonPatchTestFailed, JsonPointerException
+from collections import deque
+import argparse
 import json
+import multiprocessing
+import os
+import re
+import sys
+import time
 
-if __name__ == '__main__':
-    print("Well hello there!")
-    file_name1 = 'files/tests_out.json'
-    file_name2 = 'files/spec_tests_out.json'
-    files = [file_name1, file_name2]
-    print("Evaluating results..")
-    for name in files: 
-        print("file: {}".format(name))
-        file = open(name, 'r')
-        out = json.load(file)
-        file.close()
-        fail = 0
-        ok = 0
-        for data in out:
-            patch = JsonPatch(data['patch'])
-            try:
-                result = patch.apply(data['src'])
-            except (JsonPatchConflict, TypeError, JsonPointerException) as err:
-                print('Comment: ', data['comment'])
-                print('Patch:   ', data['patch'])
-                print('Source:  ', data['src'])
-                print('Dest:    ', data['dst'])
-                print('Error:   ', err)
-                print("FAIL")
-                print("")
-                fail += 1
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'python'))
+
+from json_patch_diff import get_patch
+
+ENGINES = ['perl', 'python']
+FILES = ['files/tests_out.json', 'files/spec_tests_out.json']
+# bytes read from a file at a time
+READ_SIZE = 1 << 16
+# cases and bytes of test cases sent to a worker at a time
+BATCH_CASES = 64
+BATCH_BYTES = 1 << 20
+# batches queued per worker, bounds the memory held by cases waiting for a worker
+BATCHES_PER_WORKER = 2
+
+WHITESPACE = ' \t\n\r'
+# brackets folded into braces, so that str.find and str.count can find where
+# an array or object ends
+FOLD = str.maketrans('[]', '{}')
+# folded text whose strings hold no brackets, which the count would take
+PLAIN = re.compile(r'[^"]*(?:"[^"\\{}]*(?:\\[^{}][^"\\{}]*)*"[^"]*)*')
+# what the scan of any other element stops at, outside of and in strings
+STRUCTURE = re.compile(r'[\[\]{}",]')
+STRING_SPECIAL = re.compile(r'["\\]')
+# the options tests.pl diffs with
+DIFF_OPTIONS = {'use_replace': True, 'use_depth': True}
+
+
+def container_end(folded, pos):
+    """
+    Returns the end of the array or object at pos of folded (a text folded
+    with FOLD), None if it goes on past the text. Brackets in its strings
+    are counted as well
+    """
+    end = pos + 1
+    depth = 1
+    while depth:
+        start = end
+        # it can't end before as many closing brackets as are open
+        for _ in range(depth):
+            end = folded.find('}', end) + 1
+            if not end:
+                return None
+        depth = folded.count('{', start, end)
+    return end
+
+
+def iter_array(file, read_size=READ_SIZE):
+    """
+    Yields the JSON text of the elements of the JSON array in file, holding
+    no more than one element (and a read ahead) in memory. The elements are
+    only scanned for their brackets, braces and strings to find where they
+    end, decoding them is left to the caller (the workers)
+    """
+    buf = folded = ''
+    pos = 0
+    eof = False
+
+    def read():
+        # drops what is before pos and at least doubles the rest, so that a
+        # big element isn't scanned over and over
+        nonlocal buf, folded, pos, eof
+        chunk = file.read(max(read_size, len(buf) - pos))
+        buf = buf[pos:] + chunk
+        folded = folded[pos:] + chunk.translate(FOLD)
+        pos = 0
+        eof = not chunk
+
+    def skip(end):
+        nonlocal pos
+        pos = end
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            read()
+
+    def scan():
+        # the end of the element at pos, token by token
+        depth = 0
+        in_string = False
+        end = pos
+        while True:
+            match = (STRING_SPECIAL if in_string else STRUCTURE).search(buf, end)
+            if match is None or match.group() == '\\' and match.end() == len(buf):
+                if eof:
+                    raise ValueError('truncated JSON array')
+                end = (match.start() if match is not None else len(buf)) - pos
+                read()
                 continue
-            if result == data['dst']:
-                ok += 1
+            char = match.group()
+            end = match.end()
+            if in_string:
+                if char == '"':
+                    in_string = False
+                else:
+                    # the escaped character
+                    end += 1
+            elif char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            elif depth:
+                if char in ']}':
+                    depth -= 1
+            elif char == '}':
+                raise ValueError("unexpected '}' in the JSON array")
             else:
-                fail +=1
-                print('Comment: ', data['comment'])
-                print('Patch:   ', data['patch'])
-                print('Source:  ', data['src'])
-                print('Dest:    ', data['dst'])
-                print('Result:  ', result)
-                print("")
-
-        print("OK    {}".format(ok))
-        if fail > 0: 
-            print("FAIL  {}".format(fail))
-        print("TOTAL {}".format(ok+fail))
-        if fail == 0:
+                end = pos + len(buf[pos:match.start()].rstrip(WHITESPACE))
+                if end == pos:
+                    raise ValueError("expected a value before '{}'".format(char))
+                return end
+
+    if skip(0) != '[':
+        raise ValueError('expected a JSON array')
+    if skip(pos + 1) == ']':
+        return
+    while True:
+        end = None
+        if buf[pos:pos + 1] in ('[', '{'):
+            while True:
+                end = container_end(folded, pos)
+                if end is not None or eof:
+                    break
+                read()
+            # strings holding brackets throw the count off, scan those
+            if end is not None and PLAIN.match(folded, pos, end).end() != end:
+                end = None
+        if end is None:
+            end = scan()
+        yield buf[pos:end]
+        char = skip(end)
+        if char == ']':
+            return
+        if char != ',':
+            raise ValueError("expected ',' or ']' after an element of the JSON array")
+        if pos > read_size:
+            read()
+        skip(pos + 1)
+
+
+def evaluate_case(name, index, text, engines, options):
+    """
+    Applies the patch of each engine to a test case, returns a (record,
+    failure) per engine. The failure is None if the patch gave the
+    destination document
+    """
+    results = []
+    for engine in engines:
+        case = json.loads(text)
+        record = {'file': name, 'index': index, 'comment': case.get('comment'), 'engine': engine}
+        if engine == 'perl':
+            patch = case['patch']
+            # recorded by tests.pl
+            record['diff_ms'] = case.get('diff_ms')
+        else:
+            start = time.perf_counter()
+            patch = get_patch(case['src'], case['dst'], **options)
+            record['diff_ms'] = (time.perf_counter() - start) * 1000
+        record['ops'] = len(patch)
+        record['size'] = len(json.dumps(patch, separators=(',', ':')))
+        error = result = None
+        start = time.perf_counter()
+        try:
+            # in place, so that only the patch is timed and not a copy of the document
+            result = JsonPatch(patch).apply(case['src'], in_place=True)
+        except (JsonPatchConflict, JsonPatchTestFailed, JsonPointerException,
+                TypeError, KeyError, IndexError) as err:
+            error = '{}: {}'.format(type(err).__name__, err)
+        record['apply_ms'] = (time.perf_counter() - start) * 1000
+        record['ok'] = error is None and result == case['dst']
+        if record['ok']:
+            results.append((record, None))
+            continue
+        # src was patched in place
+        case = json.loads(text)
+        failure = dict(record, patch=patch, src=case['src'], dst=case['dst'])
+        if error is None:
+            failure['result'] = result
+        else:
+            failure['error'] = error
+        results.append((record, failure))
+    return results
+
+
+def evaluate_batch(batch, engines, options):
+    return [result for job in batch for result in evaluate_case(*job, engines, options)]
+
+
+def batches(name, file):
+    """
+    Yields the test cases of file in batches of (name, index, text) jobs
+    """
+    batch = []
+    size = 0
+    for index, text in enumerate(iter_array(file)):
+        batch.append((name, index, text))
+        size += len(text)
+        if len(batch) >= BATCH_CASES or size >= BATCH_BYTES:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def evaluate(jobs, pool, pending, engines, options):
+    """
+    Yields the results of the batches of jobs in order, with no more than
+    pending batches submitted to the pool at a time
+    """
+    if pool is None:
+        for batch in jobs:
+            yield evaluate_batch(batch, engines, options)
+        return
+    queue = deque()
+    for batch in jobs:
+        queue.append(pool.apply_async(evaluate_batch, (batch, engines, options)))
+        if len(queue) >= pending:
+            yield queue.popleft().get()
+    while queue:
+        yield queue.popleft().get()
+
+
+class Summary(object):
+    def __init__(self):
+        self.ok = 0
+        self.fail = 0
+        self.ops = 0
+        self.size = 0
+        self.apply_ms = 0.0
+        self.diff_ms = None
+        self.slowest = None
+
+    def add(self, record):
+        if record['ok']:
+            self.ok += 1
+        else:
+            self.fail += 1
+        self.ops += record['ops']
+        self.size += record['size']
+        self.apply_ms += record['apply_ms']
+        if record['diff_ms'] is not None:
+            self.diff_ms = (self.diff_ms or 0.0) + record['diff_ms']
+        if self.slowest is None or record['apply_ms'] > self.slowest['apply_ms']:
+            self.slowest = record
+
+    def show(self):
+        print("OK    {}".format(self.ok))
+        if self.fail > 0:
+            print("FAIL  {}".format(self.fail))
+        print("TOTAL {}".format(self.ok + self.fail))
+        print("OPS   {}, {} bytes".format(self.ops, self.size))
+        if self.diff_ms is not None:
+            print("DIFF  {:.3f} ms".format(self.diff_ms))
+        print("APPLY {:.3f} ms".format(self.apply_ms))
+        if self.slowest is not None:
+            print("SLOWEST #{} {:.3f} ms, {} ops".format(
+                self.slowest['index'], self.slowest['apply_ms'], self.slowest['ops']))
+        if self.fail == 0:
             print("----  OK  -----")
         else:
             print("---- FAIL -----")
+
+
+def compare(summaries):
+    """
+    Prints the patch size, op count and diff time of the python engine
+    relative to the perl one
+    """
+    def ratio(this, that):
+        return '{:.2f}'.format(this / that) if that else 'n/a'
+
+    perl, python = summaries['perl'], summaries['python']
+    print("python / perl: size {}, ops {}, diff time {}".format(
+        ratio(python.size, perl.size), ratio(python.ops, perl.ops),
+        ratio(python.diff_ms, perl.diff_ms or 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', metavar='FILE', nargs='*', default=FILES,
+                        help='test output files of tests.pl (default: {})'.format(' '.join(FILES)))
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes, 0 evaluates in this process (default: %(default)s)')
+    parser.add_argument('-e', '--engine', choices=ENGINES + ['both'], default='perl',
+                        help='diff engine whose patches are evaluated (default: %(default)s)')
+    parser.add_argument('-m', '--use-move', action='store_true',
+                        help='let the python engine move values')
+    parser.add_argument('--cases', metavar='FILE',
+                        help='write the diff and apply time, op count and size of every patch to FILE')
+    parser.add_argument('--failures', metavar='FILE',
+                        help='write the failed cases to FILE')
+    args = parser.parse_args()
+
+    engines = ENGINES if args.engine == 'both' else [args.engine]
+    options = dict(DIFF_OPTIONS, use_move=args.use_move)
+    cases = open(args.cases, 'w') if args.cases else None
+    failures = open(args.failures, 'w') if args.failures else None
+    pool = multiprocessing.Pool(args.jobs) if args.jobs > 0 else None
+    failed = False
+    print("Evaluating results..")
+    try:
+        for name in args.files:
+            print("file: {}".format(name))
+            summaries = dict((engine, Summary()) for engine in engines)
+            with open(name, 'r', encoding='utf-8') as file:
+                for results in evaluate(batches(name, file), pool,
+                                        max(args.jobs, 1) * BATCHES_PER_WORKER, engines, options):
+                    for record, failure in results:
+                        summaries[record['engine']].add(record)
+                        if cases is not None:
+                            cases.write(json.dumps(record) + '\n')
+                        if failure is None:
+                            continue
+                        print('FAIL #{} {} {} {}'.format(record['index'], record['engine'],
+                                                         record['comment'],
+                                                         failure.get('error', 'wrong result')))
+                        if failures is not None:
+                            failures.write(json.dumps(failure) + '\n')
+            for engine in engines:
+                if len(engines) > 1:
+                    print("engine: {}".format(engine))
+                summaries[engine].show()
+                failed = failed or summaries[engine].fail > 0
+            if len(engines) > 1:
+                compare(summaries)
+    finally:
+        if pool is not None:
+            # every result is in by now, unless evaluating was interrupted
+            pool.terminate()
+            pool.join()
+        for file in (cases, failures):
+            if file is not None:
+                file.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Generates a benchmark corpus of JSON document pairs for benchmark.py
+
+Each case is a source document of about --size values, nested --depth levels
+deep with arrays of --array-length elements, and the destination made from it
+by mutating --mutation-rate of its values: inserts, deletes, moves and deep
+edits of scalars, mixed by --mix. The cases are written as a JSON array in the
+format of json-patch-tests (comment, doc, expected, patch), one at a time. The
+patch is the mutations which were made, the reference the size of the patches
+of the engines is measured against.
+"""
+import argparse
+import copy
+import json
+import random
+import sys
+
+# keys of the objects per array element, objects are narrower than arrays
+KEYS_PER_ELEMENT = 0.5
+# chance of going one level deeper when picking a value to mutate
+DESCEND = 0.75
+MUTATIONS = ['insert', 'delete', 'move', 'edit']
+# tries per mutation to find something to mutate
+ATTEMPTS = 10
+
+
+def escape(token):
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def pointer(path):
+    return ''.join('/' + escape(token) for token in path)
+
+
+class Generator(object):
+    def __init__(self, rng, depth, array_length):
+        self.rng = rng
+        self.depth = depth
+        self.array_length = array_length
+        self.keys = max(int(array_length * KEYS_PER_ELEMENT), 1)
+        self.serial = 0
+
+    def scalar(self):
+        kind = self.rng.random()
+        if kind < 0.4:
+            return self.rng.randint(-1000, 1000)
+        if kind < 0.8:
+            return 'v{}'.format(self.rng.randint(0, 10 ** 6))
+        if kind < 0.9:
+            return self.rng.random() * 1000
+        return self.rng.choice([True, False, None])
+
+    def key(self):
+        self.serial += 1
+        return 'k{}'.format(self.serial)
+
+    def value(self, size, depth=0):
+        """
+        Returns a value of about size scalars and containers
+        """
+        if size <= 1 or depth >= self.depth:
+            return self.scalar()
+        if self.rng.random() < 0.5:
+            width = min(self.array_length, size - 1)
+            return [self.value((size - 1) // width, depth + 1) for _ in range(width)]
+        width = min(self.keys, size - 1)
+        return dict((self.key(), self.value((size - 1) // width, depth + 1))
+                    for _ in range(width))
+
+    def pick(self, document, containers=True):
+        """
+        Returns the path of a random value of document, a container if
+        containers is True, else a scalar (None if there is none on the way)
+        """
+        path = []
+        value = document
+        while isinstance(value, (dict, list)) and value:
+            if containers and self.rng.random() > DESCEND:
+                break
+            key = self.rng.choice(list(value)) if isinstance(value, dict) \
+                else self.rng.randrange(len(value))
+            child = value[key]
+            if containers and not isinstance(child, (dict, list)):
+                break
+            path.append(key)
+            value = child
+        if not containers and isinstance(value, (dict, list)):
+            return None
+        return path
+
+    def mutate(self, document, kind):
+        """
+        Makes a mutation of kind in document, returns its JSON Patch operation
+        or None if there was nothing to mutate
+        """
+        if kind == 'edit':
+            path = self.pick(document, containers=False)
+            if not path:
+                return None
+            value = self.scalar()
+            resolve(document, path[:-1])[path[-1]] = value
+            return {'op': 'replace', 'path': pointer(path), 'value': value}
+        path = self.pick(document)
+        container = resolve(document, path)
+        if kind == 'insert':
+            value = self.value(self.rng.randint(1, self.array_length))
+            if isinstance(container, list):
+                index = self.rng.randint(0, len(container))
+                container.insert(index, value)
+            else:
+                index = self.key()
+                container[index] = value
+            # later mutations may change the inserted value, not the operation
+            return {'op': 'add', 'path': pointer(path + [index]), 'value': copy.deepcopy(value)}
+        if not container:
+            return None
+        if kind == 'delete':
+            if isinstance(container, list):
+                index = self.rng.randrange(len(container))
+            else:
+                index = self.rng.choice(list(container))
+            del container[index]
+            return {'op': 'remove', 'path': pointer(path + [index])}
+        # move, to another place in the same array or to a new key
+        if isinstance(container, list):
+            source = self.rng.randrange(len(container))
+            value = container.pop(source)
+            target = self.rng.randint(0, len(container))
+            container.insert(target, value)
+        else:
+            source = self.rng.choice(list(container))
+            target = self.key()
+            container[target] = container.pop(source)
+        return {'op': 'move', 'from': pointer(path + [source]), 'path': pointer(path + [target])}
+
+
+def resolve(document, path):
+    for token in path:
+        document = document[token]
+    return document
+
+
+def count(value):
+    if isinstance(value, dict):
+        return 1 + sum(count(item) for item in value.values())
+    if isinstance(value, list):
+        return 1 + sum(count(item) for item in value)
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='corpus file (default: stdout)')
+    parser.add_argument('-n', '--cases', type=int, default=100,
+                        help='document pairs (default: %(default)s)')
+    parser.add_argument('-s', '--size', type=int, default=1000,
+                        help='values of a source document, about (default: %(default)s)')
+    parser.add_argument('-d', '--depth', type=int, default=4,
+                        help='nesting depth of the documents (default: %(default)s)')
+    parser.add_argument('-a', '--array-length', type=int, default=20,
+                        help='elements of the arrays (default: %(default)s)')
+    parser.add_argument('-r', '--mutation-rate', type=float, default=0.01,
+                        help='mutations per value of the source document (default: %(default)s)')
+    parser.add_argument('-m', '--mix', type=float, nargs=4, default=[1, 1, 1, 1],
+                        metavar=('INSERTS', 'DELETES', 'MOVES', 'EDITS'),
+                        help='relative weights of the mutations (default: 1 1 1 1)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    generator = Generator(rng, args.depth, args.array_length)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        output.write('[')
+        for index in range(args.cases):
+            # an object at the top, so that no mutation replaces the whole document
+            doc = {'root': generator.value(args.size)}
+            expected = copy.deepcopy(doc)
+            mutations = max(int(round(count(doc) * args.mutation_rate)), 1)
+            patch = []
+            # a document can run out of values to delete or move
+            for _ in range(mutations * ATTEMPTS):
+                if len(patch) >= mutations:
+                    break
+                kind = rng.choices(MUTATIONS, weights=args.mix)[0]
+                operation = generator.mutate(expected, kind)
+                if operation is not None:
+                    patch.append(operation)
+            case = {'comment': 'size {} depth {} array {} mutations {} seed {} #{}'.format(
+                        args.size, args.depth, args.array_length, len(patch), args.seed, index),
+                    'doc': doc, 'expected': expected, 'patch': patch}
+            output.write(',\n' if index else '\n')
+            json.dump(case, output, separators=(',', ':'))
+        output.write('\n]\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
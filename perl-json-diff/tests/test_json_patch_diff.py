@@ -0,0 +1,122 @@
+"""
+Tests of python/json_patch_diff.py, run with pytest from tests/
+"""
+import copy
+import os
+import random
+import sys
+
+import jsonpatch
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'python'))
+
+from json_patch_diff import get_patch, common_subsequence
+
+OPTIONS = [{}, {'use_replace': True}, {'use_depth': True}, {'use_move': True},
+           {'use_depth': True, 'use_move': True}, {'keep_old': True}]
+
+# values whose hashes collide, hash(-1) == hash(-2) in CPython
+COLLISIONS = [
+    ([-1], [-2]),
+    ([1, -1, 3], [1, -2, 3]),
+    ({'a': [-1]}, {'a': [-2]}),
+    ([[-1]], [[-2]]),
+    ([-1, -2], [-2, -1]),
+]
+
+
+def check(src, dst, options):
+    original = copy.deepcopy(src)
+    patch = get_patch(src, dst, **options)
+    assert src == original
+    assert jsonpatch.apply_patch(copy.deepcopy(src), patch) == dst
+    return patch
+
+
+@pytest.mark.parametrize('src, dst', COLLISIONS)
+@pytest.mark.parametrize('options', OPTIONS)
+def test_hash_collisions(src, dst, options):
+    assert check(src, dst, options)
+
+
+def test_types_differ():
+    assert get_patch({'a': 1}, {'a': '1'}) == [{'op': 'replace', 'path': '/a', 'value': '1'}]
+    assert get_patch([1], [True]) != []
+
+
+def test_move():
+    patch = get_patch({'a': [1, 2, 3], 'b': {'c': 1}}, {'a': [2, 3, 1], 'd': {'c': 1}},
+                      use_move=True)
+    assert patch == [{'op': 'move', 'from': '/a/0', 'path': '/a/2'},
+                     {'op': 'move', 'from': '/b', 'path': '/d'}]
+
+
+def lcs_length(src, dst):
+    previous = [0] * (len(dst) + 1)
+    for x in src:
+        current = [0]
+        for j, y in enumerate(dst):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def test_common_subsequence():
+    rng = random.Random(0)
+    for _ in range(2000):
+        src = [rng.randint(0, 4) for _ in range(rng.randint(0, 30))]
+        dst = [rng.randint(0, 4) for _ in range(rng.randint(0, 30))]
+        matches = common_subsequence(src, dst)
+        assert len(matches) == lcs_length(src, dst)
+        assert all(src[i] == dst[j] for i, j in matches)
+        assert all(a[0] < b[0] and a[1] < b[1] for a, b in zip(matches, matches[1:]))
+
+
+def document(rng, depth=0):
+    if depth > 3 or rng.random() < 0.3:
+        return rng.choice([0, 1, -1, -2, '1', 'a', True, False, None, 1.5, [], {}])
+    if rng.random() < 0.5:
+        return [document(rng, depth + 1) for _ in range(rng.randint(0, 6))]
+    return dict((rng.choice('abcdef/~'), document(rng, depth + 1))
+                for _ in range(rng.randint(0, 5)))
+
+
+def mutate(rng, value, depth=0):
+    value = copy.deepcopy(value)
+    if isinstance(value, list):
+        for _ in range(rng.randint(0, 3)):
+            kind = rng.random()
+            if kind < 0.3 and value:
+                value.pop(rng.randrange(len(value)))
+            elif kind < 0.5:
+                value.insert(rng.randint(0, len(value)), document(rng, depth + 1))
+            elif kind < 0.7 and value:
+                value.insert(rng.randint(0, len(value) - 1), value.pop(rng.randrange(len(value))))
+            elif value:
+                index = rng.randrange(len(value))
+                value[index] = mutate(rng, value[index], depth + 1)
+        return value
+    if isinstance(value, dict):
+        for _ in range(rng.randint(0, 3)):
+            kind = rng.random()
+            if kind < 0.3 and value:
+                value.pop(rng.choice(list(value)))
+            elif kind < 0.5:
+                value[rng.choice('abcdefg')] = document(rng, depth + 1)
+            elif kind < 0.7 and value:
+                value[rng.choice('xyz')] = value.pop(rng.choice(list(value)))
+            elif value:
+                key = rng.choice(list(value))
+                value[key] = mutate(rng, value[key], depth + 1)
+        return value
+    return document(rng, depth) if rng.random() < 0.5 else value
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_random_documents(options):
+    rng = random.Random(1)
+    for _ in range(2000):
+        src = document(rng)
+        dst = mutate(rng, src) if rng.random() < 0.8 else document(rng)
+        check(src, dst, options)
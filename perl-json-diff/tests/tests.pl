@@ -12,6 +12,7 @@ use warnings;
 use JSON;
 use Data::Compare;
 use Data::Dumper;
+use Time::HiRes qw(time);
 use feature 'say';
 
 ## set JSON OO interface
@@ -87,7 +88,9 @@ foreach my $test_file (@test_files) {
             my $patch = @{$test}{patch};
             my $patch_text = $json->pretty->encode($patch);
             my $comment_text = $json->encode(@{$test}{comment});
+            my $start = time;
             my $diff = JSON::Patch::Diff::GetPatch($src, $dst, {'keep_old'=>0, 'use_replace'=>1, 'use_depth'=>1});
+            my $diff_ms = (time - $start) * 1000;
             my $result_patch = $json->pretty->encode($diff);
 
             # I am calling $json->decode below to avoid a strange bug, where numbers
@@ -95,7 +98,8 @@ foreach my $test_file (@test_files) {
             push @{$out_json}, {"comment" => $comment_text, 
                                 "src" => $json->decode($src_text),
                                 "dst" => $json->decode($dst_text),
-                                "patch" => $diff}; 
+                                "patch" => $diff,
+                                "diff_ms" => $diff_ms}; 
 
             #TODO: Use Data::Compare JSON extension
             if (Compare($patch, $diff)) {